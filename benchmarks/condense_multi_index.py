@@ -0,0 +1,64 @@
+"""
+Benchmark of `ImportedPiece.condenseMultiIndex` against the per-offset loop it
+used before it took one groupby pass.
+
+The tables are synthetic: 6 voices with overlapping First/Last windows, about
+three rows per Last offset, like the ngram tables that cvfs and cadences
+condense. Run it from the root of the repository with:
+
+    python -m benchmarks.condense_multi_index
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from music21 import metadata, note, stream
+
+from crim_intervals.main_objs import ImportedPiece
+
+SIZES = (100, 400, 1600, 6400)
+
+
+def loop_condense(df, to_drop=0):
+    """
+    Return `df` condensed the way `condenseMultiIndex` used to do it, one
+    duplicated offset at a time.
+    """
+    ret = df.droplevel(to_drop)
+    dup_mask = ret.index.duplicated()
+    dups = ret.index[dup_mask]
+    ret = ret[~dup_mask]
+    for dup in dups:
+        filled = df.loc[(slice(None), dup), :].infer_objects(copy=False).ffill()
+        ret.loc[dup, :] = filled.iloc[-1, :].values
+    return ret
+
+
+def make_table(rows, rng):
+    last = np.sort(rng.integers(0, rows // 3, rows)).astype(float)
+    first = last - rng.integers(1, 8, rows)
+    values = rng.choice(np.array(['C', 'T', 'B', 'A', np.nan], dtype=object), (rows, 6))
+    index = pd.MultiIndex.from_arrays([first, last], names=['First', 'Last'])
+    return pd.DataFrame(values, index=index, columns=list('SATBQR')).sort_index(level=1)
+
+
+def main():
+    score = stream.Score([stream.Part([note.Note('C4')])])
+    score.insert(0, metadata.Metadata(title='Benchmark'))
+    piece = ImportedPiece(score, 'benchmark')
+    rng = np.random.default_rng(0)
+    print('      rows     loop   groupby')
+    for rows in SIZES:
+        df = make_table(rows, rng)
+        start = time.perf_counter()
+        old = loop_condense(df)
+        loop = time.perf_counter() - start
+        start = time.perf_counter()
+        new = piece.condenseMultiIndex(df)
+        grouped = time.perf_counter() - start
+        pd.testing.assert_frame_equal(new, old.mask(old.isna()), check_dtype=False)
+        print('{:>10} {:>7.3f}s {:>8.3f}s'.format(rows, loop, grouped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark of `importScore` with and without the score cache.
+
+For each score passed on the command line (MEI or MusicXML files), its text
+is imported the way remote scores and MEI files are: parsed by music21
+without any cache, imported for the first time into an empty score cache
+(cold), and imported again from that cache (warm). Each time is the best of
+`REPEATS` runs. Run it from the root of the repository with:
+
+    python -m benchmarks.score_cache path/to/score.mei ...
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+from music21 import converter
+
+from crim_intervals.main_objs import importScore, pathDict
+
+REPEATS = 3
+
+
+def best(run):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def import_text(text, cache_dir):
+    importScore(text, cache_dir=cache_dir)
+    del pathDict[text]
+
+
+def cold_import(text):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        import_text(text, cache_dir)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def main(paths):
+    print('{:<40} {:>8} {:>8} {:>8}'.format('score', 'parse', 'cold', 'warm'))
+    for path in paths:
+        with open(path) as file:
+            text = file.read()
+        parse = best(lambda: converter.parse(text))
+        cold = min(cold_import(text) for _ in range(REPEATS))
+        cache_dir = tempfile.mkdtemp()
+        try:
+            import_text(text, cache_dir)
+            warm = best(lambda: import_text(text, cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+        print('{:<40} {:>7.3f}s {:>7.3f}s {:>7.3f}s'.format(path.rsplit('/', 1)[-1][:40], parse, cold, warm))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,483 @@
+"""
+Bounded cache for the analyses of pieces.
+
+`ImportedPiece.analyses` (and `CorpusBase.analyses`) hold every table a piece
+has computed, so that asking for the same thing twice is instant. They used
+to be plain dicts that grew for as long as the process lived, which a
+long-running session trying many parameter combinations can't afford.
+`AnalysisCache` is a drop-in replacement for those dicts that keeps track of
+the approximate size in bytes of each entry and evicts the least recently
+used entries once a budget is exceeded:
+
+* each cache has its own budget, `max_bytes`, which defaults to
+  `MAX_PIECE_BYTES`
+* all the caches in the process share a budget of `MAX_TOTAL_BYTES`, and
+  when it's exceeded the least recently used entries of any cache go first
+* entries older than `ttl` seconds (`TTL` by default) are dropped when they
+  are next looked up
+
+Any of these can be None for no limit. Evicted analyses are simply computed
+again when they're next needed. The entry just stored is never evicted by
+that store, but the next store into any cache, maybe from another thread, can
+evict it, so methods return the value they computed rather than reading it
+back, and read cached analyses with `get`, which is atomic, rather than with
+`in` followed by `[]`.
+
+Sizes are estimates: pandas objects and numpy arrays are measured by their
+buffers, containers by their items, and other objects by `sys.getsizeof`,
+which doesn't follow their references. music21 objects, wherever they are,
+count `M21_OBJECT_BYTES` each (streams count that for each of their elements
+too), since `sys.getsizeof` misses nearly all of what a note holds. Tables
+sharing the same music21 objects each count them in full. The objects in
+object columns and arrays are measured on a sample of `SIZE_SAMPLE` of them,
+so that storing a big table doesn't mean visiting every cell. Sizes are taken
+when an entry is stored.
+
+Use `ImportedPiece.cache_info` and `ImportedPiece.clear_cache` to inspect and
+empty the cache of a piece, or `cache_info` and `clear_cache` here for all of
+them at once.
+
+Methods with parameters are cached with the `memoize` decorator, which names
+the analysis and the analyses it is computed from, and derives the key from
+the arguments in the order of the method's signature, e.g.
+`('MelodicIntervals', 'q', True, True, True)`, so that every call with the
+same arguments finds the same entry. The inputs of each analysis, whether
+declared by `memoize` or with `declare`, make up a graph of which analyses
+depend on which, and `AnalysisCache.invalidate` uses it to drop an analysis
+along with everything derived from it.
+
+Public methods like `ImportedPiece.notes` hand out copies of cached tables so
+that callers can modify them, while the methods of the package read the
+cached tables themselves. With pandas' copy-on-write mode turned on,
+`pd.set_option('mode.copy_on_write', True)`, those copies are shallow: they
+share the cache's buffers and only copy them if they're modified.
+"""
+import fnmatch
+import functools
+import inspect
+import itertools
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import numpy as np
+import pandas as pd
+from music21 import base, stream
+
+# default budget of each cache, in bytes
+MAX_PIECE_BYTES = 512 * 2 ** 20
+# budget shared by all the caches in the process, in bytes
+MAX_TOTAL_BYTES = 4 * 2 ** 30
+# default number of seconds before an entry expires
+TTL = None
+# estimated size of a music21 note, rest or other object with its pitch,
+# duration and other attributes, in bytes
+M21_OBJECT_BYTES = 6 * 2 ** 10
+# number of items of an object column or array measured to estimate its size
+SIZE_SAMPLE = 256
+
+# caches and their sizes are shared by the threads of `CorpusBase.batch`
+_lock = threading.RLock()
+_caches = weakref.WeakValueDictionary()  # id: cache
+_clock = itertools.count()  # order of use across all caches
+_total = [0]  # bytes held by all the caches
+_inputs = {}  # name: names of the analyses it is computed from
+
+
+def _objectBytes(values):
+    """
+    Return the estimated size of the objects in the object array `values`,
+    extrapolated from up to `SIZE_SAMPLE` evenly spaced items: their
+    `sys.getsizeof`, plus `M21_OBJECT_BYTES` for each music21 object.
+    """
+    values = values.ravel()
+    if len(values) > SIZE_SAMPLE:
+        sample = values[np.linspace(0, len(values) - 1, SIZE_SAMPLE).astype('int64')]
+    else:
+        sample = values
+    if not len(sample):
+        return 0
+    size = sum(M21_OBJECT_BYTES if isinstance(item, base.Music21Object) else sys.getsizeof(item)
+               for item in sample)
+    return size * len(values) // len(sample)
+
+
+def sizeof(value, _depth=0):
+    """
+    Return an estimate of the memory held by `value`, in bytes.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=False)
+        size = int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        for i, dtype in enumerate(frame.dtypes):
+            if dtype == object:
+                size += _objectBytes(frame.iloc[:, i].to_numpy())
+        if value.index.dtype == object and not isinstance(value.index, pd.MultiIndex):
+            size += _objectBytes(value.index.to_numpy())
+        return size
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        size = value.nbytes
+        if value.dtype == object and _depth < 3:
+            size += _objectBytes(value)
+        return size
+    if isinstance(value, stream.Stream):
+        return M21_OBJECT_BYTES * (1 + sum(1 for _ in value.recurse(includeSelf=False)))
+    if isinstance(value, base.Music21Object):
+        return M21_OBJECT_BYTES
+    size = sys.getsizeof(value)
+    if _depth < 3:
+        if isinstance(value, dict):
+            size += sum(sizeof(k, _depth + 1) + sizeof(v, _depth + 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(sizeof(item, _depth + 1) for item in value)
+    return size
+
+
+def _name(key):
+    """
+    Return the name that `clear_cache` patterns are matched against, i.e. the
+    key itself for string keys and the first item of tuple keys like
+    `('PresentationTypes', 'd', ...)`.
+    """
+    if isinstance(key, tuple) and key and isinstance(key[0], str):
+        return key[0]
+    return key if isinstance(key, str) else str(key)
+
+
+def declare(graph):
+    """
+    Record that each analysis named in the dict `graph` is computed from the
+    analyses in its value, a tuple of names.
+    """
+    with _lock:
+        for name, inputs in graph.items():
+            _inputs.setdefault(name, set()).update(inputs)
+
+
+def dependents(*names):
+    """
+    Return the set of `names` and of the analyses computed from any of them,
+    directly or not.
+    """
+    with _lock:
+        found = set(names)
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            for other, inputs in _inputs.items():
+                if name in inputs and other not in found:
+                    found.add(other)
+                    todo.append(other)
+        return found
+
+
+def copy_on_write():
+    """
+    Return whether pandas' copy-on-write mode is on, so that shallow copies
+    of cached tables can't modify them.
+    """
+    return pd.get_option('mode.copy_on_write') is True
+
+
+def share(value):
+    """
+    Return a copy of the cached df or series `value` for a caller that may
+    modify it: a shallow one in copy-on-write mode, and a deep one otherwise.
+    """
+    return value.copy(deep=not copy_on_write())
+
+
+def _isSet(value):
+    if isinstance(value, (bool, int, float)):
+        return bool(value)
+    return value is not None
+
+
+def memoize(name, inputs=(), uncached=(), canonical=None, copy=False):
+    """
+    Decorator caching the results of a method of an object with an `analyses`
+    cache under the key `(name, arg1, arg2, ...)`, with the arguments in the
+    order of the method's signature and defaults filled in.
+
+    * `inputs` are the names of the analyses the method uses, see `declare`
+    * calls are neither cached nor looked up when any of the `uncached`
+      parameters, like a `df` to use instead of the piece's own, is given a
+      value other than None, False or 0; these aren't part of the key
+    * `canonical` maps parameters to functions putting their values in a
+      standard form for the key, e.g. `str.lower`
+    * with `copy`, each call gets a copy of the cached result (see `share`)
+
+    Calls whose key can't be hashed, and results that are None, aren't cached.
+    """
+    declare({name: tuple(inputs)})
+    canonical = canonical or {}
+
+    def decorator(method):
+        signature = inspect.signature(method)
+        params = [param for param in list(signature.parameters)[1:] if param not in uncached]
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            if any(_isSet(arguments[param]) for param in uncached):
+                return method(self, *args, **kwargs)
+            key = (name,) + tuple(canonical[param](arguments[param]) if param in canonical
+                                  else arguments[param] for param in params)
+            try:
+                hash(key)
+            except TypeError:
+                return method(self, *args, **kwargs)
+            res = self.analyses.get(key)
+            if res is None:
+                res = method(self, *args, **kwargs)
+                if res is None:
+                    return res
+                self.analyses[key] = res
+            return share(res) if copy else res
+        return wrapper
+    return decorator
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'stored', 'used')
+
+    def __init__(self, value, size, stored, used):
+        self.value = value
+        self.size = size
+        self.stored = stored
+        self.used = used
+
+
+class AnalysisCache(MutableMapping):
+    """
+    Dict-like cache of analyses, bounded by `max_bytes` (`MAX_PIECE_BYTES` if
+    None) and `ttl` (`TTL` if None), and by the process-wide `MAX_TOTAL_BYTES`.
+    Pass 0 to either to turn that limit off for this cache.
+    """
+    def __init__(self, data=None, max_bytes=None, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()  # least recently used first
+        with _lock:
+            _caches[id(self)] = self
+        if data:
+            self.update(data)
+
+    def __getstate__(self):
+        return {'data': {key: entry.value for key, entry in self._entries.items()},
+                'max_bytes': self.max_bytes, 'ttl': self.ttl}
+
+    def __setstate__(self, state):
+        self.__init__(state['data'], state['max_bytes'], state['ttl'])
+
+    def __del__(self):
+        try:
+            with _lock:
+                _total[0] -= self.bytes
+        except Exception:
+            pass
+
+    def _limit(self, value, default):
+        if value is None:
+            return default
+        return value or None
+
+    def _expired(self, entry):
+        ttl = self._limit(self.ttl, TTL)
+        return ttl is not None and time.monotonic() - entry.stored > ttl
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        _total[0] -= entry.size
+
+    def _evict(self, keep):
+        """
+        Drop expired entries, then least recently used ones until this cache and
+        all the caches together are within budget, never dropping `keep`.
+        """
+        if self._limit(self.ttl, TTL) is not None:
+            for key in [key for key, entry in self._entries.items() if key != keep and self._expired(entry)]:
+                self._drop(key)
+                self.evictions += 1
+        max_bytes = self._limit(self.max_bytes, MAX_PIECE_BYTES)
+        if max_bytes is not None:
+            for key in [key for key in self._entries if key != keep]:
+                if self.bytes <= max_bytes:
+                    break
+                self._drop(key)
+                self.evictions += 1
+        while MAX_TOTAL_BYTES is not None and _total[0] > MAX_TOTAL_BYTES:
+            # the least recently used entry of any cache, other than the one just stored
+            oldest = None
+            for cache in list(_caches.values()):
+                for key, entry in cache._entries.items():
+                    if cache is self and key == keep:
+                        continue
+                    if oldest is None or entry.used < oldest[2]:
+                        oldest = (cache, key, entry.used)
+                    break
+            if oldest is None:
+                break
+            oldest[0]._drop(oldest[1])
+            oldest[0].evictions += 1
+
+    def _live(self, key):
+        """
+        Return the entry of `key`, or None if there is none or it has expired, in
+        which case it's dropped. Call with `_lock` held.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry):
+            self._drop(key)
+            self.evictions += 1
+            entry = None
+        return entry
+
+    def _lookup(self, key):
+        """
+        Return the live entry of `key` marked as just used, or None, counting a
+        hit or a miss. Call with `_lock` held.
+        """
+        entry = self._live(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry.used = next(_clock)
+        self._entries.move_to_end(key)
+        return entry
+
+    def __getitem__(self, key):
+        with _lock:
+            entry = self._lookup(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry.value
+
+    def __setitem__(self, key, value):
+        size = sizeof(value)
+        with _lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(value, size, time.monotonic(), next(_clock))
+            self.bytes += size
+            _total[0] += size
+            self._evict(keep=key)
+
+    def __delitem__(self, key):
+        with _lock:
+            self._drop(key)
+
+    def __contains__(self, key):
+        with _lock:
+            if self._live(key) is None:
+                # hits are counted when the entry is then read
+                self.misses += 1
+                return False
+            return True
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<AnalysisCache: {} entries, {} bytes>'.format(len(self), self.bytes)
+
+    def get(self, key, default=None):
+        """
+        Return the value of `key`, or `default` if it isn't cached, in one step
+        that can't be interleaved with an eviction.
+        """
+        with _lock:
+            entry = self._lookup(key)
+        return default if entry is None else entry.value
+
+    def setdefault(self, key, default=None):
+        with _lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry.value
+            self[key] = default
+            return default
+
+    def clear(self, pattern=None):
+        """
+        Remove the entries whose name (see `_name`) matches the shell-style
+        `pattern`, e.g. "Melodic*", or all of them if `pattern` is None. Return
+        the number of entries removed.
+        """
+        with _lock:
+            keys = [key for key in self._entries if pattern is None or fnmatch.fnmatchcase(_name(key), pattern)]
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def invalidate(self, *names):
+        """
+        Remove the entries of the analyses in `names`, like "PartSeries", and of
+        every analysis computed from them (see `dependents`), e.g. after
+        changing the score they were computed from. Return the number of
+        entries removed.
+        """
+        with _lock:
+            stale = dependents(*names)
+            keys = [key for key in self._entries if _name(key) in stale]
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def info(self):
+        """
+        Return a dict summarizing the cache: its number of entries, their total
+        size in bytes, its limits, and its hit, miss and eviction counts.
+        """
+        return {'entries': len(self), 'bytes': self.bytes,
+                'max_bytes': self._limit(self.max_bytes, MAX_PIECE_BYTES),
+                'ttl': self._limit(self.ttl, TTL),
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def entries(self):
+        """
+        Return a df with a row for each entry, from least to most recently used,
+        giving its key, its name, its size in bytes and its age in seconds.
+        """
+        with _lock:
+            now = time.monotonic()
+            rows = [(key, _name(key), entry.size, now - entry.stored) for key, entry in self._entries.items()]
+        return pd.DataFrame(rows, columns=['Key', 'Name', 'Bytes', 'Age'])
+
+
+def cache_info():
+    """
+    Return a dict summarizing all the caches in the process: how many there
+    are, their total number of entries and size in bytes, and the shared limit.
+    """
+    with _lock:
+        caches = list(_caches.values())
+        return {'caches': len(caches), 'entries': sum(len(cache) for cache in caches),
+                'bytes': _total[0], 'max_bytes': MAX_TOTAL_BYTES}
+
+
+def clear_cache(pattern=None):
+    """
+    Remove the entries matching `pattern` (see `AnalysisCache.clear`) from all
+    the caches in the process, or all entries if `pattern` is None. Return the
+    number of entries removed.
+    """
+    with _lock:
+        return sum(cache.clear(pattern) for cache in list(_caches.values()))
@@ -0,0 +1,100 @@
+"""
+Matching of cadential voice function (CVF) patterns.
+
+Each pattern in `data/cadences/CVFLabels.csv` is a regular expression for a
+module ngram like "7_1:-2, 6_-2:2, 8", anchored at its start, with one
+sub-pattern per token between the ", " separators. `PatternMatcher` splits
+the patterns into those tokens once. An ngram then matches a pattern when
+each of its tokens matches the pattern's token in the same position, so
+instead of running every pattern over every ngram, each distinct token is
+tested once against the token patterns of its position, giving a row of
+booleans over the patterns, and the rows of an ngram's tokens are and-ed
+together with numpy. The token tests are remembered across pieces, since a
+corpus only has a few hundred distinct module tokens.
+
+This reproduces what `cvfs` used to get from running the whole alternation of
+patterns over every ngram and then `replace`-ing each hit with the pattern it
+matched: a pattern only applies to ngrams with as many tokens as it has, the
+first pattern in the table wins, and its last token only needs to match the
+start of the ngram's last token.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+SEPARATOR = ', '
+
+
+class PatternMatcher:
+    """
+    Multi-pattern matcher built once from a sequence of `patterns` like the
+    index of the CVF table, and reused for every piece.
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        # token counts of the patterns, in order of first appearance
+        self.lengths = []
+        # token count: positions in `patterns` of the patterns with that many tokens
+        self._positions = {}
+        # (token count, token position): compiled token patterns of those patterns
+        self._columns = {}
+        # (token count, token position, token): booleans over those patterns
+        self._masks = {}
+        split = [(pattern[1:] if pattern.startswith('^') else pattern).split(SEPARATOR)
+                 for pattern in self.patterns]
+        compiled = {}
+        for position, tokens in enumerate(split):
+            if len(tokens) not in self._positions:
+                self.lengths.append(len(tokens))
+                self._positions[len(tokens)] = []
+            self._positions[len(tokens)].append(position)
+        for n, positions in self._positions.items():
+            for k in range(n):
+                self._columns[(n, k)] = [compiled.setdefault(split[p][k], re.compile(split[p][k]))
+                                         for p in positions]
+            self._positions[n] = np.array(positions)
+
+    def _mask(self, n, k, token):
+        key = (n, k, token)
+        if key not in self._masks:
+            if k == n - 1:
+                self._masks[key] = np.array([regex.match(token) is not None for regex in self._columns[(n, k)]])
+            else:
+                self._masks[key] = np.array([regex.fullmatch(token) is not None for regex in self._columns[(n, k)]])
+        return self._masks[key]
+
+    def _key(self, n, position, last_token):
+        """
+        Return the key of a hit on the pattern at `position`. When its last token
+        only matched the start of `last_token`, the key keeps the unmatched end,
+        just as substituting the pattern into the ngram would.
+        """
+        pattern = self.patterns[position]
+        end = self._columns[(n, n - 1)][np.searchsorted(self._positions[n], position)].match(last_token).end()
+        return pattern + last_token[end:]
+
+    def match(self, ngrams):
+        """
+        Return an object array with, for each of the `ngrams` strings, the
+        pattern that matches it, or None where none does.
+        """
+        codes, uniques = pd.factorize(np.asarray(ngrams, dtype=object))
+        # code -1 (missing ngrams) picks the None in the last slot
+        keys = np.full(len(uniques) + 1, None, dtype=object)
+        tokens = [ngram.split(SEPARATOR) for ngram in uniques]
+        lengths = np.array([len(toks) for toks in tokens], dtype='int64')
+        for n in self.lengths:
+            rows = np.flatnonzero(lengths == n)
+            if not len(rows):
+                continue
+            hits = np.ones((len(rows), len(self._positions[n])), dtype=bool)
+            for k in range(n):
+                token_codes, token_uniques = pd.factorize(np.array([tokens[row][k] for row in rows], dtype=object))
+                masks = np.array([self._mask(n, k, token) for token in token_uniques])
+                hits &= masks[token_codes]
+            found = hits.any(axis=1)
+            first = self._positions[n][hits.argmax(axis=1)]
+            for row, position in zip(rows[found], first[found]):
+                keys[row] = self._key(n, position, tokens[row][-1])
+        return keys[codes]
@@ -0,0 +1,223 @@
+"""
+Arithmetic interval labels.
+
+`ImportedPiece.melodic` and `ImportedPiece.harmonic` label intervals with
+strings like "M3", "-5", or "7" according to a `(kind, directed, compound)`
+setting (see `ImportedPiece._intervalMethods`). This module computes those
+same strings straight from the diatonic step and pitch-space value of the two
+notes, instead of building a `music21.interval.Interval` for every pair and
+reading its names.
+
+The arithmetic follows music21's conventions, including their quirks: the
+direction of an interval is the sign of its semitones, qualities are counted
+against the generic direction (so C#4 to C4 is a diminished unison), and the
+labels without quality drop only the first character of the music21 name (so
+"AA4" becomes "A4"). Pairs outside what the arithmetic covers, i.e.
+microtones and qualities beyond quadruply augmented or diminished, fall back
+to music21.
+
+Labels are kept in a process-wide table keyed by the pair of note names, e.g.
+`("E-4", "C5")`, holding every flavour at once. The pitch gamut of a corpus is
+small, so after the first few pieces nearly every pair is a lookup. The table
+is bounded by `MAX_CACHED_PAIRS`, dropping the oldest pairs once it is full.
+"""
+import itertools
+
+import numpy as np
+from music21 import interval, pitch
+
+# every (kind, directed, compound) setting in `ImportedPiece._intervalMethods`
+SETTINGS = (
+    ('q', True, True), ('q', True, False), ('q', False, True), ('q', False, False),
+    ('d', True, True), ('d', True, False), ('d', True, 'simple'), ('d', False, True), ('d', False, False),
+    ('c', True, True), ('c', True, False), ('c', False, True), ('c', False, False),
+)
+# the labels stored for each pair: every setting, plus music21's `directedName` (e.g. "P-4")
+FLAVOURS = SETTINGS + ('directedName',)
+_POSITIONS = {flavour: i for i, flavour in enumerate(FLAVOURS)}
+MAX_CACHED_PAIRS = 2 ** 16
+# (low name, high name): tuple of labels in the order of FLAVOURS
+_table = {}
+# semitones in the perfect or major form of each simple generic interval
+_BASE_SEMITONES = np.array([0, 0, 2, 4, 5, 7, 9, 11])
+_PERFECT = np.array([False, True, False, False, True, True, False, False])
+# music21 stops at quadruply augmented/diminished
+_MAX_ALTERATION = 4
+
+
+def pitch_values(names):
+    """
+    Return arrays of the diatonic step numbers (music21's `diatonicNoteNum`) and
+    pitch-space values of the note `names`, e.g. "C#4".
+    """
+    pitches = [pitch.Pitch(name) for name in names]
+    diatonic = np.array([p.diatonicNoteNum for p in pitches], dtype='int64')
+    ps = np.array([p.ps for p in pitches], dtype='float64')
+    return diatonic, ps
+
+
+def _quality(perfect, alteration):
+    if perfect:
+        if alteration == 0:
+            return 'P'
+        return 'A' * alteration if alteration > 0 else 'd' * -alteration
+    if alteration == 0:
+        return 'M'
+    if alteration == -1:
+        return 'm'
+    return 'A' * alteration if alteration > 0 else 'd' * (-alteration - 1)
+
+
+def components(low_diatonic, low_ps, high_diatonic, high_ps):
+    """
+    Return arrays describing the intervals from the low notes to the high notes
+    (i.e. from the first note to the second, whichever sounds lower): the quality
+    ("P", "m", "AA"...), the directed generic interval (3 for an ascending third,
+    -3 for a descending one, 1 for unisons) and the semitones. Quality is None
+    where the arithmetic doesn't apply.
+    """
+    steps = high_diatonic - low_diatonic
+    generic = np.where(steps >= 0, steps + 1, steps - 1)
+    semitones = high_ps - low_ps
+    undirected = np.abs(generic)
+    simple = (undirected - 1) % 7 + 1
+    base = _BASE_SEMITONES[simple] + 12 * ((undirected - 1) // 7)
+    perfect = _PERFECT[simple]
+    # qualities are measured in the direction of the generic interval
+    delta = np.where(steps >= 0, semitones, -semitones) - base
+    alteration = np.where(perfect | (delta >= 0), delta, delta + 1)
+    ok = (np.round(semitones) == semitones) & (np.abs(alteration) <= _MAX_ALTERATION)
+    quality = np.full(len(steps), None, dtype=object)
+    for i in np.flatnonzero(ok):
+        quality[i] = _quality(perfect[i], int(delta[i]))
+    return quality, generic, semitones
+
+
+def format_label(flavour, quality, generic, semitones):
+    """
+    Return the label of one interval in the given flavour, which is either a
+    `(kind, directed, compound)` setting, labelled as `ImportedPiece._intervalMethods`
+    would from a music21 Interval, or "directedName".
+    """
+    if flavour == 'directedName':
+        return quality + str(generic)
+    kind, directed, compound = flavour
+    if kind == 'c':
+        semitones = int(semitones) if float(semitones).is_integer() else semitones
+        if directed:
+            return str(semitones) if compound else str(semitones % 12)
+        return str(abs(semitones)) if compound else str(abs(semitones) % 12)
+    undirected = abs(generic)
+    simple = (undirected - 1) % 7 + 1
+    semi_simple = 8 if simple == 1 and undirected > 1 else simple
+    name = quality + str(undirected)
+    semi_simple_name = quality + str(semi_simple)
+    if kind == 'q':
+        if not directed:
+            return name if compound else semi_simple_name
+        if compound:
+            return name if semitones >= 0 else '-' + name
+        return semi_simple_name if semitones > 0 else '-' + semi_simple_name
+    sign = '-' if directed and semitones < 0 else ''
+    if directed and compound is True:
+        return (quality + str(generic))[1:]
+    if compound == 'simple':
+        return sign + (quality + str(simple))[1:]
+    return sign + (name if compound else semi_simple_name)[1:]
+
+
+def _music21_components(low_name, high_name):
+    ntrvl = interval.Interval(pitch.Pitch(low_name), pitch.Pitch(high_name))
+    return ntrvl.diatonic.specifierAbbreviation, ntrvl.generic.directed, ntrvl.semitones
+
+
+def _compute_labels(pairs):
+    """
+    Return a dict mapping each `(low name, high name)` pair in `pairs` to the
+    tuple of its labels in every flavour, in the order of `FLAVOURS`.
+    """
+    names = sorted({name for pair in pairs for name in pair})
+    positions = {name: i for i, name in enumerate(names)}
+    low = np.array([positions[pair[0]] for pair in pairs], dtype='int64')
+    high = np.array([positions[pair[1]] for pair in pairs], dtype='int64')
+    diatonic, ps = pitch_values(names)
+    quality, generic, semitones = components(diatonic[low], ps[low], diatonic[high], ps[high])
+    res = {}
+    for i, pair in enumerate(pairs):
+        if quality[i] is None:
+            parts = _music21_components(*pair)
+        else:
+            parts = (quality[i], generic[i], semitones[i])
+        res[pair] = tuple(format_label(flavour, *parts) for flavour in FLAVOURS)
+    return res
+
+
+def pair_labels(pairs):
+    """
+    Return a list with the tuple of labels, in the order of `FLAVOURS`, of each
+    `(low name, high name)` pair in `pairs`. Pairs that aren't in the shared
+    table yet are computed together and added to it.
+    """
+    missing = [pair for pair in dict.fromkeys(pairs) if pair not in _table]
+    if not missing:
+        return [_table[pair] for pair in pairs]
+    computed = _compute_labels(missing)
+    res = [_table[pair] if pair in _table else computed[pair] for pair in pairs]
+    _table.update(computed)
+    if len(_table) > MAX_CACHED_PAIRS:
+        for pair in list(itertools.islice(_table, len(_table) - MAX_CACHED_PAIRS)):
+            del _table[pair]
+    return res
+
+
+def label(flavour, low_name, high_name):
+    """
+    Return the label, in the given flavour (see `FLAVOURS`), of the interval
+    from the note named `low_name` to the note named `high_name`.
+    """
+    return pair_labels([(low_name, high_name)])[0][_POSITIONS[flavour]]
+
+
+def label_codes(flavour, names, low, high):
+    """
+    Return an object array of the labels, in the given flavour (see `FLAVOURS`),
+    of the intervals from the notes `names[low]` to the notes `names[high]`.
+    `names` holds distinct note names with octave like "E-4", and `low` and `high`
+    are integer arrays of positions in it.
+    """
+    low = np.asarray(low, dtype='int64')
+    high = np.asarray(high, dtype='int64')
+    res = np.empty(len(low), dtype=object)
+    if not len(low):
+        return res
+    codes, inverse = np.unique(low * len(names) + high, return_inverse=True)
+    unique_low, unique_high = np.divmod(codes, len(names))
+    names = np.asarray(names, dtype=object)
+    labels = np.empty(len(codes), dtype=object)
+    labels[:] = label_pairs(flavour, names[unique_low], names[unique_high])
+    res[:] = labels[inverse]
+    return res
+
+
+def label_pairs(flavour, low_names, high_names):
+    """
+    Return a list of the labels, in the given flavour (see `FLAVOURS`), of the
+    intervals from each of `low_names` to the note name at the same position in
+    `high_names`.
+    """
+    position = _POSITIONS[flavour]
+    return [labels[position] for labels in pair_labels(list(zip(low_names, high_names)))]
+
+
+def cache_info():
+    """
+    Return the number of pairs in the shared label table and its maximum size.
+    """
+    return {'pairs': len(_table), 'max_pairs': MAX_CACHED_PAIRS}
+
+
+def clear_cache():
+    """
+    Empty the shared label table.
+    """
+    _table.clear()
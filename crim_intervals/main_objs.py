@@ -1,6 +1,4 @@
 from music21 import *
-# httpx appears to be faster than requests, will fit better with an async version
-import httpx
 from pathlib import Path
 import pandas as pd
 import numpy as np
@@ -23,7 +21,10 @@ from glob import glob
 from IPython.display import display, SVG, HTML
 import json
 import urllib.parse
+import warnings
 from fractions import Fraction
+from joblib import Parallel, delayed
+from . import analysis_cache, cvf_patterns, interval_labels, ngram_vocab, remote, score_cache, soggetto_index
 from .sorting_lists import (
     pitch_class_order,
     pitch_class_order_no_rests,
@@ -45,19 +46,204 @@ datePattern = re.compile('date isodate="(1\d*)')
 
 accepted_filetypes = ('mei', 'mid', 'midi', 'abc', 'xml', 'musicxml')
 pathDict = {}
+# most cells of the (rows x ngrams x ngram length) difference array built at once by distance()
+DISTANCE_CHUNK_CELLS = 2 ** 22
+# the analyses each cached table of ImportedPiece is computed from; methods using
+# analysis_cache.memoize declare their own inputs
+analysis_cache.declare({
+    # "Score" stands for the piece's music21 score, so that invalidating it drops everything
+    'FlatParts': ('Score',),
+    'FrozenScore': ('Score',),
+    'PartNames': ('FlatParts',),
+    'PartSeries': ('FlatParts', 'PartNames'),
+    'PitchArrays': ('PartSeries',),
+    'PartNumberDict': ('PartNames',),
+    'M21Objs': ('PartNames', 'PartSeries'),
+    'M21ObjsNoTies': ('M21Objs',),
+    'NoTiesIndex': ('M21Objs', 'PitchArrays'),
+    'Duration': ('Notes',),
+    'm21Expressions': ('M21ObjsNoTies',),
+    'Fermatas': ('m21Expressions',),
+    'LowLine': ('PartNames', 'PitchArrays', 'NoTiesIndex'),
+    'HighLine': ('PartNames', 'PitchArrays', 'NoTiesIndex'),
+    'Final': ('LowLine',),
+    'BeatStrength': ('FlatParts', 'PartSeries', 'PitchArrays', 'NoTiesIndex'),
+    'M21TSigObjs': ('FlatParts',),
+    'TimeSignature': ('M21TSigObjs', 'PartNames'),
+    'M21KeySigObjs': ('FlatParts',),
+    'KeySignature': ('M21KeySigObjs', 'PartNames'),
+    'Measure': ('FlatParts', 'PartNames'),
+    'Barline': ('FlatParts', 'PartNames'),
+    'SoundingCount': ('Notes',),
+    'Beats': ('Notes', 'Measure', 'TimeSignature'),
+    'BeatIndex': ('Beats',),
+    'Timeline': ('Notes', 'Measure', 'BeatIndex', 'TimeSignature', 'KeySignature',
+                 'SoundingCount', 'LowLine', 'HighLine'),
+    'MeasureBeatLookup': ('Notes', 'Timeline'),
+    'AnalyzeFourths': ('PartNames', 'HarmonicIntervals', 'Notes', 'LowLine'),
+    'Supplementum': ('Cadences', 'Notes'),
+})
+
+
+def _intervalKind(kind):
+    '''
+    Return the one-letter form of an interval `kind` used by `melodic` and
+    `harmonic`, e.g. "c" for "semitones".
+    '''
+    kind = kind[0].lower()
+    return {'s': 'c'}.get(kind, kind)
+
+def _downloadScore(url, verbose=False):
+    """
+    Return the text of the score at `url`, or None if it can't be downloaded.
+    """
+    if verbose:
+        print('Downloading remote score...')
+    try:
+        return remote.fetch_text(url)
+    except:
+        _reportDownloadError(url)
+        return None
+
+
+def _reportDownloadError(url):
+    print('Error downloading',  str(url) + ', please check',
+          'your url and try again. Continuing to next file.')
+
+
+def _loadScore(path, verbose=False, cache_dir=None, text=None):
+    """
+    Read, parse, and return a single piece for `importScore` as an `ImportedPiece`.
+    Return None if the piece can't be downloaded or isn't an accepted file type, and
+    raise a ValueError with the message to report if it can't be parsed. `text` is
+    the content of a url that has already been downloaded.
+    """
+    date = None
+    mei_doc = None
+    if path.startswith('http'):
+        to_import = text if text is not None else _downloadScore(path, verbose)
+        if to_import is None:
+            return None
+        try:
+            mei_doc = ET.fromstring(to_import) if path.endswith('.mei') else None
+        except:
+            _reportDownloadError(path)
+            return None
+    elif os.path.isfile(path):  # `path` is formatted like a file path
+        ending = path.rsplit('.', 1)[1]
+        if ending not in accepted_filetypes:
+            return None
+        if path.endswith('.mei'):
+            try:
+                with open(path, "r") as file:
+                    to_import = file.read()
+                    mei_doc = ET.fromstring(to_import)
+            except ET.ParseError as err:
+                print('Error reading the mei file tree of {}'.format(path), err, sep='\n')
+        else:
+            # music21 keeps its own pickled copy of the other files it parses
+            to_import = path
+            cache_dir = None
+    else: # `path` is actually the string of an entire piece, used for user-supplied piece in streamlit
+        to_import = path
+        if '<mei' in path[:1000]: # is an <mei> element in the beginning of the piece?
+            try:
+                mei_doc = ET.fromstring(to_import)
+            except ET.ParseError as err:
+                print('Error reading this mei file:'.format(path[:200], err, sep='\n'))
+    try:
+        cache_key = score_cache.content_key(to_import) if cache_dir else None
+        if mei_doc is not None:
+            to_import = re.sub(suppliedPattern, '\\1', to_import)
+            _date = re.search(datePattern, to_import)
+            if _date:
+                date = int(_date.group(1))
+        score = score_cache.load(cache_dir, cache_key) if cache_dir else None
+        if score is not None:
+            if verbose:
+                print('Loaded', path[:180], 'from the score cache.')
+        else:
+            score = converter.parse(to_import)
+            if cache_dir:
+                score_cache.store(cache_dir, cache_key, score)
+        piece = ImportedPiece(score, path, mei_doc, date)
+    except:
+        raise ValueError("Import of {} failed, please check your file, path, or url.".format(str(path[:180])))
+    return piece
+
+
+def _importScoreWorker(path, text, cache_dir):
+    """
+    Run `_loadScore` in a worker process of `_importScores`. The result is sent
+    back as plain data, so that the score can be frozen without copying it: either
+    a `(frozen_score, mei_doc, date)` tuple, None, or an error message.
+    """
+    try:
+        piece = _loadScore(path, cache_dir=cache_dir, text=text)
+    except ValueError as err:
+        return str(err)
+    if piece is None:
+        return None
+    return score_cache.freeze(piece.score), piece.mei_doc, piece.metadata['date']
+
+
+def _importScores(paths, workers=None, verbose=False, cache_dir=None):
+    """
+    Import every piece in `paths` and return a list of the same length and order
+    holding an `ImportedPiece`, or None for each piece that couldn't be imported.
+    With `workers` of None or 1 the pieces are imported one at a time. Otherwise
+    remote scores are first all downloaded concurrently over one connection pool, and then
+    all the parsing is spread over `workers` processes (-1 uses all the cores).
+    Pieces that were already imported in this session are reused. Failed imports
+    are printed and don't stop the others.
+    """
+    if workers in (None, 1):
+        return [importScore(path, verbose=verbose, cache_dir=cache_dir) for path in paths]
+    if cache_dir is None:
+        cache_dir = score_cache.default_cache_dir()
+    to_load = [path for path in dict.fromkeys(paths) if path not in pathDict]
+    urls = [path for path in to_load if path.startswith('http')]
+    texts = {}
+    if urls:
+        if verbose:
+            print('Downloading {} remote scores...'.format(len(urls)))
+        for url, text in zip(urls, remote.fetch_all(urls)):
+            if isinstance(text, str):
+                texts[url] = text
+            else:
+                _reportDownloadError(url)
+                texts[url] = None
+        to_load = [path for path in to_load if path not in texts or texts[path] is not None]
+    results = Parallel(n_jobs=workers)(delayed(_importScoreWorker)(path, texts.get(path), cache_dir)
+                                       for path in to_load)
+    for path, result in zip(to_load, results):
+        if isinstance(result, str):
+            print(result)
+        elif result is not None:
+            frozen, mei_doc, date = result
+            piece = ImportedPiece(score_cache.thaw(frozen), path, mei_doc, date)
+            pathDict[path] = piece
+            if verbose:
+                print("Successfully imported", path[:180])
+    return [pathDict.get(path) for path in paths]
+
+
+def _scoreFiles(path, recurse=False):
+    """
+    Return the paths of the files in the directory `path`, including those of its
+    subdirectories if `recurse` is True.
+    """
+    files = []
+    for file in [os.path.join(path, file) for file in os.listdir(path)]:
+        if os.path.isdir(file) and recurse:
+            files.extend(_scoreFiles(file, recurse))
+        elif os.path.isfile(file):
+            files.append(file)
+    return files
 
-_directedNameMemos = {}  
-def _directed_name_from_note_strings(note1, note2):
-    key = (note1.nameWithOctave, note2.nameWithOctave)
-    if key not in _directedNameMemos:
-        ret = interval.Interval(note1, note2).directedName
-        _directedNameMemos[key] = ret
-        return ret
-    else:
-        return _directedNameMemos[key]
 
 # An extension of the music21 note class with more information easily accessible
-def importScore(path, recurse=False, verbose=False):
+def importScore(path, recurse=False, verbose=False, cache_dir=None, workers=None):
     """
     Import piece or group of pieces and return an `ImportedPiece` or `CorpusBase` object respectively.
     Return None if there is an error. This function accepts piece urls, and local paths. A list of
@@ -67,89 +253,61 @@ def importScore(path, recurse=False, verbose=False):
     of all subdirectories. Set `verbose=True` (default False) to print out confirmation of import
     success for each piece. If any errors are encountered, these issues will be printed out
     regardless of verbose setting.
+
+    Set `cache_dir` to a directory path to keep a disk cache of parsed scores there, so that
+    later sessions can skip music21's parser for pieces they've already seen. Cache entries
+    are keyed by the content of the piece, so edited files are re-parsed automatically. If
+    `cache_dir` isn't passed, the `CRIM_SCORE_CACHE` environment variable is used, and if that
+    isn't set either, no disk cache is used. Only urls, MEI files and score strings are cached
+    this way: music21 already keeps a pickled copy of the other local files it parses.
+
+    When importing a directory, set `workers` to the number of processes to parse its files
+    with (-1 to use all the cores). The pieces keep the same order as with the default of
+    importing them one at a time.
     """
+    if cache_dir is None:
+        cache_dir = score_cache.default_cache_dir()
     if os.path.isdir(path):
-        files = os.listdir(path)
-        files = [os.path.join(path, file) for file in files]
-        scores = []
-        for file in files:
-            if os.path.isdir(file) and recurse:
-                score_list = importScore(file, recurse, verbose)
-                if score_list is not None and len(score_list.scores):
-                    scores.extend(score_list.scores)
-            elif os.path.isfile(file):
-                score = importScore(file, verbose=verbose)
-                if score is not None:
-                    scores.append(score)
-
+        files = _scoreFiles(path, recurse)
+        scores = [score for score in _importScores(files, workers, verbose, cache_dir) if score is not None]
         if len(scores):
             return CorpusBase(scores)
         elif verbose:
             print('No scores found in this directory: {}'.format(path))
         return
 
-    date = None
     if path in pathDict and verbose:
         print('Previously imported piece detected.')
     else:
-        mei_doc = None
-        if path.startswith('http'):
-            if verbose:
-                print('Downloading remote score...')
-            try:
-                to_import = httpx.get(path).text
-                mei_doc = ET.fromstring(to_import) if path.endswith('.mei') else None
-            except:
-                print('Error downloading',  str(path) + ', please check',
-                      'your url and try again. Continuing to next file.')
-                return None
-        elif os.path.isfile(path):  # `path` is formatted like a file path
-            ending = path.rsplit('.', 1)[1]
-            if ending not in accepted_filetypes:
-                return None
-            if path.endswith('.mei'):
-                try:
-                    with open(path, "r") as file:
-                        to_import = file.read()
-                        mei_doc = ET.fromstring(to_import)
-                except ET.ParseError as err:
-                    print('Error reading the mei file tree of {}'.format(path), err, sep='\n')
-            else:
-                to_import = path
-        else: # `path` is actually the string of an entire piece, used for user-supplied piece in streamlit
-            to_import = path
-            if '<mei' in path[:1000]: # is an <mei> element in the beginning of the piece?
-                try:
-                    mei_doc = ET.fromstring(to_import)
-                except ET.ParseError as err:
-                    print('Error reading this mei file:'.format(path[:200], err, sep='\n'))
         try:
-            if mei_doc is not None:
-                to_import = re.sub(suppliedPattern, '\\1', to_import)
-                _date = re.search(datePattern, to_import)
-                if _date:
-                    date = int(_date.group(1))
-            score = converter.parse(to_import)
-            pathDict[path] = ImportedPiece(score, path, mei_doc, date)
-            if verbose:
-                print("Successfully imported", path[:180])
-        except:
-            print("Import of", str(path[:180]), "failed, please check your file, path, or url.")
+            piece = _loadScore(path, verbose, cache_dir)
+        except ValueError as err:
+            print(err)
+            return None
+        if piece is None:
             return None
+        pathDict[path] = piece
+        if verbose:
+            print("Successfully imported", path[:180])
 
     return pathDict[path]
 
-def Crimport(path, recurse=False, verbose=False):
+def Crimport(path, recurse=False, verbose=False, cache_dir=None, workers=None):
     '''
     Better naming convention for importing single files or directories of files. This is
     an alias for `importScore`. See that method's doc string for instructions.'''
-    return importScore(path, recurse, verbose)
+    return importScore(path, recurse, verbose, cache_dir, workers)
 
 def _getCVFTable():
     if 'CVFTable' not in pathDict:
         pathDict['CVFTable'] = pd.read_csv(main_objs_dir + '/data/cadences/CVFLabels.csv', index_col='Ngram')
     return pathDict['CVFTable']
 
+def _getCVFMatcher():
+    if 'CVFMatcher' not in pathDict:
+        pathDict['CVFMatcher'] = cvf_patterns.PatternMatcher(_getCVFTable().index)
+    return pathDict['CVFMatcher']
+
 def _getCadenceTable():
     if 'CadenceTable' not in pathDict:
         pathDict['CadenceTable'] = pd.read_csv(main_objs_dir + '/data/cadences/cadenceLabels.csv', index_col=0)
@@ -162,7 +320,7 @@ class ImportedPiece:
         self.path = path
         self.file_name = path.rsplit('.', 1)[0].rsplit('/')[-1]
         self.mei_doc = mei_doc
-        self.analyses = {'note_list': None}
+        self.analyses = analysis_cache.AnalysisCache({'note_list': None})
         title, composer = path, 'Not found'
         if mei_doc is not None:
             title = mei_doc.find('mei:meiHead//mei:titleStmt/mei:title', namespaces={"mei": MEINSURI})
@@ -206,14 +364,71 @@ class ImportedPiece:
             ('c', False, False): lambda cell: str(abs(cell.semitones) % 12) if hasattr(cell, 'semitones') else cell
         }
 
+    def __getstate__(self):
+        # music21 scores don't survive plain pickling and _intervalMethods holds lambdas, so
+        # pieces are sent to other processes (e.g. by `CorpusBase.batch`) as a frozen score
+        # and rebuilt from it. Cached analyses are left behind.
+        return {'frozenScore': self._getFrozenScore(), 'path': self.path, 'mei_doc': self.mei_doc,
+                'metadata': self.metadata}
+
+    def __setstate__(self, state):
+        self.__init__(score_cache.thaw(state['frozenScore']), state['path'], state['mei_doc'],
+                      state['metadata']['date'])
+        self.metadata = state['metadata']
+        self.analyses['FrozenScore'] = state['frozenScore']
+
+    def _getFrozenScore(self):
+        '''
+        Return the score frozen by music21's `StreamFreezer`, which is how pieces
+        are pickled. It's cached like the other analyses, so it counts towards the
+        cache's budget and is dropped by `invalidate('Score')`.
+        '''
+        frozen = self.analyses.get('FrozenScore')
+        if frozen is None:
+            frozen = freezeThaw.StreamFreezer(self.score).writeStr()
+            self.analyses['FrozenScore'] = frozen
+        return frozen
+
+    def cache_info(self):
+        '''
+        Return a dict summarizing the cache of this piece's analyses: the number
+        of entries, their approximate total size in bytes, the cache's limits, and
+        how many lookups hit or missed and how many entries were evicted. Use
+        `piece.analyses.entries()` for the size and age of each entry, and see the
+        `analysis_cache` module for how the cache is bounded.
+        '''
+        return self.analyses.info()
+
+    def clear_cache(self, pattern=None):
+        '''
+        Remove the cached analyses of this piece whose name matches `pattern`, a
+        shell-style pattern like "PresentationTypes" or "Melodic*", or all of them
+        if no pattern is given. The name of a cached analysis is its key, or the
+        first item of its key when that's a tuple of the method's settings. Return
+        the number of analyses removed; they'll be computed again when needed.
+        '''
+        return self.analyses.clear(pattern)
+
+    def invalidate(self, *names):
+        '''
+        Remove the cached analyses in `names`, like "PartSeries" or
+        "MelodicIntervals", along with every cached analysis computed from them.
+        After changing `self.score`, call `invalidate('Score')` to drop every
+        analysis of it. Return the number of analyses removed. See `clear_cache`
+        for the names of cached analyses.
+        '''
+        return self.analyses.invalidate(*names)
+
     def _getFlatParts(self):
         """
         Return and store flat parts inside a piece using the score attribute.
         """
-        if 'FlatParts' not in self.analyses:
+        res = self.analyses.get('FlatParts')
+        if res is None:
             parts = self.score.getElementsByClass(stream.Part)
-            self.analyses['FlatParts'] = [part.flatten() for part in parts]
-        return self.analyses['FlatParts']
+            res = [part.flatten() for part in parts]
+            self.analyses['FlatParts'] = res
+        return res
 
     def pitch_order(self, values, order=None, include_rests=True):
         """Return a list of pitch values sorted by the shared ordering helpers."""
@@ -235,7 +450,8 @@ class ImportedPiece:
         """
         Return flat names inside a piece using the score attribute.
         """
-        if 'PartNames' not in self.analyses:
+        part_names = self.analyses.get('PartNames')
+        if part_names is None:
             part_names = []
             name_set = set()
             for i, part in enumerate(self._getFlatParts()):
@@ -249,10 +465,11 @@ class ImportedPiece:
                     name_set.add(name)
                 part_names.append(name)
             self.analyses['PartNames'] = part_names
-        return self.analyses['PartNames']
+        return part_names
 
     def _getPartSeries(self):
-        if 'PartSeries' not in self.analyses:
+        part_series = self.analyses.get('PartSeries')
+        if part_series is None:
             part_series = []
             part_names = self._getPartNames()
             for i, flat_part in enumerate(self._getFlatParts()):
@@ -263,35 +480,123 @@ class ImportedPiece:
                 ser = ser[~ser.index.duplicated()]  # remove multiple events at the same offset in a given part
                 part_series.append(ser)
             self.analyses['PartSeries'] = part_series
-        return self.analyses['PartSeries']
+        return part_series
+
+    def _getPitchArrays(self):
+        '''
+        Return a list with a dict of numpy arrays for each part (in the same order and
+        with the same events as `_getPartSeries`), so that tables can be computed with
+        vectorized operations instead of calling music21 for every cell:
+
+        * index: the offsets exactly as in the part series' index (floats or Fractions)
+        * offset, duration: the offsets and quarter lengths as floats
+        * rest: True for rests
+        * midi: the pitch space value (the MIDI number, fractional for microtones)
+        * diatonic: music21's diatonicNoteNum (C4 = 29, D4 = 30...)
+        * alter: the accidental's alteration in semitones
+        * tie: the index of the tie type in `_tieTypes` (0 when there's no tie)
+        * name: the `nameWithOctave` of notes and "Rest" for rests
+        * lyric: the lyric (None if there isn't one)
+
+        Pitch values of rests are 0.
+        '''
+        part_arrays = self.analyses.get('PitchArrays')
+        if part_arrays is None:
+            part_arrays = []
+            for ser in self._getPartSeries():
+                count = len(ser)
+                arrays = {
+                    'index': ser.index,
+                    'offset': ser.index.to_numpy(dtype='float64'),
+                    'duration': np.empty(count, dtype='float64'),
+                    'rest': np.empty(count, dtype=bool),
+                    'midi': np.zeros(count, dtype='float64'),
+                    'diatonic': np.zeros(count, dtype='int64'),
+                    'alter': np.zeros(count, dtype='float64'),
+                    'tie': np.zeros(count, dtype='int8'),
+                    'name': np.empty(count, dtype=object),
+                    'lyric': np.empty(count, dtype=object),
+                }
+                for i, noteOrRest in enumerate(ser.values):
+                    arrays['duration'][i] = noteOrRest.quarterLength
+                    arrays['rest'][i] = noteOrRest.isRest
+                    if noteOrRest.isRest:
+                        arrays['name'][i] = 'Rest'
+                    else:
+                        _pitch = noteOrRest.pitch
+                        arrays['midi'][i] = _pitch.ps
+                        arrays['diatonic'][i] = _pitch.diatonicNoteNum
+                        arrays['alter'][i] = _pitch.alter
+                        arrays['name'][i] = _pitch.nameWithOctave
+                    if noteOrRest.tie is not None:
+                        arrays['tie'][i] = ImportedPiece._tieTypes.index(noteOrRest.tie.type)
+                    arrays['lyric'][i] = noteOrRest.lyric
+                part_arrays.append(arrays)
+            self.analyses['PitchArrays'] = part_arrays
+        return part_arrays
+
+    _tieTypes = (None, 'start', 'stop', 'continue', 'let-ring')
+
+    def _getNoTiesIndex(self):
+        '''
+        Return the index of `_getM21ObjsNoTies`, i.e. every offset where at least
+        one part has a note or rest that isn't the continuation of a tie.
+        '''
+        res = self.analyses.get('NoTiesIndex')
+        if res is None:
+            index = self._getM21Objs().index
+            attacked = np.zeros(len(index), dtype=bool)
+            for arrays in self._getPitchArrays():
+                keep = arrays['tie'] <= 1
+                attacked[index.get_indexer(arrays['index'][keep])] = True
+            res = index[attacked]
+            self.analyses['NoTiesIndex'] = res
+        return res
+
+    def _pitchArrayFrame(self, values):
+        '''
+        Return a df shaped like `_getM21ObjsNoTies` from a list with one array of
+        `values` for each part, aligned with `_getPitchArrays`. Values at tied-to
+        notes are dropped and empty cells are NaN. Column dtypes are inferred the
+        same way that `DataFrame.map` would.
+        '''
+        index = self._getNoTiesIndex()
+        columns = {}
+        for name, arrays, vals in zip(self._getPartNames(), self._getPitchArrays(), values):
+            keep = arrays['tie'] <= 1
+            ser = pd.Series(vals[keep], index=arrays['index'][keep])
+            columns[name] = ser.reindex(index)
+        return pd.DataFrame(columns, index=index).infer_objects()
 
     def _getPartNumberDict(self):
         '''
         Return a dictionary mapping part names to their numerical position on the staff,
         starting at 1 and counting from the highest voice.'''
-        if 'PartNumberDict' not in self.analyses:
+        names2nums = self.analyses.get('PartNumberDict')
+        if names2nums is None:
             parts = self._getPartNames()
             names2nums = {part: str(i + 1) for i, part in enumerate(parts)}
             self.analyses['PartNumberDict'] = names2nums
-        return self.analyses['PartNumberDict']
+        return names2nums
 
     def numberParts(self, df):
         '''
-        Return the passed df with the part names in the columns replaced with numbers
-        where 1 is the highest staff. Works with single parts and multi-part column names.
-        The df's column names are changed in place, so make a copy before calling this method
-        if you want to keep the original.'''
+        Return a copy of the passed df with the part names in the columns replaced with
+        numbers where 1 is the highest staff. Works with single parts and multi-part column
+        names.'''
         _dict = self._getPartNumberDict()
         cols = ['_'.join(_dict.get(part, part) for part in col.split('_')) for col in df.columns]
-        res = df.copy()
+        res = analysis_cache.share(df)
         res.columns = cols
         return res
 
     def _getM21Objs(self):
-        if 'M21Objs' not in self.analyses:
+        res = self.analyses.get('M21Objs')
+        if res is None:
             part_names = self._getPartNames()
-            self.analyses['M21Objs'] = pd.concat(self._getPartSeries(), names=part_names, axis=1, sort=True)
-        return self.analyses['M21Objs']
+            res = pd.concat(self._getPartSeries(), names=part_names, axis=1, sort=True)
+            self.analyses['M21Objs'] = res
+        return res
 
     def _remove_tied(self, noteOrRest):
         if hasattr(noteOrRest, 'tie') and noteOrRest.tie is not None and noteOrRest.tie.type != 'start':
@@ -299,10 +604,11 @@ class ImportedPiece:
         return noteOrRest
 
     def _getM21ObjsNoTies(self):
-        if 'M21ObjsNoTies' not in self.analyses:
+        df = self.analyses.get('M21ObjsNoTies')
+        if df is None:
             df = self._getM21Objs().map(self._remove_tied).dropna(how='all')
             self.analyses['M21ObjsNoTies'] = df
-        return self.analyses['M21ObjsNoTies']
+        return df
 
     def regularize(self, df, unit=2):
         '''
@@ -421,9 +727,11 @@ class ImportedPiece:
         ngramDurations = importedPiece.durations(df=har, n=_n, mask_df=ngrams)
         ```
         '''
-        if 'Duration' in self.analyses and df is None and n == 1 and mask_df is None:
-            return self.analyses['Duration']
-        _df = self.notes().copy() if df is None else df.copy()
+        if df is None and n == 1 and mask_df is None:
+            result = self.analyses.get('Duration')
+            if result is not None:
+                return result
+        _df = (self._notes() if df is None else df).copy()
         highestTime = self.score.highestTime
         _df.loc[highestTime, :] = 'Rest'  # this is just a placeholder
         if n > 0:
@@ -439,6 +747,7 @@ class ImportedPiece:
             result = result[mask]
         return result.dropna(how='all')
 
+    @analysis_cache.memoize('Lyrics', inputs=('PartNames', 'PitchArrays', 'NoTiesIndex'))
     def lyrics(self, strip=True):
         '''
         Return a dataframe of the lyrics associated with each note in the piece.
@@ -446,17 +755,17 @@ class ImportedPiece:
         and trailing whitespace and dashes. If `strip` is `False`, then the lyrics will
         be returned as they are in the score. Notes without lyrics are shown as NaN.
         '''
-        key = ('Lyrics', strip)
-        if key not in self.analyses:
-            m21Objs = self._getM21ObjsNoTies()
+        values = []
+        for arrays in self._getPitchArrays():
+            lyrics = arrays['lyric'].copy()
             if strip:
-                df = m21Objs.map(na_action='ignore',
-                    func=lambda cell: cell.lyric.strip('\n \t-') if (cell.isNote and cell.lyric) else np.nan )
-            else: 
-                df = m21Objs.map(na_action='ignore',
-                    func=lambda cell: cell.lyric if cell.isNote else np.nan)
-            self.analyses[key] = df
-        return self.analyses[key]
+                has_lyric = ~arrays['rest'] & lyrics.astype(bool)
+                lyrics[has_lyric] = [lyric.strip('\n \t-') for lyric in lyrics[has_lyric]]
+                lyrics[~has_lyric] = np.nan
+            else:
+                lyrics[arrays['rest']] = np.nan
+            values.append(lyrics)
+        return self._pitchArrayFrame(values)
 
     def _noteRestHelper(self, noteOrRest):
         if noteOrRest.isRest:
@@ -481,34 +790,41 @@ class ImportedPiece:
         `combineUnisons` works the same way for consecutive attacks on the same
         pitch in a given voice, however, `combineUnisons` defaults to `False`.
         '''
-        if 'Notes' not in self.analyses:
-            df = self._getM21ObjsNoTies().map(self._noteRestHelper, na_action='ignore')
-            self.analyses['Notes'] = df
-        ret = self.analyses['Notes'].copy()
-        if combineRests:
-            ret = ret.apply(self._combineRests)
+        return analysis_cache.share(self._notes(combineRests, combineUnisons))
+
+    @analysis_cache.memoize('Notes', inputs=('PartNames', 'PitchArrays', 'NoTiesIndex'))
+    def _notes(self, combineRests=True, combineUnisons=False):
+        '''
+        Return the cached table of `notes` with these settings, shared by every
+        caller, so it must not be modified.
+        '''
         if combineUnisons:
-            ret = ret.apply(self._combineUnisons)
-        return ret
+            return self._notes(combineRests).apply(self._combineUnisons)
+        if combineRests:
+            return self._notes(False).apply(self._combineRests)
+        names = [arrays['name'] for arrays in self._getPitchArrays()]
+        return self._pitchArrayFrame(names)
 
     def _m21Expressions(self):
         '''
         Get all the expressions from music21. This includes fermatas, mordents, etc.
         '''
-        if 'm21Expressions' not in self.analyses:
+        df = self.analyses.get('m21Expressions')
+        if df is None:
             df = self._getM21ObjsNoTies().map(lambda noteOrRest: noteOrRest.expressions, na_action='ignore')
             self.analyses['m21Expressions'] = df
-        return self.analyses['m21Expressions']
+        return df
 
     def fermatas(self):
         '''
         Get all the fermatas in a piece. A fermata is designated by a `True` value.
         '''
-        if 'Fermatas' not in self.analyses:
+        df = self.analyses.get('Fermatas')
+        if df is None:
             df = self._m21Expressions().map(
                 lambda exps: any(isinstance(exp, expressions.Fermata) for exp in exps), na_action='ignore')
             self.analyses['Fermatas'] = df
-        return self.analyses['Fermatas']
+        return df
 
     def lowLine(self):
         '''
@@ -516,25 +832,50 @@ class ImportedPiece:
         any given moment. Attack information cannot be reliably preserved so
         consecutive repeated notes and rests are combined. If all parts have a rest,
         then "Rest" is shown for that stretch of the piece.'''
-        if 'LowLine' not in self.analyses:
-            # use m21 objects so that you can do comparison with min
-            notes = self._getM21ObjsNoTies()
-            # you can't compare notes and rests, so replace rests with a really high note
-            highNote = note.Note('C9')
-            notes = notes.map(lambda n: highNote if n.isRest else n, na_action='ignore')
-            notes.ffill(inplace=True)
-            lowLine = notes.apply(min, axis=1)
-            lowLine = lowLine.apply(lambda n: n.nameWithOctave)
+        res = self.analyses.get('LowLine')
+        if res is None:
+            lowLine = self._extremeLine(lowest=True)
             lowLine.replace('C9', 'Rest', inplace=True)
             lowLine.name = 'Low Line'
-            self.analyses['LowLine'] = lowLine[lowLine != lowLine.shift()]
-        return self.analyses['LowLine']
+            res = lowLine[lowLine != lowLine.shift()]
+            self.analyses['LowLine'] = res
+        return res
+
+    def _extremeLine(self, lowest=True):
+        '''
+        Return a series of the name of the lowest (or highest if `lowest` is False)
+        note sounding at each offset of `_getM21ObjsNoTies`, comparing notes by
+        pitch space like music21 does. When several voices tie, the first one wins.
+        Rests count as a really high note (C9) for the low line and a really low
+        note (C-9) for the high line, so they're only chosen when all voices rest.
+        '''
+        restPitch, restName = (108.0, 'C9') if lowest else (-96.0, 'C-9')
+        pitchArrays = self._getPitchArrays()
+        # the pitches and names of all the parts' notes end to end, so that one
+        # frame of positions in them, forward-filled as floats, stands for both
+        allPitches = np.concatenate([np.where(arrays['rest'], restPitch, arrays['midi'])
+                                     for arrays in pitchArrays])
+        allNames = np.concatenate([np.where(arrays['rest'], restName, arrays['name']).astype(object)
+                                   for arrays in pitchArrays])
+        starts = np.cumsum([0] + [len(arrays['midi']) for arrays in pitchArrays])
+        positions = self._pitchArrayFrame([start + np.arange(len(arrays['midi']))
+                                           for start, arrays in zip(starts, pitchArrays)]).ffill()
+        index = positions.index
+        positions = positions.to_numpy(dtype='float64')
+        missing = np.isnan(positions)
+        positions = np.where(missing, 0, positions).astype('int64')
+        pitches = np.where(missing, np.inf if lowest else -np.inf, allPitches[positions])
+        columns = np.argmin(pitches, axis=1) if lowest else np.argmax(pitches, axis=1)
+        rows = np.arange(len(index))
+        names = np.where(missing[rows, columns], np.nan, allNames[positions[rows, columns]])
+        return pd.Series(names, index=index, dtype=object)
 
     def final(self):
         '''
         Return the final of the piece, defined as the lowest sounding note at
         the end of the piece.'''
-        if 'Final' not in self.analyses:
+        final = self.analyses.get('Final')
+        if final is None:
             lowLine = self.lowLine()
             if len(lowLine.index):
                 final = lowLine.iat[-1]
@@ -543,7 +884,7 @@ class ImportedPiece:
             if final == 'Rest' and len(lowLine.index) > 1:
                 final = lowLine.iat[-2]
             self.analyses['Final'] = final
-        return self.analyses['Final']
+        return final
 
     def highLine(self):
         '''
@@ -551,19 +892,14 @@ class ImportedPiece:
         any given moment. Attack information cannot be reliably preserved so
         consecutive repeated notes and rests are combined. If all parts have a rest,
         then "Rest" is shown for that stretch of the piece.'''
-        if 'HighLine' not in self.analyses:
-            # use m21 objects so that you can do comparison with min
-            notes = self._getM21ObjsNoTies()
-            # you can't compare notes and rests, so replace rests with a really high note
-            lowNote = note.Note('C', octave=-9)
-            notes = notes.map(lambda n: lowNote if n.isRest else n, na_action='ignore')
-            notes.ffill(inplace=True)
-            highLine = notes.apply(max, axis=1)
-            highLine = highLine.apply(lambda n: n.nameWithOctave)
+        res = self.analyses.get('HighLine')
+        if res is None:
+            highLine = self._extremeLine(lowest=False)
             highLine.replace('C-9', 'Rest', inplace=True)
             highLine.name = 'High Line'
-            self.analyses['HighLine'] = highLine[highLine != highLine.shift()]
-        return self.analyses['HighLine']
+            res = highLine[highLine != highLine.shift()]
+            self.analyses['HighLine'] = res
+        return res
 
     def _emaRowHelper(self, row):
         measures = list(range(row.iat[0], row.iat[2] + 1))
@@ -759,7 +1095,7 @@ class ImportedPiece:
             newCols = []
             for i in range(len(ret.columns)):
                 part = ret.iloc[:, i].dropna()
-                notes = self.notes().loc[:, part.name].dropna()
+                notes = self._notes().loc[:, part.name].dropna()
                 new_index = []
                 for (_first, _last) in part.index:
                     new_index.append((notes.loc[:_first].index[-2], _last))
@@ -785,7 +1121,7 @@ class ImportedPiece:
             if isinstance(df, pd.DataFrame):
                 hr = df.copy()
                 ngram_length = int(hr.iloc[0]['ngram_length'])
-                nr = self.notes()
+                nr = self._notes()
                 dur = self.durations(df = nr)
                 ngrams = self.ngrams(df = dur, n = ngram_length, offsets = 'both', exclude=[])
                 hr = hr.reset_index()
@@ -800,7 +1136,7 @@ class ImportedPiece:
                 # p_types = df.copy()
                 # ngram_length = 4
                 ngram_length = len(df.iloc[0]['Soggetti'][0])
-                nr = self.notes(combineUnisons = combine_unisons)
+                nr = self._notes(combineUnisons = combine_unisons)
                 mel = self.melodic(df = nr, end=False)
                 ngrams = self.ngrams(df=mel, n=ngram_length)
                 
@@ -813,12 +1149,10 @@ class ImportedPiece:
         if isinstance(df, pd.DataFrame):
             if len(df) >= 1:
                 idf = ret.index.to_frame()
-                _measures = self.measures().iloc[:, 0]
-                measures = idf.map(lambda i: _measures.loc[:i].iat[-1])
-                _beats = self.beatIndex()
-                beats = idf.map(lambda i: _beats[i])
-                res = pd.concat([measures['First'], beats['First'], measures['Last'], beats['Last']], axis=1, sort=True)
-                res.columns = ['First Measure', 'First Beat', 'Last Measure', 'Last Beat']
+                firstMeasures, firstBeats = self._measuresAndBeats(idf['First'])
+                lastMeasures, lastBeats = self._measuresAndBeats(idf['Last'])
+                res = pd.DataFrame({'First Measure': firstMeasures, 'First Beat': firstBeats,
+                                    'Last Measure': lastMeasures, 'Last Beat': lastBeats}, index=ret.index)
                 ret = self.numberParts(ret)
                 res = pd.concat([res, ret], axis=1, sort=True)
                 res = res.apply(self._emaRowHelper, axis=1)
@@ -946,9 +1280,8 @@ class ImportedPiece:
         a quarter note, 0.5 is an eighth note, etc. This is useful for
         calculating the beat strength of notes and rests.
         '''
-        tsigs = self._getM21TSigObjs()
-        tsigs.columns = self._getPartNames()
-        df = tsigs.map(lambda tsig: tsig.beatDuration.quarterLength, na_action='ignore')
+        df = self._getM21TSigObjs().map(lambda tsig: float(tsig.beatDuration.quarterLength), na_action='ignore')
+        df.columns = self._getPartNames()
         return df
 
     def beats(self):
@@ -962,20 +1295,28 @@ class ImportedPiece:
 
         The weights are determined by music21's `beatStrength` method, which is based on the prevailing time signature at each moment in the piece.    
         '''
-        if 'Beats' not in self.analyses:
-            nr = self.notes()
-            nrOffs = nr.apply(lambda row: row.index)
-            ms = self.measures().apply(lambda row: row.index)
-            temp = pd.concat([ms, nr], axis=1, sort=True)
-            ms = temp.iloc[:, :len(ms.columns)].ffill()
-            ms = ms[nr.notnull()]
-            offFromMeas = nrOffs - ms
-            beatDur = self._getBeatUnit()
-            temp = pd.concat([beatDur, nr], axis=1, sort=True)
-            beatDur = temp.iloc[:, :len(beatDur.columns)].ffill()
-            beatDur = beatDur[nr.notnull()]
-            self.analyses['Beats'] = (offFromMeas / beatDur) + 1
-        return self.analyses['Beats']
+        res = self.analyses.get('Beats')
+        if res is None:
+            nr = self._notes()
+            offsets = nr.index.to_numpy(dtype='float64')
+            # each offset's distance from the start of its measure, in any voice
+            measureStarts = self.measures().index.to_numpy(dtype='float64')
+            starts = np.searchsorted(measureStarts, offsets, side='right') - 1
+            offFromMeas = offsets - np.where(starts >= 0, measureStarts[starts.clip(0)], np.nan)
+            # and the beat unit of the time signature in effect in each voice
+            beatDurs = self._getBeatUnit()
+            beats = {}
+            for part, beatDur in beatDurs.items():
+                beatDur = beatDur.dropna()
+                changes = np.searchsorted(beatDur.index.to_numpy(dtype='float64'), offsets, side='right') - 1
+                units = np.where(changes >= 0, beatDur.to_numpy(dtype='float64')[changes.clip(0)], np.nan)
+                beats[part] = np.where(nr[part].notnull(), offFromMeas / units + 1, np.nan)
+            beats = pd.DataFrame(beats, index=nr.index, columns=nr.columns)
+            # rows of measure starts and time signature changes are kept, even when empty
+            index = nr.index.union(self.measures().index).union(beatDurs.index).rename(None)
+            res = beats.reindex(index)
+            self.analyses['Beats'] = res
+        return res
 
     def beatIndex(self):
         '''
@@ -990,10 +1331,57 @@ class ImportedPiece:
         Results from this method should not be sent to
         the `regularize` method. 
         '''
-        if 'BeatIndex' not in self.analyses:
-            ser = self.beats().dropna(how='all').apply(lambda row: row.dropna().iat[0], axis=1)
+        ser = self.analyses.get('BeatIndex')
+        if ser is None:
+            beats = self.beats().to_numpy(dtype='float64')
+            valid = ~np.isnan(beats)
+            rows = np.flatnonzero(valid.any(axis=1))
+            ser = pd.Series(beats[rows, valid[rows].argmax(axis=1)], index=self.beats().index[rows])
             self.analyses['BeatIndex'] = ser
-        return self.analyses['BeatIndex']
+        return ser
+
+    def _measureBeatLookup(self):
+        '''
+        Return a tuple of arrays describing every offset where a note or rest starts
+        in the piece, in order: the offsets, their measures, their beats, and their
+        "measure/beat" labels as used in the Measures_Beats column of
+        `presentationTypes`, and their positions in the detailIndex of the notes,
+        which is ordered by measure and beat. They come from that detailIndex, so
+        they agree with it, and are built once per piece.
+        '''
+        res = self.analyses.get('MeasureBeatLookup')
+        if res is None:
+            ndx = self.detailIndex(self._notes(), offset=True).index
+            offsets = ndx.get_level_values('Offset').to_numpy(dtype='float64')
+            order = np.argsort(offsets, kind='stable')
+            measures = ndx.get_level_values('Measure')
+            beats = ndx.get_level_values('Beat')
+            labels = (measures.astype(str) + '/' + beats.astype(str)).to_numpy(dtype=object)
+            res = (offsets[order], measures.to_numpy()[order],
+                   beats.to_numpy()[order], labels[order], order)
+            self.analyses['MeasureBeatLookup'] = res
+        return res
+
+    def _measuresAndBeats(self, offsets):
+        '''
+        Return arrays of the measure numbers (as ints) and beats of `offsets`, each
+        taken from the last note or rest starting at or before it.
+        '''
+        table, measures, beats, _, _ = self._measureBeatLookup()
+        positions = np.searchsorted(table, np.asarray(offsets, dtype='float64'), side='right') - 1
+        positions = positions.clip(0)
+        return measures[positions].astype(int), beats[positions]
+
+    def _measureBeatLabels(self, offsets):
+        '''
+        Return a list of the "measure/beat" labels of the distinct `offsets` where
+        a note or rest starts, in the order of the detailIndex.
+        '''
+        table, _, _, labels, ranks = self._measureBeatLookup()
+        offsets = np.unique(np.asarray(offsets, dtype='float64'))
+        positions = np.searchsorted(table, offsets).clip(max=len(table) - 1)
+        positions = positions[table[positions] == offsets]
+        return labels[positions[np.argsort(ranks[positions])]].tolist()
 
     def detailIndex(self, df, measure=True, beat=True, offset=False, t_sig=False,
         key_sig=False, sounding=False, progress=False, lowest=False, highest=False, _all=False):
@@ -1016,50 +1404,90 @@ class ImportedPiece:
 
         You can also pass `_all=True` to include all these types of index information.
         '''
-        cols = [df]
-        names = []
         if _all:
             measure, beat, offset, t_sig, key_sig, sounding, progress, lowest, highest = [True] * 9
-        if measure:
-            cols.append(self.measures().iloc[:, 0])
-            names.append('Measure')
-        if beat:
-            cols.append(self.beatIndex())
-            names.append('Beat')
-        if offset:
-            cols.append(df.index.to_series())
-            names.append('Offset')
-        if t_sig:
-            cols.append(self.timeSignatures().iloc[:, 0])
-            names.append('TSig')
-        if key_sig:
-            cols.append(self.keySignatures().iloc[:, 0])
-            names.append('KeySig')
-        if sounding:
-            cols.append(self.soundingCount())
-            names.append('Sounding')
-        if progress:
-            prog = (df.index / self.notes().index[-1]).to_series()
-            prog.index = df.index
-            cols.append(prog)
-            names.append('Progress')
-        if lowest:
-            cols.append(self.lowLine())
-            names.append('Lowest')
-        if highest:
-            cols.append(self.highLine())
-            names.append('Highest')
-        temp = pd.concat(cols, axis=1, sort=True)
-        temp2 = temp.iloc[:, len(df.columns):].ffill()
-        if measure:
-            temp2.iloc[:, 0] = temp2.iloc[:, 0].astype(int)
-        mi = pd.MultiIndex.from_frame(temp2, names=names)
-        ret = temp.iloc[:, :len(df.columns)].copy()
-        ret.index = mi
+        names = [name for name, flag in (('Measure', measure), ('Beat', beat), ('Offset', offset),
+                 ('TSig', t_sig), ('KeySig', key_sig), ('Sounding', sounding), ('Progress', progress),
+                 ('Lowest', lowest), ('Highest', highest)) if flag]
+        offsets = df.index.to_numpy(dtype='float64')
+        timelines = {name: self._timeline(name) for name in names if name not in ('Offset', 'Progress')}
+        # every offset that would have a row if the df and the series behind its
+        # levels were aligned, which decides whether missing values change dtypes
+        allOffsets = np.unique(np.concatenate([offsets] + [tl[0] for tl in timelines.values()]))
+        gap = len(allOffsets) > len(np.unique(offsets))
+        levels = []
+        for name in names:
+            if name == 'Offset':
+                values = df.index.to_numpy()
+                if gap:
+                    values = values.astype(ImportedPiece._dtypeWithMissing(values.dtype))
+            elif name == 'Progress':
+                values = offsets / self._timeline('Progress')
+            else:
+                _, known, vals = timelines[name]
+                # each offset takes the last known value at or before it
+                positions = np.searchsorted(known, offsets, side='right') - 1
+                missing = positions < 0
+                dtype = vals.dtype
+                if missing.any() or len(known) < len(allOffsets):
+                    dtype = ImportedPiece._dtypeWithMissing(dtype)
+                values = vals[positions.clip(0)].astype(dtype) if len(vals) else np.full(len(offsets), np.nan)
+                if missing.any():
+                    values[missing] = np.nan
+            levels.append(values)
+        ret = df.copy()
+        if gap:
+            ret = ret.astype({col: ImportedPiece._dtypeWithMissing(dtype) for col, dtype in df.dtypes.items()})
+        ret.index = pd.MultiIndex.from_arrays(levels, names=names)
         ret.dropna(inplace=True, how='all')
         ret.sort_index(inplace=True)
         return ret
 
+    def _dtypeWithMissing(dtype):
+        '''
+        Return the dtype that pandas gives a column of `dtype` once it has missing
+        values, e.g. float64 for int64 and object for bool.'''
+        if isinstance(dtype, np.dtype) and dtype.kind in 'iu':
+            return np.dtype('float64')
+        if isinstance(dtype, np.dtype) and dtype.kind == 'b':
+            return np.dtype(object)
+        return dtype
+
+    def _timeline(self, name):
+        '''
+        Return a tuple of arrays for the `name` level of `detailIndex` (e.g.
+        "Measure" or "Lowest"): the offsets of the series behind it, the sorted
+        offsets where it has a value, and those values, so that any offset can find
+        the value in effect with one `searchsorted`. For "Progress" it's just the
+        offset of the last note or rest that progress is measured against. These
+        are built once per piece.'''
+        key = ('Timeline', name)
+        timeline = self.analyses.get(key)
+        if timeline is not None:
+            return timeline
+        if name == 'Progress':
+            timeline = self._notes().index[-1]
+        else:
+            if name == 'Measure':
+                ser = self.measures().iloc[:, 0]
+            elif name == 'Beat':
+                ser = self.beatIndex()
+            elif name == 'TSig':
+                ser = self.timeSignatures().iloc[:, 0]
+            elif name == 'KeySig':
+                ser = self.keySignatures().iloc[:, 0]
+            elif name == 'Sounding':
+                ser = self.soundingCount()
+            elif name == 'Lowest':
+                ser = self.lowLine()
+            else:
+                ser = self.highLine()
+            known = ser.notnull().to_numpy()
+            timeline = (ser.index.to_numpy(dtype='float64'), ser.index.to_numpy(dtype='float64')[known],
+                        ser.to_numpy()[known])
+        self.analyses[key] = timeline
+        return timeline
+
     def di(self, df, measure=True, beat=True, offset=False, t_sig=False, key_sig=False,
         sounding=False, progress=False, lowest=False, highest=False, _all=False):
         """
@@ -1068,18 +1496,6 @@ class ImportedPiece:
         return self.detailIndex(df=df, measure=measure, beat=beat, offset=offset, t_sig=t_sig,
             key_sig=key_sig, sounding=sounding, progress=progress, lowest=lowest, highest=highest, _all=_all)
 
-    def _beatStrengthHelper(self, noteOrRest):
-        '''
-        Return the beat strength of a note or rest.
-
-        This follows the music21 conventions where the downbeat is equal to 1, and
-        all other metric positions in a measure are given smaller numbers approaching
-        zero as their metric weight decreases.
-        '''
-        if hasattr(noteOrRest, 'beatStrength'):
-            return noteOrRest.beatStrength
-        return noteOrRest
-
     def beatStrengths(self):
         '''
         Returns a table of the beat strengths of all the notes and rests in
@@ -1089,10 +1505,52 @@ class ImportedPiece:
         
         Results from this method should not be sent to the `regularize` method.
         '''
-        if 'BeatStrength' not in self.analyses:
-            df = self._getM21ObjsNoTies().map(self._beatStrengthHelper)
-            self.analyses['BeatStrength'] = df
-        return self.analyses['BeatStrength']
+        res = self.analyses.get('BeatStrength')
+        if res is None:
+            parts = self.score.getElementsByClass(stream.Part)
+            values = [self._partBeatStrengths(part, flat_part, ser) for part, flat_part, ser
+                      in zip(parts, self._getFlatParts(), self._getPartSeries())]
+            res = self._pitchArrayFrame(values)
+            self.analyses['BeatStrength'] = res
+        return res
+
+    def _partBeatStrengths(self, part, flat_part, ser):
+        '''
+        Return an array of the beat strengths of the notes and rests in `ser`, one of
+        the `_getPartSeries`. Rather than having music21 search for the measure and
+        time signature of every note, this looks up each note's measure once, finds
+        its time signature by offset, and only asks music21 for the accent weight of
+        each distinct time signature and position. This follows music21's own
+        `beatStrength` logic, which is still used as-is for notes that aren't directly
+        in a measure (e.g. in a chord or a voice) or that have no time signature.
+        '''
+        inMeasure = {}
+        for measure in part.getElementsByClass(stream.Measure):
+            for noteOrRest in measure.getElementsByClass(['Note', 'Rest']):
+                inMeasure[id(noteOrRest)] = measure.elementOffset(noteOrRest) + measure.paddingLeft
+        tsigs = list(flat_part.getElementsByClass(meter.TimeSignature))
+        tsOffsets = np.array([flat_part.elementOffset(ts) for ts in tsigs], dtype='float64')
+        tsIndices = np.searchsorted(tsOffsets, ser.index.to_numpy(dtype='float64'), side='right') - 1
+        tsDetails = [(ts._getMeasureOffset(includeMeasurePadding=False), ts.barDuration.quarterLength)
+                     for ts in tsigs]
+        accents = {}
+        strengths = np.empty(len(ser), dtype='float64')
+        for i, (noteOrRest, tsIndex) in enumerate(zip(ser.values, tsIndices)):
+            mOffset = inMeasure.get(id(noteOrRest))
+            if mOffset is None or tsIndex < 0:
+                strengths[i] = noteOrRest.beatStrength
+                continue
+            tsMeasureOffset, barDuration = tsDetails[tsIndex]
+            if mOffset + tsMeasureOffset < barDuration:
+                position = mOffset
+            else:
+                position = (mOffset - tsMeasureOffset) % barDuration
+            key = (tsIndex, position)
+            if key not in accents:
+                accents[key] = tsigs[tsIndex].getAccentWeight(position, forcePositionMatch=True,
+                                                              permitMeterModulus=False)
+            strengths[i] = accents[key]
+        return strengths
 
     def _getM21TSigObjs(self):
         '''
@@ -1101,13 +1559,14 @@ class ImportedPiece:
         This is useful for getting the prevailing time signature at any given
         moment in the piece.
         '''
-        if 'M21TSigObjs' not in self.analyses:
+        df = self.analyses.get('M21TSigObjs')
+        if df is None:
             tsigs = []
             for part in self._getFlatParts():
                 tsigs.append(pd.Series({ts.offset: ts for ts in part.getTimeSignatures()}))
             df = pd.concat(tsigs, axis=1, sort=True)
             self.analyses['M21TSigObjs'] = df
-        return self.analyses['M21TSigObjs']
+        return df
 
     def timeSignatures(self):
         """
@@ -1118,12 +1577,13 @@ class ImportedPiece:
         from music21's `.ratioString` attribute. For example, 4/4 time is
         expressed as "4/4", 3/4 time is expressed as "3/4", etc.
         """
-        if 'TimeSignature' not in self.analyses:
+        df = self.analyses.get('TimeSignature')
+        if df is None:
             df = self._getM21TSigObjs()
             df = df.map(lambda ts: ts.ratioString, na_action='ignore')
             df.columns = self._getPartNames()
             self.analyses['TimeSignature'] = df
-        return self.analyses['TimeSignature']
+        return df
 
     def _getM21KeySigObjs(self):
         '''
@@ -1132,13 +1592,14 @@ class ImportedPiece:
         This is useful for getting the prevailing (systemic) key signature at
         any given moment in the piece.
         '''
-        if 'M21KeySigObjs' not in self.analyses:
+        df = self.analyses.get('M21KeySigObjs')
+        if df is None:
             ksigs = []
             for part in self._getFlatParts():
                 ksigs.append(pd.Series({ks.offset: ks for ks in part.getElementsByClass(['KeySignature'])}))
             df = pd.concat(ksigs, axis=1, sort=True)
             self.analyses['M21KeySigObjs'] = df
-        return self.analyses['M21KeySigObjs']
+        return df
 
     def keySignatures(self):
         """
@@ -1150,12 +1611,13 @@ class ImportedPiece:
         is a positive integer for the number of sharps, a negative integer for
         the number of flats, and 0 for no accidentals in the key signature.
         """
-        if 'KeySignature' not in self.analyses:
+        df = self.analyses.get('KeySignature')
+        if df is None:
             df = self._getM21KeySigObjs()
             df = df.map(lambda ks: ks.sharps, na_action='ignore')
             df.columns = self._getPartNames()
             self.analyses['KeySignature'] = df
-        return self.analyses['KeySignature']
+        return df
 
     def measures(self):
         """
@@ -1163,7 +1625,8 @@ class ImportedPiece:
 
         Measures are expressed as integers.
         """
-        if "Measure" not in self.analyses:
+        df = self.analyses.get("Measure")
+        if df is None:
             parts = self._getFlatParts()
             partMeasures = []
             for part in parts:
@@ -1172,7 +1635,7 @@ class ImportedPiece:
             df = pd.concat(partMeasures, axis=1, sort=True)
             df.columns = self._getPartNames()
             self.analyses["Measure"] = df
-        return self.analyses["Measure"]
+        return df
 
     def barlines(self):
         """
@@ -1180,7 +1643,8 @@ class ImportedPiece:
         picks them, but this seems to get all the double barlines which helps
         detect section divisions.
         """
-        if "Barline" not in self.analyses:
+        df = self.analyses.get("Barline")
+        if df is None:
             parts = self._getFlatParts()
             partBarlines = []
             for part in parts:
@@ -1189,7 +1653,7 @@ class ImportedPiece:
             df = pd.concat(partBarlines, axis=1, sort=True)
             df.columns = self._getPartNames()
             self.analyses["Barline"] = df
-        return self.analyses["Barline"]
+        return df
 
     def soundingCount(self):
         """
@@ -1200,13 +1664,14 @@ class ImportedPiece:
         It is also available in the `.detailIndex` method to add this information to
         almost any dataframe CRIM-Intervals provides.
         """
-        if not 'SoundingCount' in self.analyses:
-            nr = self.notes().ffill()
+        ser = self.analyses.get('SoundingCount')
+        if ser is None:
+            nr = self._notes().ffill()
             df = nr[nr != 'Rest']
             ser = df.count(axis=1)
             ser.name = 'Sounding'
             self.analyses['SoundingCount'] = ser
-        return self.analyses['SoundingCount']
+        return ser
 
     def _zeroIndexIntervals(ntrvl):
         '''
@@ -1220,63 +1685,91 @@ class ImportedPiece:
             return str(val - 1)
         return str(val + 1)
 
-    def _harmonicIntervalHelper(row):
-        if hasattr(row.iat[1], 'isRest') and hasattr(row.iat[0], 'isRest'):
-            if row.iat[1].isRest or row.iat[0].isRest:
-                return 'Rest'
-            elif row.iat[1].isNote and row.iat[0].isNote:
-                return interval.Interval(row.iat[0], row.iat[1])
-        return np.nan
-
-    def _melodicIntervalHelper(row):
-        if hasattr(row.iat[0], 'isRest'):
-            if row.iat[0].isRest:
-                return 'Rest'
-            elif row.iat[0].isNote and hasattr(row.iat[1], 'isNote') and row.iat[1].isNote:
-                return interval.Interval(row.iat[1], row.iat[0])
+    def _m21Kind(cell):
+        '''
+        Return 2 for a music21 rest, 1 for a music21 note, 0 for other music21
+        objects (e.g. chords) and NaN for anything else.
+        '''
+        if hasattr(cell, 'isRest'):
+            if cell.isRest:
+                return 2
+            return 1 if cell.isNote else 0
         return np.nan
 
-    def _melodifyPart(ser, end):
+    def _harmonicIntervalPair(pair, kinds):
         '''
-        Convert a series of music21 notes or rests to melodic intervals.
-
-        If end is `True`, the intervals will be from the end of the note to the start
-        of the next note. If end is `False`, the intervals will be from the start of
-        the note to the start of the next note.
+        Return a series of the music21 intervals between the two columns of the
+        `pair` df of music21 objects, after dropping empty rows and forward filling.
+        Rows where either part rests are "Rest", and rows with anything other than
+        two notes (e.g. chords) are NaN. `kinds` codes the cells of `pair` as
+        `_m21Kind` does. Only the note pairs are sent to music21.
         '''
-        ser.dropna(inplace=True)
-        shifted = ser.shift(1) if end else ser.shift(-1)
-        partDF = pd.concat([ser, shifted], axis=1, sort=True)
-        if end:
-            res = partDF.apply(ImportedPiece._melodicIntervalHelper, axis=1).dropna()
-        else:  # not a typo, this uses _harmonicIntervalHelper if end == False
-            res = partDF.apply(ImportedPiece._harmonicIntervalHelper, axis=1).dropna()
+        rows = pair.notna().any(axis=1).to_numpy()
+        pair = pair[rows].ffill()
+        kinds = kinds[rows].ffill().to_numpy(dtype='float64')
+        valid = ~np.isnan(kinds).any(axis=1)
+        res = np.full(len(pair), np.nan, dtype=object)
+        res[valid & (kinds == 2).any(axis=1)] = 'Rest'
+        notes = valid & (kinds == 1).all(axis=1)
+        res[notes] = [interval.Interval(low, high) for low, high in pair.to_numpy()[notes]]
+        return pd.Series(res, index=pair.index).infer_objects()
+
+    def _nameCodes(df):
+        '''
+        Return a 2D integer array coding the cells of `df`, a df of note names and
+        "Rest"s, and an array of the distinct note names. Notes are coded by their
+        position in the names array, rests are -2, and empty cells are -1.
+        '''
+        codes, uniques = pd.factorize(df.to_numpy(dtype=object).ravel())
+        uniques = np.asarray(uniques, dtype=object)
+        isRest = uniques == 'Rest'
+        mapping = np.full(len(uniques), -2, dtype='int64')
+        mapping[~isRest] = np.arange((~isRest).sum())
+        codes = np.where(codes >= 0, mapping[codes], -1)
+        return codes.reshape(df.shape), uniques[~isRest]
+
+    def _labelIntervals(low, high, names, settings):
+        '''
+        Return an object array holding the labels, in the given settings, of the
+        intervals between the coded cells `low` and `high` where both are notes, and
+        NaN elsewhere.
+        '''
+        res = np.full(len(low), np.nan, dtype=object)
+        notes = (low >= 0) & (high >= 0)
+        res[notes] = interval_labels.label_codes(settings, names, low[notes], high[notes])
         return res
 
-    def _strToM21Obj(cell):
+    def _melodifyPart(codes, index, names, settings, end):
         '''
-        Convert a df cell from a string to a music21 note or rest. NAs are ignored.'''
-        if cell == 'Rest':
-            return note.Rest()
-        return note.Note(cell)
+        Return a series of the melodic intervals of one part from the column of
+        `codes` made by `_nameCodes`, labelled in the given settings.
 
-    def _getM21MelodicIntervals(self, end, df):
-        key = 'M21MelodicIntervals' + 'End' if end else 'Start'
-        if key not in self.analyses or df is not None:
-            if df is None:
-                m21Objs = self._getM21ObjsNoTies()
-            else:
-                m21Objs = df.map(ImportedPiece._strToM21Obj, na_action='ignore')
-            _df = m21Objs.apply(ImportedPiece._melodifyPart, args=(end,))
-            if df is not None:
-                return _df
-            self.analyses[key] = _df
-        return self.analyses[key]
+        If end is `True`, each interval is associated with its second note, and a rest
+        is "Rest" whatever came before it. If end is `False`, each interval is associated
+        with its first note, and it is "Rest" when either of its two events is a rest.
+        '''
+        sounding = codes != -1
+        codes, index = codes[sounding], index[sounding]
+        if end:
+            prev = np.concatenate(([-1], codes[:-1]))
+            res = ImportedPiece._labelIntervals(prev, codes, names, settings)
+            res[codes == -2] = 'Rest'
+        else:
+            nxt = np.concatenate((codes[1:], [-1]))
+            res = ImportedPiece._labelIntervals(codes, nxt, names, settings)
+            res[(nxt != -1) & ((codes == -2) | (nxt == -2))] = 'Rest'
+        keep = pd.notna(res)
+        return pd.Series(res[keep], index=index[keep], dtype=object)
 
-    def _getRegularM21MelodicIntervals(self, unit):
-        m21Objs = self._getM21ObjsNoTies()
-        m21Objs = self.regularize(m21Objs, unit=unit)
-        return m21Objs.apply(ImportedPiece._melodifyPart, args=(True,))
+    def _melodicIntervals(self, df, settings, end):
+        '''
+        Return the melodic intervals of every part of `df`, a df of note names and
+        "Rest"s, labelled in the given `(kind, directed, compound)` settings.
+        '''
+        codes, names = ImportedPiece._nameCodes(df)
+        parts = {col: ImportedPiece._melodifyPart(codes[:, i], df.index, names, settings, end)
+                 for i, col in enumerate(df.columns)}
+        return pd.DataFrame(parts, columns=df.columns).infer_objects()
 
     def _qualityDirectedCompound(cell):
         if hasattr(cell, 'direction'):
@@ -1319,6 +1812,7 @@ class ImportedPiece:
             res = res.shift(-1)
         return res
 
+    @analysis_cache.memoize('DurationalRatios', inputs=('Duration',), uncached=('df',))
     def durationalRatios(self, df=None, end=True):
         '''
         Return durational ratios of each item in each column compared to the
@@ -1330,19 +1824,11 @@ class ImportedPiece:
         durational ratios with the start of the first event rather than with the
         start of the second event.
         '''
-        cachable = False
-        key = ('DurationalRatios', end)
         if df is None:
-            cachable = True
-            if key in self.analyses:
-                return self.analyses['DurationalRatios']
             df = self.durations()
-        res = df.apply(self._durationalRatioHelper, args=(end,)).dropna(how='all')
-        if cachable:
-            self.analyses['DurationalRatios'] = res
-        return res
+        return df.apply(self._durationalRatioHelper, args=(end,)).dropna(how='all')
 
-    def distance(self, df=None, n=3):
+    def distance(self, df=None, n=3, max_distance=None):
         '''
         Return the distances between all the values in df which should be a
         dataframe of strings of integer ngrams. Specifically, this is meant for
@@ -1359,12 +1845,19 @@ class ImportedPiece:
         n : int, optional (default 3)
             The ngram length to use when `df` is not passed. Ignored if `df`
             is passed.
+        max_distance : int, optional
+            If passed, only the pairs of ngrams at most this far apart are
+            returned, as an edge list instead of the full matrix. This keeps
+            memory proportional to the number of close pairs, which matters
+            when there are thousands of unique ngrams.
 
         Returns
         -------
         pandas.DataFrame
             A square distance matrix indexed and columned by the unique ngram
-            values found in `df`.
+            values found in `df`. If `max_distance` is passed, a df with a row
+            for each pair of ngrams within that distance instead, with
+            "source", "match", and "distance" columns.
 
         Examples
         --------
@@ -1409,27 +1902,75 @@ class ImportedPiece:
         ```python
         col[col <= 2]
         ```
+
+        To get just the pairs of ngrams within a distance of 2 of each other,
+        which is much lighter on pieces with many unique ngrams, do this:
+
+        ```python
+        edges = importedPiece.distance(n=4, max_distance=2)
+        edges[edges['source'] == target]
+        ```
+        '''
+        return self._distanceHelper(df, n, None, max_distance)
+
+    def _ngramArray(values):
+        '''
+        Return a 2D int array with a row of the integers in each of the ngrams in
+        `values`, which are strings like "1, -2, 1" or tuples. Raises a ValueError
+        if the ngrams are not all the same length.'''
+        rows = [tuple_to_list(cell, cast=int) for cell in values]
+        lengths = sorted({len(row) for row in rows})
+        if len(lengths) > 1:
+            raise ValueError('Expected ngrams of the same length, got lengths {}.'.format(lengths))
+        return np.array(rows, dtype='int64').reshape(len(values), -1)
+
+    def _ngramDistances(a, b, head_flex=None, max_distance=None):
+        '''
+        Return the distances between the ngrams in the rows of the 2D int arrays `a`
+        and `b`, i.e. the sums of the absolute differences of their items. If
+        `head_flex` is passed, a difference of at most `head_flex` in the first item
+        counts as none. Without `max_distance` this is the dense len(a) x len(b)
+        matrix, and otherwise it's a tuple of arrays of the row in `a`, the row in
+        `b`, and the distance of every pair at most `max_distance` apart, in row
+        major order. The rows of `a` are compared in chunks to bound memory.'''
+        step = max(1, DISTANCE_CHUNK_CELLS // max(1, b.size))
+        chunks = []
+        for start in range(0, len(a), step):
+            diff = np.abs(a[start:start + step, None, :] - b[None, :, :])
+            if head_flex is not None and diff.shape[2]:
+                head = diff[:, :, 0]
+                head[head <= head_flex] = 0
+            dist = diff.sum(axis=2)
+            if max_distance is None:
+                chunks.append(dist)
+            else:
+                rows, cols = np.nonzero(dist <= max_distance)
+                chunks.append((rows + start, cols, dist[rows, cols]))
+        if max_distance is None:
+            return np.concatenate(chunks) if chunks else np.zeros((0, len(b)), dtype='int64')
+        if not chunks:
+            return tuple(np.zeros(0, dtype='int64') for _ in range(3))
+        return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+
+    def _distanceHelper(self, df, n, head_flex, max_distance):
         '''
+        Shared implementation of `distance` and `flexed_distance`.'''
         if df is None:
             df = self.melodic('z', True, True)
             df = self.ngrams(df=df, n=n, exclude=['Rest'])
         uni = df.stack().unique()
-        ser = pd.Series(uni)
-        df = pd.DataFrame.from_records(ser.apply(lambda cell: tuple(tuple_to_list(cell, cast=int))))
-        cols = [(df - df.loc[i]).abs().apply(sum, axis=1) for i in df.index]
-        dist = pd.concat(cols, axis=1, sort=True)
+        arr = ImportedPiece._ngramArray(uni)
+        res = ImportedPiece._ngramDistances(arr, arr, head_flex, max_distance)
+        if max_distance is not None:
+            source, match, dist = res
+            return pd.DataFrame({'source': uni[source], 'match': uni[match], 'distance': dist})
+        dist = pd.DataFrame(res)
         dist.columns = uni
         dist.index = uni
         return dist
 
-    # July 2022 helper for flexed entries
-    def _flexed_sum(self, item, head_flex):
-        if item[0] <= head_flex:
-            item[0] = 0
-        return sum(item)
-
     # July 2022 helper for flexed entries updated
-    def flexed_distance(self, head_flex, df=None, n=3):
+    def flexed_distance(self, head_flex, df=None, n=3, max_distance=None):
           '''
           Return the distances between all the values in df which should be a
           dataframe of strings of integer ngrams. Specifically, this is meant for
@@ -1460,12 +2001,17 @@ class ImportedPiece:
           n : int, optional (default 3)
               The ngram length to use when `df` is not passed. Ignored if `df`
               is passed.
+          max_distance : int, optional
+              If passed, only the pairs of ngrams at most this far apart are
+              returned, as an edge list instead of the full matrix.
 
           Returns
           -------
           pandas.DataFrame
               A square distance matrix indexed and columned by the unique ngram
-              values found in `df`, using the flexed head comparison.
+              values found in `df`, using the flexed head comparison. If
+              `max_distance` is passed, a df with "source", "match", and
+              "distance" columns for each pair within that distance instead.
 
           Examples
           --------
@@ -1511,18 +2057,10 @@ class ImportedPiece:
           col[col <= 2]
           ```
           '''
-          if df is None:
-              df = self.melodic('z', True, True)
-              df = self.ngrams(df=df, n=n, exclude=['Rest'])
-          uni = df.stack().unique()
-          ser = pd.Series(uni)
-          df = pd.DataFrame.from_records(ser.apply(lambda cell: tuple(tuple_to_list(cell, cast=int))))
-          cols = [(df - df.loc[i]).abs().apply(self._flexed_sum, axis=1, args=(head_flex,)) for i in df.index]
-          dist = pd.concat(cols, axis=1, sort=True)
-          dist.columns = uni
-          dist.index = uni
-          return dist
+          return self._distanceHelper(df, n, head_flex, max_distance)
 
+    @analysis_cache.memoize('MelodicIntervals', inputs=('Notes',), uncached=('unit', 'df'),
+                            canonical={'kind': _intervalKind})
     def melodic(self, kind='q', directed=True, compound=True, unit=0, end=True, df=None):
         '''
         Return melodic intervals for all voice pairs. Each melodic interval
@@ -1583,21 +2121,18 @@ class ImportedPiece:
         pandas.DataFrame
             Melodic intervals in each part.
         '''
-        kind = kind[0].lower()
-        kind = {'s': 'c'}.get(kind, kind)
+        kind = _intervalKind(kind)
         _kind = {'z': 'd'}.get(kind, kind)
         settings = (_kind, directed, compound)
-        key = ('MelodicIntervals', kind, directed, compound, end)
-        if key not in self.analyses or unit or df is not None:
-            _df = self._getRegularM21MelodicIntervals(unit) if unit else self._getM21MelodicIntervals(end, df)
-            _df = _df.map(self._intervalMethods[settings], na_action='ignore')
-            if kind == 'z':
-                _df = _df.map(ImportedPiece._zeroIndexIntervals, na_action='ignore')
-            if unit or df is not None:
-                return _df
-            else:
-                self.analyses[key] = _df
-        return self.analyses[key]
+        if unit:
+            notes = self.regularize(self._notes(combineRests=False), unit=unit)
+            _df = self._melodicIntervals(notes, settings, end=True)
+        else:
+            notes = self._notes(combineRests=False) if df is None else df
+            _df = self._melodicIntervals(notes, settings, end)
+        if kind == 'z':
+            _df = _df.map(ImportedPiece._zeroIndexIntervals, na_action='ignore')
+        return _df
 
     def _patternToSeries(self, pattern):
         output_list = []
@@ -1660,7 +2195,7 @@ class ImportedPiece:
         # runs sns plot layout
         self._plot_default()
 
-        local_ngrams = pd.DataFrame(columns=self.notes().columns)
+        local_ngrams = pd.DataFrame(columns=self._notes().columns)
 
         if length < 1:
             print("Please use length >= 1")
@@ -1675,7 +2210,7 @@ class ImportedPiece:
             loop_start = length
 
         for i in range(loop_start, length + 1):
-            loop_notes = self.notes(combineUnisons=True)
+            loop_notes = self._notes(combineUnisons=True)
             loop_melodic = self.melodic(df=loop_notes, kind=kind, end=end)
             if useEntries:
                 loop_ngrams = self.entries(df=loop_melodic, n=int(i), exclude=["Rest"]).fillna('')
@@ -1708,59 +2243,72 @@ class ImportedPiece:
             plt.title("Total Number of Patterns: " + str(len(graph_pattern_list)) + "\n Piece Name: " + self.metadata["title"])
         plt.show()
 
-    # fixed helper
-    def _getM21HarmonicIntervals(self, againstLow=False, df=None):
-            """
-            Return m21 interval objects for every pair of intervals in the piece.
+    def _harmonicIntervals(self, settings, againstLow=False, df=None):
+        '''
+        Return the harmonic intervals, labelled in the given `(kind, directed, compound)`
+        settings, for every pair of voices in `df`, a df of note names and "Rest"s
+        (the notes of the piece by default). This does all pairs between voices if
+        `againstLow` is `False` (default) or each voice against the lowest sounding
+        note if `againstLow` is `True`.
+        '''
+        notes = self._notes(combineRests=False) if df is None else df
+        if againstLow:
+            low = self.lowLine()
+            if df is not None:
+                low = low.loc[low.index.intersection(df.index)]
+            lowIndex = len(notes.columns)
+            combos = [(lowIndex, x) for x in range(len(notes.columns))]
+            notes = pd.concat([notes, low], axis=1)
+        else:
+            combos = combinations(range(len(notes.columns) - 1, -1, -1), 2)
+        codes, names = ImportedPiece._nameCodes(notes)
+        pairs = []
+        for combo in combos:
+            pair = codes[:, list(combo)]
+            # drop the rows where neither voice has an event and forward fill the rest
+            rows = (pair != -1).any(axis=1)
+            pair = pair[rows]
+            positions = np.where(pair != -1, np.arange(len(pair))[:, None], 0)
+            pair = pair[np.maximum.accumulate(positions, axis=0), [0, 1]]
+            low, high = pair[:, 0], pair[:, 1]
+            res = ImportedPiece._labelIntervals(low, high, names, settings)
+            res[(low != -1) & (high != -1) & ((low == -2) | (high == -2))] = 'Rest'
+            # name each column according to the voice names that make up the intervals
+            name = '_'.join((notes.columns[combo[0]], notes.columns[combo[1]]))
+            pairs.append(pd.Series(res, index=notes.index[rows], name=name).infer_objects())
+        if pairs:
+            return pd.concat(pairs, axis=1, sort=True)
+        return pd.DataFrame()
 
-            This does all pairs between voices if `againstLow` is `False` (default) or
-            each voice against the lowest sounding note if `againstLow` is `True`.
-            """
-            key = ('M21HarmonicIntervals', againstLow)
-            
-            # Fixed: Only use cache when df is None (like the melodic version)
-            if key not in self.analyses or df is not None:
-                if df is None:
-                    m21Objs = self._getM21ObjsNoTies()
-                else:
-                    sampleVal = df.stack(future_stack=True).dropna().iat[0]
-                    if isinstance(sampleVal, str):
-                        m21Objs = df.map(ImportedPiece._strToM21Obj, na_action='ignore')
-                    else:
-                        m21Objs = df
-                
-                pairs = []
-                if againstLow:
-                    low = self.lowLine()
-                    if df is not None:
-                        # Fixed: Use the actual df index range, not just first to last
-                        low = low.loc[low.index.intersection(df.index)]
-                    low = low.apply(lambda val: note.Note(val) if val != 'Rest' else note.Rest())
-                    lowIndex = len(m21Objs.columns)
-                    combos = [(lowIndex, x) for x in range(len(m21Objs.columns))]
-                    m21Objs = pd.concat([m21Objs, low], axis=1)
-                else:
-                    combos = combinations(range(len(m21Objs.columns) - 1, -1, -1), 2)
-                
-                for combo in combos:
-                    df_combo = m21Objs.iloc[:, list(combo)].dropna(how='all').ffill()
-                    ser = df_combo.apply(ImportedPiece._harmonicIntervalHelper, axis=1)
-                    # name each column according to the voice names that make up the intervals
-                    ser.name = '_'.join((m21Objs.columns[combo[0]], m21Objs.columns[combo[1]]))
-                    pairs.append(ser)
-                
-                if pairs:
-                    ret = pd.concat(pairs, axis=1, sort=True)
-                else:
-                    ret = pd.DataFrame()
+    def _getM21HarmonicIntervals(self, againstLow=False, df=None):
+        '''
+        Return m21 interval objects for every pair of voices in `df`, a df of music21
+        notes and rests. This does all pairs between voices if `againstLow` is `False`
+        (default) or each voice against the lowest sounding note if `againstLow` is `True`.
+        '''
+        m21Objs = df
+        kinds = df.map(ImportedPiece._m21Kind)
+        if againstLow:
+            low = self.lowLine()
+            low = low.loc[low.index.intersection(df.index)]
+            lowKinds = pd.Series(np.where(low == 'Rest', 2, 1), index=low.index)
+            low = low.apply(lambda val: note.Note(val) if val != 'Rest' else note.Rest())
+            lowIndex = len(m21Objs.columns)
+            combos = [(lowIndex, x) for x in range(len(m21Objs.columns))]
+            m21Objs = pd.concat([m21Objs, low], axis=1)
+            kinds = pd.concat([kinds, lowKinds], axis=1)
+        else:
+            combos = combinations(range(len(m21Objs.columns) - 1, -1, -1), 2)
+        pairs = []
+        for combo in combos:
+            ser = ImportedPiece._harmonicIntervalPair(m21Objs.iloc[:, list(combo)], kinds.iloc[:, list(combo)])
+            # name each column according to the voice names that make up the intervals
+            ser.name = '_'.join((m21Objs.columns[combo[0]], m21Objs.columns[combo[1]]))
+            pairs.append(ser)
+        if pairs:
+            return pd.concat(pairs, axis=1, sort=True)
+        return pd.DataFrame()
 
-                # Fixed: Only cache when df is None (like the melodic version)
-                if df is not None:
-                    return ret
-                else:
-                    self.analyses[key] = ret
-            
-            return self.analyses[key]
     # def _getM21HarmonicIntervals(self, againstLow=False, df=None):
     #     """
     #     Return m21 interval objects for every pair of intervals in the piece.
@@ -1803,6 +2351,8 @@ class ImportedPiece:
     #         self.analyses[key] = ret
     #     return self.analyses[key]
     # update har to correct caching. etc
+    @analysis_cache.memoize('HarmonicIntervals', inputs=('Notes', 'LowLine'), uncached=('df',),
+                            canonical={'kind': _intervalKind})
     def harmonic(self, kind='q', directed=True, compound=True, againstLow=False, df=None):
         '''
         Return harmonic intervals for all voice pairs.
@@ -1847,27 +2397,17 @@ class ImportedPiece:
             Harmonic intervals in each pair in the format specified by the
             `kind`, `directed`, and `compound` parameters.
         '''
-        kind = kind[0].lower()
-        kind = {'s': 'c'}.get(kind, kind)
+        kind = _intervalKind(kind)
         _kind = {'z': 'd'}.get(kind, kind)
         settings = (_kind, directed, compound)
-        key = ('HarmonicIntervals', kind, directed, compound, againstLow)
-        
-        # Fixed logic: when df is provided OR key not in cache, compute intervals
-        if df is not None or key not in self.analyses:
+        if df is None or isinstance(df.stack(future_stack=True).dropna().iat[0], str):
+            _df = self._harmonicIntervals(settings, againstLow, df)
+        else:
             _df = self._getM21HarmonicIntervals(againstLow, df)
             _df = _df.map(self._intervalMethods[settings], na_action='ignore')
-            if kind == 'z':
-                _df = _df.map(ImportedPiece._zeroIndexIntervals, na_action='ignore')
-            _df = _df.sort_index()
-            
-            # Fixed caching logic: only cache when df is None (standard behavior)
-            if df is not None:
-                return _df  # Return computed result for custom df without caching
-            else:
-                self.analyses[key] = _df  # Cache result for standard behavior
-        
-        return self.analyses[key]
+        if kind == 'z':
+            _df = _df.map(ImportedPiece._zeroIndexIntervals, na_action='ignore')
+        return _df.sort_index()
     # def harmonic(self, kind='q', directed=True, compound=True, againstLow=False, df=None):
     #     '''
     #     Return harmonic intervals for all voice pairs.
@@ -1971,72 +2511,85 @@ class ImportedPiece:
 
         return entry_modules
 
-    def _ngrams_offsets_helper(col, _n, offsets):
+    def _windowCodes(codes, n):
+        """
+        Return a read-only 2D view of the 1D array `codes` with a row for every
+        window of `n` consecutive codes.
         """
-        Generate a list of series that align the notes from one ngrams according
-        to the first or the last note's offset.
+        if len(codes) < n:
+            return np.empty((0, n), dtype=codes.dtype)
+        return np.lib.stride_tricks.sliding_window_view(codes, n)
 
-        Parameters
-        ----------
-        col : pandas.Series
-            A column that originally contains notes and rests.
-        _n : int
-            The size of the ngram.
-        offsets : str
-            We could input 'first' if we want to group the ngrams by their
-            first note's offset, 'last' if we want to group the ngram by the
-            last note's offset, or 'both' if we want to multi-index on both
-            of these simultaneously.
+    def _decodeWindows(windows, decode):
+        """
+        Return an object array with `decode(row)` for each row of the 2D array of
+        codes `windows`. Each distinct window is only decoded once.
+        """
+        res = np.empty(len(windows), dtype=object)
+        if len(windows):
+            unique, inverse = np.unique(windows, axis=0, return_inverse=True)
+            decoded = np.empty(len(unique), dtype=object)
+            decoded[:] = [decode(row) for row in unique]
+            res[:] = decoded[inverse.reshape(-1)]
+        return res
 
-        Returns
-        -------
-        pandas.DataFrame
-            A DataFrame of ngrams sorted by the first or last note's offset,
-            or by both with a multi-index.
+    def _windowIndex(index, n, offsets):
         """
+        Return the index for the windows of `n` consecutive events in `index`,
+        according to the offset of their first or last events, or both.
+        """
+        first, last = index[:len(index) - n + 1], index[n - 1:]
         if offsets == 'both':
-            first = pd.concat([col.shift(-i) for i in range(_n)], axis=1, sort=True)
-            last = pd.concat([col.shift(i) for i in range(_n - 1, -1, -1)], axis=1, sort=True)
-            mi = pd.MultiIndex.from_arrays([first.index[:-_n + 1], last.index[_n - 1:]], names=['First', 'Last'])
-            chunks = first.iloc[:-_n + 1].copy()
-            chunks.index = mi
-        elif offsets == 'last':
-            chunks = pd.concat([col.shift(i) for i in range(_n - 1, -1, -1)], axis=1, sort=True)
-        else: # offsets == 'first'
-            chunks = pd.concat([col.shift(-i) for i in range(_n)], axis=1, sort=True)
-        return chunks
+            return pd.MultiIndex.from_arrays([first, last], names=['First', 'Last'])
+        return last if offsets == 'last' else first
+
+    def _runBounds(isRest):
+        """
+        Return arrays of the start and (exclusive) end positions of every run of
+        consecutive `False` values in the boolean array `isRest`.
+        """
+        edges = np.diff(np.concatenate(([0], (~isRest).astype('int8'), [0])))
+        return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
 
     def _ngramHelper(col, n, exclude, offsets):
-        col.dropna(inplace=True)
+        col = col.dropna()
         if n == -1:
-            # get the starting and ending elements of ngrams
-            starts = col[(col != 'Rest') & (col.shift(1).isin(('Rest', np.nan)))]
-            ends = col[(col != 'Rest') & (col.shift(-1).isin(('Rest', np.nan)))]
-            si = tuple(col.index.get_loc(i) for i in starts.index)
-            ei = tuple(col.index.get_loc(i) + 1 for i in ends.index)
+            # the longest ngrams between rests
+            starts, ends = ImportedPiece._runBounds(col.to_numpy() == 'Rest')
             if offsets == 'last':
-                ind = ends.index
+                ind = col.index[ends - 1]
             elif offsets == 'both':
-                ind = pd.MultiIndex.from_arrays([starts.index, ends.index], names=['First', 'Last'])
+                ind = pd.MultiIndex.from_arrays([col.index[starts], col.index[ends - 1]], names=['First', 'Last'])
             else: # offsets == 'first'
-                ind = starts.index
-            vals = [', '.join(col.iloc[si[i]: ei[i]]) for i in range(len(si))]
-            ser = pd.Series(vals, name=col.name, index=ind)
-            return ser
-
-        chains = ImportedPiece._ngrams_offsets_helper(col, n, offsets)
-        if len(exclude):
-            chains = chains[chains.apply(lambda row: row.str.contains('|'.join(exclude), regex=True)) == False]
-        chains.dropna(inplace=True)
+                ind = col.index[starts]
+            values = col.to_numpy()
+            vals = [', '.join(values[start:end]) for start, end in zip(starts, ends)]
+            return pd.Series(vals, name=col.name, index=ind, dtype=object)
+
+        codes, vocab = pd.factorize(col)
+        if n > 1:
+            # as in a row of shifted copies of the column, e.g. ints become floats
+            vocab = vocab.astype(col.shift(1).dtype)
+        windows = ImportedPiece._windowCodes(codes, n)
+        index = ImportedPiece._windowIndex(col.index, n, offsets)
+        if len(exclude) and len(windows):
+            excluded = pd.Series(vocab).str.contains('|'.join(exclude), regex=True)
+            excluded = excluded.fillna(True).to_numpy(dtype=bool)
+            keep = ~excluded[windows].any(axis=1)
+            windows, index = windows[keep], index[keep]
+        if not len(windows):
+            return pd.Series(dtype='float64', index=index)
+        # strings or tuples are only made at the end, once for each distinct window
+        items = vocab.tolist()
         if col.dtype.name == 'str':
-            chains = chains.apply(lambda row: ', '.join(row), axis=1)
+            vals = ImportedPiece._decodeWindows(windows, lambda row: ', '.join([items[i] for i in row]))
         else:
-            chains = chains.apply(tuple, axis=1)
-        return chains
+            vals = ImportedPiece._decodeWindows(windows, lambda row: tuple([items[i] for i in row]))
+        return pd.Series(vals, index=index)
 
     def ngrams(self, df=None, n=3, how='columnwise', other=None, held='Held',
                   exclude=['Rest'], interval_settings=('d', True, True), unit=0,
-                  offsets='first', show_both=False):
+                  offsets='first', show_both=False, tokens=False):
         '''
         Generate n-grams from the given dataframe (df) or from the harmonic and
         melodic intervals of the piece.
@@ -2100,6 +2653,12 @@ class ImportedPiece:
             shown. If False, only the melodic motion of the lower voice is shown.
             This added information is needed to disambiguate some complex contrapuntal
             modules.
+        tokens : bool
+            If True, each ngram is returned as an integer id from a vocabulary shared
+            by all pieces (see the `ngram_vocab` module) instead of as a string or
+            tuple. The same ngram always gets the same id, so this is a compact and
+            fast way to compare ngrams across pieces. Use `ngram_vocab.decode_frame`
+            to get the strings back.
 
         When a dataframe is passed as `df` and nothing is given for `other`, this
         is the simple case where the events in each column of the `df` DataFrame
@@ -2163,6 +2722,11 @@ class ImportedPiece:
         cadential voice function evasion by dropout and also to be able to detect
         which voice attacks at a dissonance.
         '''
+        if tokens:
+            ngrams = self.ngrams(df=df, n=n, how=how, other=other, held=held, exclude=exclude,
+                                 interval_settings=interval_settings, unit=unit,
+                                 offsets=offsets, show_both=show_both)
+            return ngram_vocab.encode_frame(ngrams)
         if df is not None and other is None:
             how = 'columnwise'
         elif (df is not None and other is not None) or (df is None and other is None):
@@ -2196,36 +2760,40 @@ class ImportedPiece:
             combo.dropna(subset=(pair,), inplace=True)
             filler = held + ':' + held if show_both else held
             combo[lowerVoice] = combo[lowerVoice].fillna(filler)
-            combo.insert(loc=1, column='Joiner', value=', ')
-            combo['_'] = '_'
+            mel = combo[lowerVoice].to_numpy(dtype=object)
+            har = combo[pair].to_numpy(dtype=object)
+            # each step is a harmonic interval and the lower voice's motion to the next one
+            steps = har[:-1] + '_' + mel[1:]
             if n == -1:
-                har = df[pair].dropna()
-                starts = har[(har != 'Rest') & (har.shift(1).isin(('Rest', np.nan)))]
-                ends = har[(har != 'Rest') & (har.shift(-1).isin(('Rest', np.nan)))]
-                starts.dropna(inplace=True)
-                ends.dropna(inplace=True)
-                si = tuple(har.index.get_loc(i) for i in starts.index)
-                ei = tuple(har.index.get_loc(i) + 1 for i in ends.index)
-                col = [''.join([cell for row in combo.iloc[si[i]: ei[i]].values  # second loop
-                                         for cell in row][2:-1])  # innermost loop
-                       for i in range(len(si))]  # outermost loop
-                col = pd.Series(col)
+                starts, ends = ImportedPiece._runBounds(har == 'Rest')
+                col = pd.Series([', '.join(list(steps[start:end - 1]) + [har[end - 1]])
+                                 for start, end in zip(starts, ends)], dtype=object)
                 if offsets == 'last':
-                    col.index = ends.index
+                    col.index = combo.index[ends - 1]
                 elif offsets == 'both':
-                    col.index = pd.MultiIndex.from_arrays([starts.index, ends.index], names=['First', 'Last'])
+                    col.index = pd.MultiIndex.from_arrays([combo.index[starts], combo.index[ends - 1]],
+                                                          names=['First', 'Last'])
                 else: # offsets == 'first'
-                    col.index = starts.index
+                    col.index = combo.index[starts]
             else:  # n >= 1
-                lastIndex = -1
+                # open-ended modules are a single step, otherwise there are n - 1 steps and a last harmonic interval
+                stepCodes, stepVocab = pd.factorize(steps)
+                harCodes, harVocab = pd.factorize(har)
                 if n == 1:
-                    lastIndex = -3
-                    n = 2
-                combo = ImportedPiece._ngrams_offsets_helper(combo, n, offsets)
-                col = combo.iloc[:, 2:lastIndex].dropna().apply(lambda row: ''.join(row), axis=1)
+                    windows = ImportedPiece._windowCodes(stepCodes, 1)
+                    index = ImportedPiece._windowIndex(combo.index, 2, offsets)
+                else:
+                    windows = np.column_stack((ImportedPiece._windowCodes(stepCodes, n - 1)[:len(har) - n + 1],
+                                               harCodes[n - 1:]))
+                    index = ImportedPiece._windowIndex(combo.index, n, offsets)
+                stepVocab, harVocab = stepVocab.tolist(), harVocab.tolist()
+                vals = ImportedPiece._decodeWindows(
+                    windows, lambda row: ', '.join([stepVocab[i] for i in row[:-1]] + [harVocab[row[-1]]])
+                    if n > 1 else stepVocab[row[0]])
+                col = pd.Series(vals, index=index, dtype=object)
                 if exclude:
-                    mask = col.apply(lambda cell: all([excl not in cell for excl in exclude]))
-                    col = col[mask]
+                    excluded = [cell for cell in pd.unique(vals) if any(excl in cell for excl in exclude)]
+                    col = col[~col.isin(excluded)]
             col.name = pair
             cols.append(col)
         # in case piece has no harmony and cols stays empty
@@ -2320,36 +2888,55 @@ class ImportedPiece:
             res1.update(res2)
             return res1
 
-    def _cvf_helper(self, row, df):
-        '''
-        Assign the cadential voice function of the lower and upper voices in
-        each pair to their respective part name columns. This allows any label from
-        any pair to overwrite the label from a previous pair. The one exception is
-        that a Cantizans can't overwrite an Altizans, and if it tries to, the
-        accompanying Bassizans gets rewritten to be a Qunitizans.'''
-        if (row.name in df.index and 'A' in df.loc[(slice(None), row.name[1]), row.UpperVoice].values
-            and row.LowerCVF == 'B' and row.UpperCVF == 'C'):
-            df.loc[row.name, [row.LowerVoice, row.UpperVoice]] = ('Q', 'A')
-        elif (row.name in df.index and 'A' in df.loc[(slice(None), row.name[1]), row.LowerVoice].values
-            and row.LowerCVF == 'C' and row.UpperCVF == 'B'):
-            df.loc[row.name, [row.LowerVoice, row.UpperVoice]] = ('A', 'Q')
-        elif (row.name in df.index and 'A' in df.loc[(slice(None), row.name[1]), row.UpperVoice].values
-            and row.UpperCVF == 'C'):
-            df.loc[row.name, [row.LowerVoice, row.UpperVoice]] = (row.LowerCVF, 'A')
+    def _cvf_helper(self, df):
+        '''
+        Return a df of the cadential voice functions of the pairs in `df`, with the
+        lower and upper labels of each pair assigned to their respective part name
+        columns. Pairs are taken in order, so any label from any pair can overwrite the
+        label from a previous pair. The one exception is that a Cantizans can't overwrite
+        an Altizans, and if it tries to, the accompanying Bassizans gets rewritten to be a
+        Qunitizans.'''
+        rows = {}  # (First, Last): {voice: label}
+        atLast = {}  # Last: the rows ending at that offset
+        for name, lowerVoice, upperVoice, lowerCVF, upperCVF in zip(
+                df.index, df.LowerVoice, df.UpperVoice, df.LowerCVF, df.UpperCVF):
+            row = rows.get(name)
+            if row is None:
+                row = rows[name] = {}
+                atLast.setdefault(name[1], []).append(row)
+                labels = (lowerCVF, upperCVF)
+            else:
+                upperA = any(other.get(upperVoice) == 'A' for other in atLast[name[1]])
+                if upperA and lowerCVF == 'B' and upperCVF == 'C':
+                    labels = ('Q', 'A')
+                elif (lowerCVF == 'C' and upperCVF == 'B'
+                      and any(other.get(lowerVoice) == 'A' for other in atLast[name[1]])):
+                    labels = ('A', 'Q')
+                elif upperA and upperCVF == 'C':
+                    labels = (lowerCVF, 'A')
+                else:
+                    labels = (lowerCVF, upperCVF)
+            row[lowerVoice], row[upperVoice] = labels
+        if rows:
+            index = pd.MultiIndex.from_tuples(list(rows), names=df.index.names)
         else:
-            df.loc[row.name, [row.LowerVoice, row.UpperVoice]] = (row.LowerCVF, row.UpperCVF)
+            index = pd.MultiIndex.from_arrays([[], []], names=df.index.names)
+        return pd.DataFrame(list(rows.values()), index=index, columns=self._getPartNames(), dtype=object)
 
-    def _cvf_disambiguate_h(self, row):
+    def _cvf_disambiguate_h(self, cvfs):
         '''
         The 'h' label is used internally to help reduce the amount of false
         positives we get with unprepared 4ths. They are either removed or
-        replaced with 'b' labels if they seem to be evaded bassizans cvfs.'''
-        if not row.empty and 'h' in row.values:  # h is for potential evaded bassizans that gets confused with a chanson idiom
-            if len(row.dropna()) > 2:
-                row.replace('h', 'b', inplace=True)
-            else:
-                row.replace(('C', 'h'), np.nan, inplace=True)
-        return row
+        replaced with 'b' labels if they seem to be evaded bassizans cvfs.
+        Return a copy of `cvfs` with the 'h' labels resolved.'''
+        vals = cvfs.to_numpy(dtype=object, copy=True)
+        isH = vals == 'h'  # h is for potential evaded bassizans that gets confused with a chanson idiom
+        hRows = isH.any(axis=1)
+        if hRows.any():
+            many = cvfs.notna().sum(axis=1).to_numpy() > 2
+            vals[isH & (hRows & many)[:, None]] = 'b'
+            vals[(isH | (vals == 'C')) & (hRows & ~many)[:, None]] = np.nan
+        return pd.DataFrame(vals, index=cvfs.index, columns=cvfs.columns)
 
     def _cvf_simplifier(self, row):
         '''
@@ -2373,6 +2960,7 @@ class ImportedPiece:
         elif 'A' in row.values:
             return nr.at[row.name, row.index[np.where(row == 'A')[0][0]]][:-1]
 
+    @analysis_cache.memoize('CVF', inputs=('PartNames', 'AnalyzeFourths', 'MelodicIntervals'), copy=True)
     def cvfs(self, keep_keys=False, offsets='last'):
         '''
         Return a dataframe of cadential voice functions in the piece. If
@@ -2422,55 +3010,45 @@ class ImportedPiece:
         '''
         if len(self._getPartNames()) < 2:
             return pd.DataFrame()
-        key = ('CVF', keep_keys, offsets)
-        if key in self.analyses:
-            return self.analyses[key].copy()
         cadences = _getCVFTable()
-        cadences['N'] = cadences.index.map(lambda i: i.count(', ') + 1)
+        matcher = _getCVFMatcher()
         harmonic = self.markFourths()
         melodic = self.melodic('d', True, False)
         ngrams = {n: self.ngrams(how='modules', df=harmonic, other=melodic, n=n, offsets='both',
-                  held='1', exclude=[], show_both=True).stack() for n in cadences.N.unique()}
-        hits = [ser[ser.str.contains('|'.join(cadences[cadences.N == n].index), regex=True)]
-                for n, ser in ngrams.items() if not ser.empty]
-        hits = pd.concat(hits)
-        hits.sort_index(level=1, inplace=True)
-        hits = hits[~hits.index.duplicated('last')]
+                  held='1', exclude=[], show_both=True).stack() for n in matcher.lengths}
+        hits = []
+        for ser in ngrams.values():
+            if not ser.empty:
+                patterns = matcher.match(ser.to_numpy(dtype=object))
+                found = pd.notna(patterns)
+                hits.append(pd.DataFrame({'Ngram': ser[found], 'Pattern': patterns[found]}))
+        df = pd.concat(hits)
+        df.sort_index(level=1, inplace=True)
+        df = df[~df.index.duplicated('last')]
         if keep_keys:
-            ngramKeys = hits.unstack(level=-1)
-        hits.name = 'Ngram'
-        df = pd.DataFrame(hits)
-        df['Pattern'] = df.Ngram.replace(cadences.index, cadences.index, regex=True)
+            ngramKeys = df.Ngram.unstack(level=-1)
         df = df.join(cadences, on='Pattern')
         voices = [pair.split('_') for pair in df.index.get_level_values(2)]
         df[['LowerVoice', 'UpperVoice']] = voices
         df.index = df.index.droplevel(2)
-        cvfs = pd.DataFrame(columns=self._getPartNames(), index=pd.MultiIndex.from_arrays([[], []], names=df.index.names))
-        df.apply(func=self._cvf_helper, axis=1, args=(cvfs,))
-        cvfs = cvfs.apply(self._cvf_disambiguate_h, axis=1).dropna(how='all')
-        cvfs = cvfs.astype('object', copy=False)
-        mel = self.melodic('c', True, True)
-        for _index in cvfs.index:
-            for _voice in cvfs.columns:
-                if cvfs.at[_index, _voice] == 'x' and mel.at[_index[1], _voice] in ('5', '-7'):
-                    cvfs.at[_index, _voice] = 'B'
-                    continue
-                if cvfs.at[_index, _voice] == 'y' and mel.at[_index[1], _voice] in ('1', '2'):
-                    cvfs.at[_index, _voice] = 'C'
-                    continue
-                if cvfs.at[_index, _voice] == 'z' and mel.at[_index[1], _voice] in ('-1', '-2'):
-                    cvfs.at[_index, _voice] = 'T'
+        cvfs = self._cvf_disambiguate_h(self._cvf_helper(df)).dropna(how='all')
+        # abandoned cvfs whose voice makes the expected motion after all are realized
+        mel = self.melodic('c', True, True).reindex(index=cvfs.index.get_level_values(1), columns=cvfs.columns)
+        vals = cvfs.to_numpy(dtype=object, copy=True)
+        for abandoned, motions, realized in (('x', ('5', '-7'), 'B'), ('y', ('1', '2'), 'C'), ('z', ('-1', '-2'), 'T')):
+            vals[(vals == abandoned) & mel.isin(motions).to_numpy()] = realized
+        cvfs = pd.DataFrame(vals, index=cvfs.index, columns=cvfs.columns)
         if keep_keys:
             cvfs = pd.concat([cvfs, ngramKeys], axis=1, sort=True)
         if offsets == 'last' and len(cvfs.index.levels) > 1:
             cvfs = self.condenseMultiIndex(cvfs)
-        self.analyses[key] = cvfs
-        return cvfs.copy()
+        return cvfs
 
     def condenseMultiIndex(self, df, to_drop=0):
         '''
         Take a df with a 'First' and 'Last' multi-index and return a copy condensed such that 
-        the `to_drop` index is dropped.
+        the `to_drop` index is dropped. Rows that end up with the same index are merged
+        into one, holding the last non-null value of each column among them.
         '''
         if isinstance(df, pd.core.series.Series):
             df = pd.DataFrame(df)
@@ -2478,13 +3056,11 @@ class ImportedPiece:
             ret = df.copy()
         else:
             ret = df.droplevel(to_drop)
-        dup_mask = ret.index.duplicated()
-        dups = ret.index[dup_mask]
-        ret = ret[~dup_mask]
-        for dup in dups:
-            filled = df.loc[(slice(None), dup), :].infer_objects(copy=False).ffill()
-            ret.loc[dup, :] = filled.iloc[-1, :].values
-        return ret
+        if not ret.index.has_duplicates:
+            return ret.copy()
+        ret = ret.groupby(level=list(range(ret.index.nlevels)), sort=False).last()
+        # groups with no value in an object column come back as None
+        return ret.mask(ret.isna())
 
     def morleyCadences(self):
         '''
@@ -2492,7 +3068,7 @@ class ImportedPiece:
         moments are labeled with "Morley Cadence" as they match Morley's definition of a cadence
         which is a one-voice melodic pattern.
         '''
-        nr = self.notes(combineUnisons=True)
+        nr = self._notes(combineUnisons=True)
         mel = self.melodic(kind='d', end=True, df=nr)
         mel_ng = self.ngrams(n=2, df=mel, offsets='last')
         mel2_matches = mel_ng.map(lambda cell: cell == ('-2', '2'), na_action='ignore').replace(False, np.nan).dropna(how='all')
@@ -2682,19 +3258,22 @@ class ImportedPiece:
         This method caches the result in the `analyses` attribute of the `Score` object
         to avoid recomputing the cadences if the method is called again with the same parameters.
         """
-        # key_sig/include_final change which columns get computed, so (unlike
-        # keep_keys/voice_detail, which just drop columns post-hoc) they must be
-        # part of the cache key -- otherwise a cached call without them would be
-        # silently reused for a later call requesting them, and vice versa.
-        memo_key = ('Cadences', key_sig, include_final)
-        if memo_key in self.analyses:
-            labels = self.analyses[memo_key]
-            if not keep_keys:
-                labels = labels.drop(['Pattern', 'Key'], axis=1)
-            if not voice_detail:
-                labels = labels.drop(['PartMap'], axis=1)
-            return labels
+        labels = self._cadenceLabels(key_sig, include_final)
+        if not keep_keys:
+            labels = labels.drop(['Pattern', 'Key'], axis=1)
+        if not voice_detail:
+            labels = labels.drop(['PartMap'], axis=1)
+        return labels
 
+    # key_sig/include_final change which columns get computed, so (unlike
+    # keep_keys/voice_detail, which just drop columns post-hoc) they are
+    # parameters of the cached table
+    @analysis_cache.memoize('Cadences', inputs=('CVF', 'MelodicIntervals', 'Timeline', 'Final'))
+    def _cadenceLabels(self, key_sig=False, include_final=False):
+        '''
+        Return the table of cadences that `cadences` drops columns from, with the
+        "Pattern", "Key" and "PartMap" columns.
+        '''
         cvfs = self.cvfs(offsets='last')
         mel = self.melodic('c', True, True)
         mel = mel[cvfs.notnull()].dropna(how='all')
@@ -2746,9 +3325,9 @@ class ImportedPiece:
         # Named (rather than positional) level lookups, since the `key_sig` column
         # inserts an extra index level between TSig and Sounding when requested.
         labels['Low'] = detailed.index.get_level_values('Lowest').values
-        final = note.Note(self.final())
-        labels['RelLow'] = labels.Low.apply(lambda x: ImportedPiece._qualityDirectedCompound(interval.Interval(final, note.Note(x))))
-        nr = self.notes()
+        final = self.final()
+        labels['RelLow'] = labels.Low.apply(lambda x: interval_labels.label(('q', True, True), final, x))
+        nr = self._notes()
         if len(labels.index):
             labels['Tone'] = cvfs.apply(self._cadential_pitch, args=(nr,), axis=1)
         else:
@@ -2757,7 +3336,7 @@ class ImportedPiece:
         # (see docstring); guard note.Note(x) against that, since some music21
         # versions raise instead of tolerating a NaN pitch name.
         labels['RelTone'] = labels.Tone.apply(
-            lambda x: ImportedPiece._qualityDirectedSimple(interval.Interval(final, note.Note(x))) if pd.notna(x) else np.nan
+            lambda x: interval_labels.label(('q', True, False), final, x) if pd.notna(x) else np.nan
         )
         labels.RelTone = labels.RelTone[labels.Tone.notnull()]
         labels.Tone = labels.Tone.fillna(np.nan)
@@ -2777,11 +3356,6 @@ class ImportedPiece:
         labels['ToNext'] = labels['SinceLast'].shift(-1)
         if len(labels.index):
             labels.iat[-1, -1] = self.score.highestTime - labels.index[-1]
-        self.analyses[memo_key] = labels
-        if not keep_keys:
-            labels = labels.drop(['Pattern', 'Key'], axis=1)
-        if not voice_detail:
-            labels = labels.drop(['PartMap'], axis=1)
         return labels
 
     # cadence RADAR plots:
@@ -2941,44 +3515,55 @@ class ImportedPiece:
         else:
             plt.show()
 
+    def _firstLetterCodes(ser):
+        '''
+        Return an int array coding the first character of each string in `ser` by
+        its code point, and -1 for missing values.'''
+        codes, uniques = pd.factorize(ser)
+        firsts = np.array([ord(name[0]) for name in uniques] + [-1], dtype='int64')
+        return firsts[codes]
+
     def markFourths(self):
         '''
         Distinguish between consonant and dissonant fourths. Returns a df of the diatonic,
         directed, and simple intervals of the piece with a "D" appended to dissonant fourths.
         Consonant fourths and all other intervals remain unchanged. A fourth is considered
         dissonant if it is against the same pitch class as the lowest sounding note.'''
-        if 'AnalyzeFourths' in self.analyses:
-            return self.analyses['AnalyzeFourths']
+        har = self.analyses.get('AnalyzeFourths')
+        if har is not None:
+            return har
         if len(self._getPartNames()) == 1:
-            self.analyses['AnalyzeFourths'] = pd.DataFrame()
-            return self.analyses['AnalyzeFourths']
+            har = pd.DataFrame()
+            self.analyses['AnalyzeFourths'] = har
+            return har
         har = self.harmonic('d', True, False).copy()
-        nr = self.notes().ffill()
-        lowLine = self.lowLine()
         label = 'D'  # the label to use for fourths against the lowest note
-        for col in har.columns:
-            for i in har.index:
-                if har.at[i, col] == '4':
-                    lowerVoice = col.split('_')[0]
-                    lowerNote = nr.at[i, lowerVoice]
-                    lowest = lowLine.asof(i)
-                    if lowerNote[0] == lowest[0]:
-                        har.at[i, col] += label
-                elif har.at[i, col] == '-4':
-                    upperVoice = col.split('_')[1]
-                    upperNote = nr.at[i, upperVoice]
-                    lowest = lowLine.asof(i)
-                    if upperNote[0] == lowest[0]:
-                        har.at[i, col] += label
+        up, down = (har == '4').to_numpy(), (har == '-4').to_numpy()
+        cols = np.flatnonzero((up | down).any(axis=0))
+        if len(cols):
+            # codes of the first letter of the sounding note in each voice and in the lowest line, -1 for none
+            nr = self._notes().ffill().reindex(har.index)
+            lowest = self.lowLine().dropna().reindex(har.index, method='ffill')
+            lowestLetters = ImportedPiece._firstLetterCodes(lowest)
+            letters = {}
+            for i in cols:
+                lowerVoice, upperVoice = har.columns[i].split('_')[:2]
+                for voice in (lowerVoice, upperVoice):
+                    if voice not in letters:
+                        letters[voice] = ImportedPiece._firstLetterCodes(nr[voice])
+                against = np.where(up[:, i], letters[lowerVoice], letters[upperVoice])
+                mask = (up[:, i] | down[:, i]) & (against == lowestLetters) & (against >= 0)
+                har.iloc[mask, i] += label
         self.analyses['AnalyzeFourths'] = har
-        return self.analyses['AnalyzeFourths']
+        return har
 
 
     def supplementum(self):
         '''
         Return the portion of the piece that corresponds to the supplementum, or what is often called a Plagal Coda. 
         This is defined as part after the last [Authentic] cadence in the piece.'''
-        if 'Supplementum' not in self.analyses:
+        supp = self.analyses.get('Supplementum')
+        if supp is None:
             cads = self.cadences()
             if cads['Progress'].iat[-1] == 1:
                 supp = None
@@ -2986,7 +3571,7 @@ class ImportedPiece:
                 lastCad = cads.index[-1]
                 supp = self.notes().loc[lastCad:]
             self.analyses['Supplementum'] = supp
-        return self.analyses['Supplementum']
+        return supp
 
     def _alpha_only(self, value):
         """
@@ -2997,6 +3582,24 @@ class ImportedPiece:
         else:
             return value
 
+    def _rowValueCounts(values):
+        """
+        This helper function is used as part of homorhythm.
+        Given a 2-D object array, it returns a boolean array of its non-null
+        cells, arrays of the number of non-null and of distinct non-null values
+        in each row, and a boolean array of the cells whose value appears more
+        than once in their row.
+        """
+        codes = pd.factorize(values.ravel())[0].reshape(values.shape)
+        valid = codes >= 0
+        # same[i, j, k]: cells j and k of row i hold the same value
+        same = (codes[:, :, None] == codes[:, None, :]) & valid[:, :, None]
+        # a value is counted at its first cell in the row
+        earlier = np.tril(np.ones((values.shape[1], values.shape[1]), dtype=bool), -1)
+        first = valid & ~(same & earlier).any(axis=2)
+        repeated = same.sum(axis=2) > 1
+        return valid, valid.sum(axis=1), first.sum(axis=1), repeated
+
     def homorhythm(self, ngram_length=4, full_hr=True):
         """
         This function predicts homorhythmic passages in a given piece.
@@ -3024,44 +3627,26 @@ class ImportedPiece:
 
         """
         # active version with lyric ngs
-        nr = self.notes()
+        nr = self._notes()
         dur = self.durations(df=nr)
 
         # add ng = exclude=[] to arguments in ngrams
         # specify ngram length with arguments
         ng = self.ngrams(df=dur, n=ngram_length, exclude=[])
-        dur_ngrams = []
-        for index, rows in ng.iterrows():
-            dur_ngrams_no_nan = [x for x in rows if pd.isnull(x) == False]
-            dur_ngrams.append(dur_ngrams_no_nan)
-        ng['dur_ngrams'] = dur_ngrams
-        ng['active_voices'] = ng['dur_ngrams'].apply(len)
-        ng['number_dur_ngrams'] = ng['dur_ngrams'].apply(lambda lyst: len(set(lyst)))
+        voices = ng.columns
+        valid, active, distinct, repeated = ImportedPiece._rowValueCounts(ng.to_numpy(dtype=object))
+        ng['active_voices'] = active
+        ng['number_dur_ngrams'] = distinct
 
         # from JS to check full_hr or partial
         if full_hr == True:
-            ng = ng[(ng['number_dur_ngrams'] < 2) & (ng['active_voices'] > 1)]
+            keep = (distinct < 2) & (active > 1)
         else:
-            ng = ng[ng['number_dur_ngrams'] < ng['active_voices']]
+            keep = distinct < active
+        ng = ng[keep]
 
-        #find involved voices
-
-        hr_voices = []
-        for index, rows in ng. iterrows():
-            seen = set()
-            hr_ngrams = []
-            for x in rows['dur_ngrams']:
-                if x in seen and not x in hr_ngrams:
-                    hr_ngrams.append(x)
-                else:
-                    seen.add(x)
-            hr_v = []
-            for index, value in rows.items():
-                if value in hr_ngrams:
-                    hr_v.append(index)
-            hr_voices.append(hr_v)
-
-        ng['hr_voices'] = hr_voices
+        # find involved voices, i.e. those whose durational ngram is shared with another voice
+        ng['hr_voices'] = [voices[row].to_list() for row in repeated[keep]]
 
         # get the lyrics as ngrams to match the durations
         lyrics = self.lyrics()
@@ -3075,15 +3660,13 @@ class ImportedPiece:
         filtered_lyric_ngs = lyrics_ng.filter(items = ng_list, axis=0)
 
         # count the lyric_ngrams at each position
-        syll_set = []
-        for index, rows in filtered_lyric_ngs.iterrows():
-            syll_no_nan = [z for z in rows if pd.isnull(z) == False]
-            syll_set.append(syll_no_nan)
-        filtered_lyric_ngs['syllable_set'] = syll_set
-        filtered_lyric_ngs["count_lyr_ngrams"] = filtered_lyric_ngs["syllable_set"].apply(lambda lyst: len(set(lyst)))
+        sylls = filtered_lyric_ngs.to_numpy(dtype=object)
+        valid, active_sylls, count_sylls, _ = ImportedPiece._rowValueCounts(sylls)
+        filtered_lyric_ngs['syllable_set'] = [list(row[mask]) for row, mask in zip(sylls, valid)]
+        filtered_lyric_ngs["count_lyr_ngrams"] = count_sylls
 
         # and the number of active voices
-        filtered_lyric_ngs['active_syll_voices'] = filtered_lyric_ngs['syllable_set'].apply(len)
+        filtered_lyric_ngs['active_syll_voices'] = active_sylls
         if full_hr == True:
             hr_sylls_mask = filtered_lyric_ngs[(filtered_lyric_ngs['active_syll_voices'] > 1) & (filtered_lyric_ngs['count_lyr_ngrams'] < 2)]
         else:
@@ -3097,7 +3680,7 @@ class ImportedPiece:
         # retain ngram length for use with ema
         hr['ngram_length'] = int(ngram_length)
         result = self.detailIndex(hr, offset=True)
-        result["Progress"] = (result.index.get_level_values(2) / self.notes().index[-1])
+        result["Progress"] = (result.index.get_level_values(2) / self._notes().index[-1])
 
         if len(result) == 0:
             print ("No HR passages found in " + self.metadata['composer'] + ":" + self.metadata['title'])
@@ -3121,6 +3704,7 @@ class ImportedPiece:
         mask = ((_col != 'Rest') & ((shifted == 'Rest') | (barlines == 'double') | (_fermatas)))
         return mask
 
+    @analysis_cache.memoize('EntryMask', inputs=('Notes', 'Fermatas'))
     def entryMask(self, fermatas=True):
         """
         Return a dataframe of `True`, `False`, or NaN values which can be used as
@@ -3139,11 +3723,7 @@ class ImportedPiece:
         If fermatas is set to True (default), anything coming immediately after
         a fermata will also be counted as an entry.
         """
-        key = ('EntryMask', fermatas)
-        if key not in self.analyses:
-            nr = self.notes()
-            self.analyses[key] = nr.apply(self._entryHelper, args=(fermatas,))
-        return self.analyses[key]
+        return self._notes().apply(self._entryHelper, args=(fermatas,))
 
     def entries(self, df=None, n=None, thematic=False, anywhere=False, fermatas=True, exclude=[]):
         """
@@ -3173,26 +3753,29 @@ class ImportedPiece:
         after a fermata will also be counted as an entry.
         """
         if df is None:
-            nr = self.notes(combineUnisons=True)
+            nr = self._notes(combineUnisons=True)
             df = self.melodic(df=nr, kind='d', end=False)
         if n is not None:
             df = self.ngrams(df, n, exclude=exclude)
         mask = self.entryMask(fermatas)
         num_parts = len(mask.columns)
-        mask.columns = df.columns[:num_parts]
-        entries = df.copy()
-        entries.iloc[:, :num_parts] = entries.iloc[:, :num_parts][mask]
-        source = entries.copy()
+        keep = np.ones(df.shape, dtype=bool)
+        keep[:, :num_parts] = mask.reindex(df.index, fill_value=False).to_numpy(dtype=bool)
+        entries = df.where(keep)
+        # compare patterns by ids numbered for this call rather than as strings
         if anywhere:
-            ret = df[df.isin(entries.stack().values)].copy()
+            ids, entryIds = ngram_vocab.factorize(df.to_numpy(dtype=object), entries.to_numpy(dtype=object))
+            found = np.isin(ids, entryIds[entryIds >= 0]) & (ids >= 0)
+            ret = df[pd.DataFrame(found, index=df.index, columns=df.columns)]
+            ids = np.where(found, ids, -1)
         else:
-            ret = entries.copy()
+            ids = ngram_vocab.factorize(entries.to_numpy(dtype=object))[0]
+            ret = entries
         if thematic:
-            stack = ret.iloc[:, :num_parts].stack()
-            counts = stack.value_counts()
-            recurring = counts[counts > 1].index
-            # recurring_entries = recurring[recurring.isin(ret.stack())]
-            ret = ret[ret.isin(recurring)]
+            partIds = ids[:, :num_parts]
+            repeated, counts = np.unique(partIds[partIds >= 0], return_counts=True)
+            recurring = np.isin(ids, repeated[counts > 1])
+            ret = ret[pd.DataFrame(recurring, index=ret.index, columns=ret.columns)]
         ret.dropna(how='all', subset=ret.columns[:num_parts], inplace=True)
         return ret
 
@@ -3207,9 +3790,8 @@ class ImportedPiece:
         thus P-4, m3, P5, P5, M-9, P-4, P4
         """
         all_tones = self._getM21Objs()
-        notes = [all_tones.at[item] for item in coordinates]
-        entry_ints = [_directed_name_from_note_strings(notes[i], notes[i + 1]) for i in range(len(notes) - 1)]
-        return entry_ints
+        names = [all_tones.at[item].nameWithOctave for item in coordinates]
+        return interval_labels.label_pairs('directedName', names[:-1], names[1:])
 
     def _split_by_threshold(seq, max_diff=70):
         """
@@ -3231,6 +3813,59 @@ class ImportedPiece:
 
         yield part
 
+    def _hiddenTypeOffsets(offsets, max_entries=5):
+        """
+        This helper function is used as part of iterHiddenTypes.
+        It yields the tuples of at least three of the distinct `offsets` that can make
+        a PEN or an ID, without trying every combination of them: a PEN grows by
+        repeating its first time interval, and an ID by any later entry followed by
+        one at its first time interval. Tuples have at most `max_entries` offsets.
+        """
+        offsets = sorted(set(offsets))
+        present = set(offsets)
+        position = {offset: i for i, offset in enumerate(offsets)}
+        seen = set()
+        for i, first in enumerate(offsets):
+            for second in offsets[i + 1:]:
+                step = second - first
+                # PENs: every entry a step after the last one
+                seq = [first, second]
+                while len(seq) < max_entries and seq[-1] + step in present:
+                    seq.append(seq[-1] + step)
+                    if tuple(seq) not in seen:
+                        seen.add(tuple(seq))
+                        yield tuple(seq)
+                # IDs: pairs of entries a step apart
+                stack = [(first, second)]
+                while stack:
+                    seq = stack.pop()
+                    if len(seq) + 2 > max_entries:
+                        continue
+                    for nxt in offsets[position[seq[-1]] + 1:]:
+                        if nxt + step in present:
+                            longer = seq + (nxt, nxt + step)
+                            if longer not in seen:
+                                seen.add(longer)
+                                yield longer
+                            stack.append(longer)
+
+    def _hiddenTypeCandidates(full_list_of_matches, entryArray, max_entries=5):
+        """
+        This helper function is used by presentationTypes and iterHiddenTypes.
+        It yields `(matches, df, whole)` tuples for each fuga of each distinct list of
+        matches: first the df of all its entries with `whole` True, and then the df
+        of each set of them that can make a PEN or an ID (see `_hiddenTypeOffsets`)
+        with `whole` False. A caller can stop the whole search at any point by
+        breaking out of a single loop.
+        """
+        for matches in dict.fromkeys(tuple(matches) for matches in full_list_of_matches["match"]):
+            matches = list(matches)
+            entry_array = entryArray(matches)
+            for item in ImportedPiece._split_by_threshold(entry_array.index):
+                yield matches, entry_array.loc[item].reset_index(), True
+                for offsets in ImportedPiece._hiddenTypeOffsets(item, max_entries):
+                    yield matches, entry_array.loc(axis=0)[list(offsets)].reset_index(), False
+
     # July 2022 added to check for overlap
     def _dur_ngram_helper(df, ng_durs):
         """
@@ -3296,7 +3931,7 @@ class ImportedPiece:
             return 'FUGA'
 
     # July 2022:  This Replaces the Previous helper
-    def _temp_dict_of_details(self, df, det, matches):
+    def _temp_dict_of_details(self, df, matches):
         """
         This helper function is used as part of presentationTypes.
         It assembles various features for the presentation types
@@ -3425,10 +4060,7 @@ class ImportedPiece:
             tone_coordinates =  list(zip(short_offset_list, voice_list))
             melodic_intervals = self._find_entry_int_distance(tone_coordinates)
 
-        meas_beat = det[det.index.get_level_values('Offset').isin(short_offset_list)]
-        mb2 = meas_beat.reset_index()
-        mb2['mb'] = mb2["Measure"].astype(str) + "/" + mb2["Beat"].astype(str)
-        meas_beat_list = mb2['mb'].to_list()
+        meas_beat_list = self._measureBeatLabels(short_offset_list)
 
         # temp results for this set
         temp = {"Composer": self.metadata["composer"],
@@ -3444,6 +4076,23 @@ class ImportedPiece:
                 "Parallel_Voice": parallel_voice}
         return temp
     
+    def _entryRows(matches, patternCodes, byPattern, starts):
+        '''
+        Return the sorted positions of the entries whose pattern is in `matches`,
+        given the entries' pattern codes grouped by `byPattern` with each code's
+        group beginning at `starts`.'''
+        groups = [byPattern[starts[code]:starts[code + 1]]
+                  for code in {patternCodes[match] for match in matches if match in patternCodes}]
+        return np.sort(np.concatenate(groups)) if groups else np.zeros(0, dtype='int64')
+
+    def _hashableTemp(temp):
+        '''
+        Return a hashable version of a dictionary made by `_temp_dict_of_details`,
+        equal for dictionaries that compare equal.'''
+        def _freeze(value):
+            return tuple(_freeze(item) for item in value) if isinstance(value, list) else value
+        return tuple((key, _freeze(value)) for key, value in temp.items())
+
     def _offset_joiner(self, a):
 
         '''
@@ -3494,9 +4143,51 @@ class ImportedPiece:
             parallel_voice = None
         return parallel_voice
 
+    def _presentationTypeInputs(self, kind, end, melodic_ngram_length, limit_to_entries, body_flex,
+                                head_flex, combine_unisons):
+        '''
+        Return what `presentationTypes` and `iterHiddenTypes` start from: the df of
+        melodic entries, a df with the list of matching soggetti for each soggetto
+        in its "match" column, and a function
+        returning the df of the entries of a given list of soggetti, with an
+        "index" (offset) index and "voice" and "pattern" columns.'''
+        nr = self._notes(combineUnisons=combine_unisons)
+        mel = self.melodic(df=nr, kind=kind, end=end)
+        mel_ng = self.ngrams(df=mel, exclude=['Rest'], n=melodic_ngram_length)
+        if limit_to_entries:
+            entries = self.entries(mel_ng)
+        else:
+            entries = self.ngrams(df=mel, exclude=['Rest'], n=melodic_ngram_length)
+        # remove entries that start at fractional offsets
+        integer_mask = entries.index % 1 == 0
+        entries = entries[integer_mask]
+        # ngrams of melodic entries
+        mels_stacked = entries.stack().to_frame()
+        mels_stacked.rename(columns =  {0:"pattern"}, inplace = True)
+        # edit distance, based on side-by-side comparison of melodic ngrams
+        # gets flexed and other similar soggetti
+        # only the pairs within body_flex of each other are kept
+        filtered_dist = self.flexed_distance(head_flex, entries, max_distance=body_flex)
+        # # Group the filtered distanced patterns
+        full_list_of_matches = filtered_dist.groupby('source')['match'].apply(list).reset_index()
+
+        # entries of each pattern, so each group of matches is gathered without rescanning them all
+        codes, patterns = pd.factorize(mels_stacked['pattern'])
+        byPattern = np.argsort(codes, kind='stable')
+        starts = np.searchsorted(codes[byPattern], np.arange(len(patterns) + 1))
+        patternCodes = {pattern: i for i, pattern in enumerate(patterns)}
+
+        def entryArray(matches):
+            related_entry_list = mels_stacked.iloc[ImportedPiece._entryRows(matches, patternCodes, byPattern, starts)]
+            return related_entry_list.reset_index(level=1).rename(columns = {'level_1': "voice", 0: "pattern"})
+
+        return entries, full_list_of_matches, entryArray
+
+    @analysis_cache.memoize('PresentationTypes', inputs=('EntryMask', 'MelodicIntervals', 'Duration', 'Notes',
+                                                      'MeasureBeatLookup'), uncached=('hidden_types_limit',))
     def presentationTypes(self, kind='d', end=False, melodic_ngram_length=4, limit_to_entries=True,
                           body_flex=0, head_flex=1, include_hidden_types=False,
-                          combine_unisons=False):
+                          combine_unisons=False, hidden_types_limit=None):
         """
         This function uses several other functions to classify the entries in a given piece.
         The output is a list, in order of offset, of each presentation type, including information about
@@ -3531,6 +4222,11 @@ class ImportedPiece:
         * to include all the hidden PENs and IDS (those found within longer Fugas),
         use `include_hidden_types == True` (set to False by default)
         * for faster (and simpler) listing of points of imitation without hidden forms, use `include_hidden_types == False` (= default)
+        * hidden types are looked for among the sets of three to five entries of a fuga whose time intervals can
+        make a PEN or an ID, but there can still be many of them in a long fuga, so `hidden_types_limit` can be set
+        to stop after that many sets in the piece (None by default, for no limit), with a warning if there were more
+        to check. Results with a limit aren't cached, so the warning is given on every call that stops early. To
+        stream only the hidden PENs and IDs, see `iterHiddenTypes`
 
 
         Examples
@@ -3543,20 +4239,8 @@ class ImportedPiece:
         Note that the output of this function can be used with verovioPtypes to show
         each cadence in staff notation.
         """
-        memo_key = ('PresentationTypes', kind, end, melodic_ngram_length, limit_to_entries,
-            body_flex, head_flex, include_hidden_types, combine_unisons)
-        if memo_key in self.analyses:
-            return self.analyses[memo_key]
-        nr = self.notes(combineUnisons=combine_unisons)
-        mel = self.melodic(df=nr, kind=kind, end=end)
-        mel_ng = self.ngrams(df=mel, exclude=['Rest'], n=melodic_ngram_length)
-        if limit_to_entries:
-            entries = self.entries(mel_ng)
-        else:
-            entries = self.ngrams(df=mel, exclude=['Rest'], n=melodic_ngram_length)
-        # remove entries that start at fractional offsets
-        integer_mask = entries.index % 1 == 0
-        entries = entries[integer_mask]
+        entries, full_list_of_matches, entryArray = self._presentationTypeInputs(
+            kind, end, melodic_ngram_length, limit_to_entries, body_flex, head_flex, combine_unisons)
         # get ngram durs to use for overlap check as part of _temp files
         ng_durs = self.durations(df=entries)
         points = pd.DataFrame(columns=['Composer',
@@ -3579,36 +4263,22 @@ class ImportedPiece:
                                             'Count_Offsets',
                                             'Offsets_Key']
 
-        det = self.detailIndex(nr, offset=True, progress=True)
-        # ngrams of melodic entries
-        mels_stacked = entries.stack().to_frame()
-        mels_stacked.rename(columns =  {0:"pattern"}, inplace = True)
-        # edit distance, based on side-by-side comparison of melodic ngrams
-        # gets flexed and other similar soggetti
-        dist = self.flexed_distance(head_flex, entries)
-        dist_stack = dist.stack().to_frame()
-        # # filter distances to threshold.  <2 is good
-        distance_factor = body_flex + 1
-        filtered_dist_stack = dist_stack[dist_stack[0] < distance_factor]
-        filtered_dist = filtered_dist_stack.reset_index()
-        filtered_dist.rename(columns =  {'level_0':"source", 'level_1':'match'}, inplace = True)
-        # # Group the filtered distanced patterns
-        full_list_of_matches = filtered_dist.groupby('source')['match'].apply(list).reset_index()
-
         list_temps = []
         # # classification without hidden types
         if include_hidden_types == False:
-            for matches in full_list_of_matches["match"]:
-                related_entry_list = mels_stacked[mels_stacked['pattern'].isin(matches)]
-                entry_array = related_entry_list.reset_index(level=1).rename(columns = {'level_1': "voice", 0: "pattern"})
+            # sources with the same matches make the same temps, so each distinct group is handled once
+            groups = dict.fromkeys(tuple(matches) for matches in full_list_of_matches["match"])
+            seen = set()
+            for matches in groups:
+                matches = list(matches)
+                entry_array = entryArray(matches)
                 dfs = self._split_dataframe(entry_array, "index", 70)
                 # classification of the full set
                 for df in dfs:
-                    temp = self._temp_dict_of_details(df, det, matches)
-                    # print(temp)
-                    if temp in list_temps:
-                        pass
-                    else:
+                    temp = self._temp_dict_of_details(df, matches)
+                    key = ImportedPiece._hashableTemp(temp)
+                    if key not in seen:
+                        seen.add(key)
                         list_temps.append(temp)
             points = pd.DataFrame(list_temps)
             if not points.empty:
@@ -3630,36 +4300,30 @@ class ImportedPiece:
                     points["Overlaps"] = points[["Entry_Durs", "Offsets"]].apply(ImportedPiece._entry_overlap_helper, axis=1)
                     points["Count_Non_Overlaps"] = points["Overlaps"].apply(ImportedPiece._non_overlap_count)
                     points.drop(['Count_Offsets', 'Offsets_Key', 'Entry_Durs', 'Overlaps'], axis=1, inplace=True)
-                    points["Progress"] = (points["First_Offset"] / self.notes().index[-1])        
+                    points["Progress"] = (points["First_Offset"] / self._notes().index[-1])        
                     points = points.sort_values("Progress")
                     points = points.reset_index(drop=True)
-                    self.analyses[memo_key] = points
                     return points
 
         # classification with hidden types
         elif include_hidden_types == True:
-            # hidden_types_list = ["PEN", "ID"]
-            for matches in full_list_of_matches["match"]:
-                related_entry_list = mels_stacked[mels_stacked['pattern'].isin(matches)]
-                entry_array = related_entry_list.reset_index(level=1).rename(columns = {'level_1': "voice", 0: "pattern"})
-
-                split_list = list(ImportedPiece._split_by_threshold(entry_array.index))
-                for item in split_list:
+            # sets of entries left before hidden_types_limit is reached
+            budget = np.inf if hidden_types_limit is None else hidden_types_limit
+            truncated = False
+            for matches, df, whole in ImportedPiece._hiddenTypeCandidates(full_list_of_matches, entryArray):
+                if whole:
                     # the initial classification of the full set
-                    df = entry_array.loc[item].reset_index()
                     if len(df) > 1:
-                    # df = df.reset_index()
-                        temp = self._temp_dict_of_details(df, det, matches)
-                        list_temps.append(temp)
-
-                    if len(item) > 2 :
-                        # make range from 2 to allow for fugas needed in NIMs
-                        for r in range(3, 6):
-                            list_combinations = list(combinations(item, r))
-                            for slist in list_combinations:
-                                df = entry_array.loc(axis=0)[slist].reset_index()
-                                temp = self._temp_dict_of_details(df, det, matches)
-                                list_temps.append(temp)
+                        list_temps.append(self._temp_dict_of_details(df, matches))
+                    continue
+                if budget <= 0:
+                    truncated = True
+                    break
+                budget -= 1
+                list_temps.append(self._temp_dict_of_details(df, matches))
+            if truncated:
+                # the caller is past presentationTypes and its memoize wrapper
+                ImportedPiece._warnTruncated(self, 'hidden_types_limit', hidden_types_limit, stacklevel=4)
             # 8/24 patch for empty lists
             if len(list_temps) == 0:
                 print("No Hidden Types Found in " + self.metadata['composer'] + ":" + self.metadata['title'])
@@ -3685,13 +4349,65 @@ class ImportedPiece:
                         points["Overlaps"] = points[["Entry_Durs", "Offsets"]].apply(ImportedPiece._entry_overlap_helper, axis=1)
                         # points["Count_Non_Overlaps"] = points["Overlaps"].apply(ImportedPiece._non_overlap_count)
                         points.drop(['Count_Offsets', 'Offsets_Key', 'Entry_Durs', 'Overlaps'], axis=1, inplace=True)
-                        points["Progress"] = (points["First_Offset"] / self.notes().index[-1])
+                        points["Progress"] = (points["First_Offset"] / self._notes().index[-1])
                         # return points
                         points = points.sort_values("Progress")
                         points = points.reset_index(drop=True)
-                        self.analyses[memo_key] = points
                         return points
-            
+
+    def _warnTruncated(self, name, limit, stacklevel):
+        '''
+        Warn that the hidden types search stopped at its `limit`, passed as the
+        parameter `name`, before every combination of entries was classified.
+        `stacklevel` is the number of frames from here to the caller to blame.
+        '''
+        warnings.warn('{} of {} reached in {}: {} before every combination of entries was classified, so '
+                      'hidden types may be missing.'.format(name, limit, self.metadata['composer'],
+                                                            self.metadata['title']), stacklevel=stacklevel)
+
+    def iterHiddenTypes(self, kind='d', end=False, melodic_ngram_length=4, limit_to_entries=True,
+                        body_flex=0, head_flex=1, combine_unisons=False, max_entries=5, limit=None):
+        """
+        Yield the hidden PENs and IDs of the piece one at a time, as dictionaries with
+        the fields of the rows of `presentationTypes` (without the overlap checks).
+
+        The parameters are those of `presentationTypes`. Instead of classifying every
+        combination of three to five entries of each fuga, the offsets that can make
+        a PEN or an ID are found from their time intervals first, so only those
+        entries are looked up and classified. Each set of offsets is yielded once.
+
+        * `max_entries` is the largest number of entries in a hidden type (5 by default)
+        * `limit` stops after that many sets of entries have been classified (None by
+        default, for no limit), whether or not they turned out to be PENs or IDs, with
+        a warning if there were more to classify
+
+        For example:
+
+        for ptype in piece.iterHiddenTypes(limit=1000):
+            print(ptype['Presentation_Type'], ptype['Measures_Beats'])
+        """
+        _, full_list_of_matches, entryArray = self._presentationTypeInputs(
+            kind, end, melodic_ngram_length, limit_to_entries, body_flex, head_flex, combine_unisons)
+        budget = np.inf if limit is None else limit
+        seen = set()
+        for matches, df, whole in ImportedPiece._hiddenTypeCandidates(full_list_of_matches, entryArray, max_entries):
+            if whole:
+                continue
+            if budget <= 0:
+                ImportedPiece._warnTruncated(self, 'limit', limit, stacklevel=3)
+                return
+            budget -= 1
+            temp = self._temp_dict_of_details(df, matches)
+            key = tuple(temp['Offsets'])
+            if key in seen or len(set(temp['Voices'])) < 2:
+                continue
+            temp['Presentation_Type'] = ImportedPiece._classify_by_offset(temp['Time_Entry_Intervals'])
+            if temp['Presentation_Type'] in ('PEN', 'ID'):
+                seen.add(key)
+                temp['Flexed_Entries'] = len(matches) > 1
+                temp['Number_Entries'] = len(temp['Offsets'])
+                yield temp
+
     # new print methods with verovio
     def verovioCadences(self, df=None):
         """
@@ -3731,8 +4447,7 @@ class ImportedPiece:
             text_file = open(self.path, "r")
             fetched_mei_string = text_file.read()
         else:
-            response = httpx.get(self.path)
-            fetched_mei_string = response.text
+            fetched_mei_string = remote.fetch_text(self.path)
         tk = verovio.toolkit()
         tk.loadData(fetched_mei_string)
         tk.setScale(30)
@@ -3794,8 +4509,7 @@ class ImportedPiece:
             text_file = open(self.path, "r")
             fetched_mei_string = text_file.read()
         else:
-            response = httpx.get(self.path)
-            fetched_mei_string = response.text
+            fetched_mei_string = remote.fetch_text(self.path)
         tk = verovio.toolkit()
         tk.loadData(fetched_mei_string)
         tk.setScale(30)
@@ -3868,8 +4582,7 @@ class ImportedPiece:
             text_file = open(self.path, "r")
             fetched_mei_string = text_file.read()
         else:
-            response = httpx.get(self.path)
-            fetched_mei_string = response.text
+            fetched_mei_string = remote.fetch_text(self.path)
         tk = verovio.toolkit()
         tk.loadData(fetched_mei_string)
         tk.setScale(30)
@@ -3988,8 +4701,7 @@ class ImportedPiece:
                 text_file = open(self.path, "r")
                 fetched_mei_string = text_file.read()
         else:
-            response = httpx.get(self.path)
-            fetched_mei_string = response.text
+            fetched_mei_string = remote.fetch_text(self.path)
         tk = verovio.toolkit()
         tk.loadData(fetched_mei_string)
         tk.setScale(30)
@@ -4059,6 +4771,19 @@ class ImportedPiece:
 # These are used part of visualization routines
 # Do not delete!
 
+def _batchHelper(func, piece, kwargs, metadata, number_parts):
+    """
+    Run one piece's share of `CorpusBase.batch`. This is a module-level function so
+    that it can be sent to worker processes.
+    """
+    df = func(piece, **kwargs)
+    if number_parts:
+        piece.numberParts(df)
+    if isinstance(df, pd.DataFrame):
+        if metadata:
+            df[['Composer', 'Title', 'Date']] = piece.metadata['composer'], piece.metadata['title'], piece.metadata['date']
+    return df
+
 def joiner(a):
     """This is used for visualization routines."""
     return tuple_to_string(a, separator='_')
@@ -4087,13 +4812,18 @@ class CorpusBase:
         list of notes constructed from scores, combining unisons
     """
 
-    def __init__(self, paths: list):
+    def __init__(self, paths: list, workers=None):
         """
         Parameters
         ----------
         paths : list
             list file paths/urls to mei files
             file paths MUST begin with a '/', otherwise they will be categoried as urls
+        workers : int, optional
+            number of processes used to parse the scores, -1 to use all the cores.
+            Remote scores are downloaded concurrently before parsing. The default of None imports
+            the pieces one at a time. Either way the pieces keep the order of `paths`,
+            and pieces that fail to import are reported and left out.
 
         Raises
         ----------
@@ -4102,10 +4832,11 @@ class CorpusBase:
         """
         self.paths = paths
         self.scores = []  # store lists of ImportedPieces generated from the path above
-        self.analyses = {'note_list': None}
+        self.analyses = analysis_cache.AnalysisCache({'note_list': None})
+        imported = iter(_importScores([path for path in paths if type(path) == str], workers))
         for path in paths:
             if type(path) == str:
-                _score = importScore(path)
+                _score = next(imported)
                 if _score is not None:
                     self.scores.append(_score)
             else:   # path is already an ImportedPiece
@@ -5020,7 +5751,8 @@ class CorpusBase:
         """Convert tuple-like values to a string using the shared helper."""
         return tuple_to_string(value, separator=separator)
 
-    def batch(self, func, kwargs={}, metadata=True, number_parts=True, verbose=False):
+    def batch(self, func, kwargs={}, metadata=True, number_parts=True, verbose=False,
+              n_jobs=None, backend='process'):
         '''
         The batch method is a convenience function for running the same analysis 
         on all pieces in a `CorpusBase` object. It takes an unbound method from the 
@@ -5068,11 +5800,23 @@ class CorpusBase:
             If True, prints the function being called and the piece being
             analyzed as the batch runs. Useful for pinpointing a piece that
             triggers a bug.
+        n_jobs : int, optional (default None)
+            Number of workers to spread the pieces over, -1 to use all the
+            cores. The default of None runs the pieces one at a time.
+        backend : {'process', 'thread'}, optional (default 'process')
+            Whether the `n_jobs` workers are processes or threads. Processes
+            work around the GIL, so they suit slow, pure-python analyses like
+            `ImportedPiece.cadences`. Each piece is copied to its worker
+            process, so the results it computes there aren't cached on the
+            piece in this session, and `func` has to be picklable (an
+            `ImportedPiece` method is, a lambda isn't). Threads share the
+            pieces and their caches.
 
         Returns
         -------
         list
-            One result per piece in the corpus, in the order of `self.scores`.
+            One result per piece in the corpus, in the order of `self.scores`
+            (whatever the `n_jobs` and `backend`).
 
         Examples
         --------
@@ -5132,8 +5876,15 @@ class CorpusBase:
         list_of_dfs_with_numbers_for_part_names = corpus.batch(ImportedPiece.melodic)
         list_of_dfs_with_original_part_names = corpus.batch(ImportedPiece.melodic, number_parts=False)
         ```
+
+        Running cadences on four worker processes:
+
+        ```python
+        list_of_dfs = corpus.batch(ImportedPiece.cadences, n_jobs=4)
+        ```
         '''
-        post = []
+        if backend not in ('process', 'thread'):
+            raise ValueError("backend must be 'process' or 'thread'.")
         dfs = ('df', 'mask_df', 'other')
         _kwargs = {key: val for key, val in kwargs.items() if key not in dfs}
         list_args = {key: val for key, val in kwargs.items() if key in dfs}
@@ -5141,18 +5892,22 @@ class CorpusBase:
             print('\nRunning {} analysis on {} pieces:'.format(func.__name__, len(self.scores)))
         if number_parts and func.__name__ in ('cadences', 'presentationTypes', 'lowLine', 'highLine', 'final'):
             number_parts = False
+        tasks = []
         for i, score in enumerate(self.scores):
-            if verbose:
-                print('\t{}: {}'.format(i + 1, score.metadata['title']))
             largs = {key: val[i] for key, val in list_args.items()}
-            df = func(score, **_kwargs, **largs)
-            if number_parts:
-                score.numberParts(df)
-            if isinstance(df, pd.DataFrame):
-                if metadata:
-                    df[['Composer', 'Title', 'Date']] = score.metadata['composer'], score.metadata['title'], score.metadata['date']
-            post.append(df)
-        return post
+            tasks.append((func, score, {**_kwargs, **largs}, metadata, number_parts))
+        if n_jobs in (None, 1):
+            post = []
+            for i, task in enumerate(tasks):
+                if verbose:
+                    print('\t{}: {}'.format(i + 1, task[1].metadata['title']))
+                post.append(_batchHelper(*task))
+            return post
+        if verbose:
+            for i, score in enumerate(self.scores):
+                print('\t{}: {}'.format(i + 1, score.metadata['title']))
+        prefer = 'processes' if backend == 'process' else 'threads'
+        return Parallel(n_jobs=n_jobs, prefer=prefer)(delayed(_batchHelper)(*task) for task in tasks)
 
     def modelFinder(self, 
                     models=None, 
@@ -5223,16 +5978,70 @@ class CorpusBase:
         res = pd.DataFrame(columns=list(model.file_name for model in models.scores), index=list(mass.file_name for mass in masses.scores))
         res.columns.name = 'Model'
         res.index.name = 'Mass'
+        # compare the patterns by ids numbered for this call rather than as strings
+        ids = ngram_vocab.factorize(*[df.stack().to_numpy(dtype=object) for df in entries + mass_entries])
+        entries, mass_entries = ids[:len(entries)], ids[len(entries):]
         for i, model in enumerate(models.scores):
-            mod_patterns = entries[i].stack().unique()
+            mod_patterns = np.unique(entries[i])
             for j, mass in enumerate(masses.scores):
-                stack = mass_entries[j].stack()
-                hits = stack[stack.isin(mod_patterns)]
-                if len(stack.index):
-                    percent = len(hits.index) / len(stack.index)
+                stack = mass_entries[j]
+                if len(stack):
+                    percent = int(np.isin(stack, mod_patterns).sum()) / len(stack)
                     res.at[mass.file_name, model.file_name] = percent
         return res
 
+    @analysis_cache.memoize('SoggettoIndex')
+    def soggettoIndex(self, n=4, kind='z', combine_unisons=False):
+        """
+        Return a `SoggettoIndex` of the melodic ngrams of every piece in the corpus,
+        for finding the soggetti anywhere in the corpus within a given distance of
+        a pattern. Distances work as in `ImportedPiece.distance` and
+        `ImportedPiece.flexed_distance`, but a query only checks the ngrams that
+        can be close enough instead of comparing every pair. The index is built
+        once per set of arguments and kept on the corpus, and `SoggettoIndex.save`
+        and `SoggettoIndex.load` keep it between sessions.
+
+        Parameters
+        ----------
+        n : int, optional (default 4)
+            The length of the melodic ngrams.
+        kind : str, optional (default 'z')
+            The kind of melodic intervals, 'z' for 0-indexed diatonic intervals or
+            'c' for semitones. Intervals are directed and compound.
+        combine_unisons : bool, optional (default False)
+            Whether to combine repeated notes before taking the intervals.
+
+        Examples
+        --------
+        ```python
+        index = corpus.soggettoIndex(n=4)
+        index.query('1, -2, 1, -2', max_distance=1)
+        ```
+
+        With `head_flex`, a difference of up to that much in the first interval
+        doesn't count towards the distance:
+
+        ```python
+        index.query('1, -2, 1, -2', max_distance=0, head_flex=1)
+        ```
+
+        To get just the distinct ngrams and their distances:
+
+        ```python
+        index.patterns_near('1, -2, 1, -2', max_distance=2)
+        ```
+        """
+        frames = []
+        for piece in self.scores:
+            nr = piece.notes(combineUnisons=combine_unisons)
+            mel = piece.melodic(kind=kind, directed=True, compound=True, df=nr)
+            ser = piece.ngrams(df=mel, n=n, exclude=['Rest']).stack()
+            frames.append(pd.DataFrame({'Composer': piece.metadata['composer'], 'Title': piece.metadata['title'],
+                                        'Voice': ser.index.get_level_values(1), 'Offset': ser.index.get_level_values(0),
+                                        'Pattern': ser.to_numpy(dtype=object)}))
+        occurrences = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=soggetto_index.OCCURRENCE_COLUMNS)
+        return soggetto_index.SoggettoIndex(occurrences)
+
     def derivativeAnalyzer(self, df=None, n=10):
         '''
         Find the top n masses with the highest derivation scores for each model in a table of `.modelFinder results.
@@ -5333,7 +6142,9 @@ class CorpusBase:
                 df = df[df.map(lambda cell: 'Rest' not in cell, na_action='ignore')].dropna(how='all')
                 stack = df.stack()
                 if not ic:
-                    hits = stack[stack.isin(mod_patterns)]
+                    # compare the modules by ids numbered for this pair rather than as strings
+                    stack_ids, mod_ids = ngram_vocab.factorize(stack.to_numpy(dtype=object), mod_patterns)
+                    hits = stack[np.isin(stack_ids, mod_ids)]
                 else:   # ic == True
                     ic_targets = []
                     for patt in mod_patterns:
@@ -0,0 +1,136 @@
+"""
+Shared vocabulary of ngram patterns.
+
+`ImportedPiece.ngrams(tokens=True)` returns each ngram as an integer id instead
+of a string like "3, -2, 2" (or a tuple). Ids come from one vocabulary shared
+by every piece in the process, so the same pattern has the same id in every
+piece and patterns can be compared across a corpus with integer `isin`
+checks and hash joins instead of string comparisons. `decode_frame` turns
+ids back into the usual strings.
+
+Ids are only meaningful in the process that made them, so encode results
+after they come back from worker processes (e.g. from `CorpusBase.batch`),
+not inside the workers.
+
+The vocabulary holds at most `MAX_SIZE` patterns. `clear` empties it once the
+ids handed out so far are no longer needed. Comparisons that only need ids
+within one call, like those of `ImportedPiece.entries`, use `factorize`,
+which doesn't add to the vocabulary.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+# most patterns the vocabulary can hold
+MAX_SIZE = 2 ** 22
+
+_ids = {}  # pattern: id
+_patterns = []  # id: pattern
+_lock = threading.Lock()
+
+
+def _intern(patterns):
+    """
+    Return an int64 array of the ids of `patterns`, adding new ones to the vocabulary.
+    """
+    with _lock:
+        new = len(set(pattern for pattern in patterns if pattern not in _ids))
+        if MAX_SIZE is not None and len(_patterns) + new > MAX_SIZE:
+            raise ValueError('The ngram vocabulary is full ({} patterns). Call ngram_vocab.clear() once the '
+                             'ids handed out so far are no longer needed, or raise ngram_vocab.MAX_SIZE.'.format(len(_patterns)))
+        res = np.empty(len(patterns), dtype='int64')
+        for i, pattern in enumerate(patterns):
+            _id = _ids.get(pattern)
+            if _id is None:
+                _id = _ids[pattern] = len(_patterns)
+                _patterns.append(pattern)
+            res[i] = _id
+        return res
+
+
+def _objects(values):
+    if not isinstance(values, np.ndarray) or values.dtype != object:
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = list(values)
+        values = arr
+    return values
+
+
+def encode(values):
+    """
+    Return an int64 array of the ids of the patterns in `values`, an iterable of
+    strings or tuples. Missing values get -1.
+    """
+    values = _objects(values)
+    codes, uniques = pd.factorize(values.ravel())
+    ids = _intern(list(uniques))
+    res = np.full(len(codes), -1, dtype='int64')
+    res[codes >= 0] = ids[codes[codes >= 0]]
+    return res.reshape(values.shape)
+
+
+def factorize(*values):
+    """
+    Return a list with an int64 array of ids for each of the iterables of
+    patterns in `values`, numbered for this call only, so that the same pattern
+    has the same id in all of them. Missing values get -1. Unlike `encode`, this
+    doesn't add the patterns to the vocabulary.
+    """
+    values = [_objects(vals) for vals in values]
+    flat = [vals.ravel() for vals in values]
+    codes, _ = pd.factorize(np.concatenate(flat) if flat else np.zeros(0, dtype=object))
+    ends = np.cumsum([len(vals) for vals in flat])
+    return [part.reshape(vals.shape) for part, vals in zip(np.split(codes.astype('int64'), ends[:-1]), values)]
+
+
+def decode(ids):
+    """
+    Return an object array of the patterns with the given `ids`, and NaN for -1.
+    """
+    ids = np.asarray(ids, dtype='int64')
+    res = np.full(ids.shape, np.nan, dtype=object)
+    found = ids >= 0
+    unique, inverse = np.unique(ids[found], return_inverse=True)
+    patterns = np.empty(len(unique), dtype=object)
+    patterns[:] = [_patterns[_id] for _id in unique]
+    res[found] = patterns[inverse]
+    return res
+
+
+def encode_frame(df):
+    """
+    Return a copy of `df` with each pattern replaced by its id. Columns have the
+    nullable "Int64" dtype so that empty cells stay missing.
+    """
+    ids = encode(df.to_numpy(dtype=object))
+    data = {i: pd.arrays.IntegerArray(ids[:, i], ids[:, i] == -1) for i in range(ids.shape[1])}
+    res = pd.DataFrame(data, index=df.index)
+    res.columns = df.columns
+    return res
+
+
+def decode_frame(df):
+    """
+    Return a copy of `df`, a df of pattern ids like `encode_frame` returns, with
+    the ids replaced by the patterns.
+    """
+    ids = df.fillna(-1).to_numpy(dtype='int64')
+    res = pd.DataFrame(decode(ids), index=df.index, columns=df.columns)
+    return res.infer_objects()
+
+
+def clear():
+    """
+    Empty the vocabulary. Ids handed out before can no longer be decoded.
+    """
+    with _lock:
+        _ids.clear()
+        _patterns.clear()
+
+
+def size():
+    """
+    Return the number of patterns in the vocabulary.
+    """
+    return len(_patterns)
@@ -0,0 +1,209 @@
+"""
+Fetching of remote scores (e.g. the MEI files on crimproject.org).
+
+All requests go through one shared, keep-alive `httpx.Client`, so importing or
+printing many pieces from the same server reuses a single connection instead
+of opening a new one for every url. `fetch_all` downloads a batch of urls
+concurrently over one `httpx.AsyncClient`. Failed requests are retried with
+exponential backoff.
+
+If a mirror directory is set (with the `CRIM_MIRROR_DIR` environment variable
+or the `mirror` argument), every download is also saved there along with its
+ETag and Last-Modified headers. Later requests for the same url are made
+conditional on those, so unchanged scores are read from the mirror after a
+304 response, and the mirrored copy is used if the server can't be reached
+or answers with a server error. Client errors like 404 are raised as usual,
+so that a score that was removed or moved isn't served from the mirror.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import tempfile
+import time
+import urllib.parse
+
+import httpx
+
+# most connections kept open to one server, and most requests in flight in `fetch_all`
+MAX_CONNECTIONS = 8
+RETRIES = 3
+# seconds to wait before the first retry, doubled for each one after that
+BACKOFF = 0.5
+TIMEOUT = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_client = None
+
+
+def _limits(max_connections):
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def get_client():
+    """
+    Return the shared `httpx.Client`, creating it on first use.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.Client(limits=_limits(MAX_CONNECTIONS), timeout=TIMEOUT, follow_redirects=True)
+    return _client
+
+
+def default_mirror_dir():
+    """
+    Return the mirror directory set with the `CRIM_MIRROR_DIR` environment
+    variable, or None if there isn't one.
+    """
+    return os.environ.get('CRIM_MIRROR_DIR') or None
+
+
+def _mirror_path(mirror, url):
+    """
+    Return the path of the mirrored copy of `url`, or None if `url` can't be
+    mirrored because its path would lead outside the `mirror` directory.
+    """
+    parts = urllib.parse.urlsplit(url)
+    segments = [seg for seg in parts.path.split('/') if seg not in ('', '.')] or ['index']
+    if parts.query:
+        segments[-1] += '_' + hashlib.sha1(parts.query.encode()).hexdigest()[:10]
+    for seg in [parts.netloc] + segments:
+        if (seg == '..' or os.path.isabs(seg) or os.path.splitdrive(seg)[0]
+                or os.sep in seg or (os.altsep and os.altsep in seg)):
+            return None
+    return os.path.join(mirror, parts.netloc, *segments)
+
+
+def _read_mirror(mirror, url):
+    """
+    Return the mirrored text of `url` and the dict of its saved validator
+    headers, or (None, {}) if it hasn't been mirrored.
+    """
+    path = _mirror_path(mirror, url) if mirror else None
+    if path is None:
+        return None, {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        with open(path + '.headers.json') as f:
+            validators = json.load(f)
+    except (OSError, ValueError):
+        return None, {}
+    return text, validators
+
+
+def _atomic_write(path, text):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _write_mirror(mirror, url, response):
+    path = _mirror_path(mirror, url)
+    if path is None:
+        return
+    validators = {key: response.headers[key] for key in ('etag', 'last-modified') if key in response.headers}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _atomic_write(path, response.text)
+        _atomic_write(path + '.headers.json', json.dumps(validators))
+    except OSError as err:
+        print('Could not save {} to the mirror in {}:'.format(url, mirror), err)
+
+
+def _conditional_headers(cached, validators):
+    headers = {}
+    if cached is not None:
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last-modified' in validators:
+            headers['If-Modified-Since'] = validators['last-modified']
+    return headers
+
+
+def _response_text(response, url, mirror, cached):
+    """
+    Return the text to use for `response`, saving fresh downloads to the mirror.
+    Server errors fall back to the mirrored copy if there is one. Other error
+    responses, and server errors without a mirrored copy, raise
+    `httpx.HTTPStatusError`.
+    """
+    if cached is not None and (response.status_code == 304 or response.is_server_error):
+        return cached
+    response.raise_for_status()
+    if mirror:
+        _write_mirror(mirror, url, response)
+    return response.text
+
+
+def fetch_text(url, mirror=None):
+    """
+    Download and return the text at `url` over the shared client, retrying
+    connection errors and temporary server errors with exponential backoff.
+    If the server still can't be reached or answers with a server error, the
+    mirrored copy is returned when there is one. Otherwise, and for client
+    errors like 404, the `httpx.HTTPError` is raised.
+    """
+    mirror = mirror or default_mirror_dir()
+    cached, validators = _read_mirror(mirror, url)
+    headers = _conditional_headers(cached, validators)
+    for attempt in range(RETRIES + 1):
+        try:
+            response = get_client().get(url, headers=headers)
+        except httpx.TransportError:
+            if attempt == RETRIES:
+                if cached is not None:
+                    return cached
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                return _response_text(response, url, mirror, cached)
+        time.sleep(BACKOFF * 2 ** attempt)
+
+
+async def _fetch_text_async(client, semaphore, url, mirror):
+    cached, validators = _read_mirror(mirror, url)
+    headers = _conditional_headers(cached, validators)
+    for attempt in range(RETRIES + 1):
+        try:
+            async with semaphore:
+                response = await client.get(url, headers=headers)
+        except httpx.TransportError as err:
+            if attempt == RETRIES:
+                return cached if cached is not None else err
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                try:
+                    return _response_text(response, url, mirror, cached)
+                except httpx.HTTPStatusError as err:
+                    return err
+        await asyncio.sleep(BACKOFF * 2 ** attempt)
+
+
+async def _fetch_all(urls, max_concurrency, mirror):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with httpx.AsyncClient(limits=_limits(max_concurrency), timeout=TIMEOUT,
+                                 follow_redirects=True) as client:
+        return await asyncio.gather(*(_fetch_text_async(client, semaphore, url, mirror) for url in urls))
+
+
+def _run(coroutine):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # there's already an event loop running in this thread, e.g. in Jupyter
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, coroutine).result()
+
+
+def fetch_all(urls, max_concurrency=MAX_CONNECTIONS, mirror=None):
+    """
+    Download all the `urls` concurrently, with at most `max_concurrency`
+    requests in flight, and return a list in the same order holding the text
+    of each url, or the `httpx.HTTPError` that stopped it from downloading.
+    Retries and the mirror work as in `fetch_text`.
+    """
+    return _run(_fetch_all(list(urls), max_concurrency, mirror or default_mirror_dir()))
@@ -0,0 +1,123 @@
+"""
+On-disk cache of parsed scores, used by `importScore` to skip music21's
+parser when a piece has already been imported in an earlier session.
+
+Entries are keyed by a hash of the piece's content (not its path), so an
+edited file or a changed remote score simply misses the cache. Each entry
+holds the frozen music21 score, which thaws in well under the time it takes
+to parse it (see benchmarks/score_cache.py). Tables like `measures` are
+still computed when a piece first needs them, so that an import that misses
+the cache only costs the parse and the write.
+
+Local files other than MEI are left to music21, which keeps its own pickled
+copy of every file it parses, so only remote scores, MEI files and score
+strings are cached here.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+
+import music21
+from music21 import freezeThaw
+
+# bump this whenever the layout of a cache entry changes
+CACHE_FORMAT = 2
+
+
+def default_cache_dir():
+    """
+    Return the cache directory set with the `CRIM_SCORE_CACHE` environment
+    variable, or None if caching hasn't been turned on.
+    """
+    return os.environ.get('CRIM_SCORE_CACHE') or None
+
+
+def content_key(content):
+    """
+    Return the cache key for `content`, which is the text or the bytes of a
+    score. The music21 version is part of the key because frozen streams
+    can't be thawed reliably across music21 releases.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    digest = hashlib.sha256(content)
+    digest.update('|music21={}|format={}'.format(music21.VERSION_STR, CACHE_FORMAT).encode())
+    return digest.hexdigest()
+
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + '.pkl')
+
+
+def freeze(score, copy=False):
+    """
+    Return `score` as pickled bytes that can be stored or sent to another
+    process. This strips `score` in place, so only use the thawed copy
+    afterwards, unless `copy` is True, in which case a copy is frozen instead
+    and `score` is left as it was.
+    """
+    return freezeThaw.StreamFreezer(score, fastButUnsafe=not copy).writeStr()
+
+
+def thaw(data):
+    """
+    Rebuild a music21 score from the bytes returned by `freeze`.
+    """
+    thawer = freezeThaw.StreamThawer()
+    thawer.openStr(data)
+    return thawer.stream
+
+
+def load(cache_dir, key):
+    """
+    Return the score cached under `key`, or None if there is no usable entry.
+    Unreadable or corrupt entries are treated as misses.
+    """
+    path = _entry_path(cache_dir, key)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+        return thaw(entry['score'])
+    except Exception:
+        return None
+
+
+def store(cache_dir, key, score):
+    """
+    Write a frozen copy of `score` to the cache under `key`, leaving `score`
+    itself as it was, so that the piece being imported keeps the score that
+    was just parsed. The write is atomic so that concurrent imports never see
+    half-written entries. Scores that can't be frozen or written are skipped.
+    """
+    path = _entry_path(cache_dir, key)
+    try:
+        frozen = freeze(score, copy=True)
+    except Exception:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({'score': frozen}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as err:
+        print('Could not write to the score cache in {}:'.format(cache_dir), err)
+
+
+def clear(cache_dir=None):
+    """
+    Delete every entry in the score cache and return how many were removed.
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    removed = 0
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return removed
+    for root, _, files in os.walk(cache_dir):
+        for file in files:
+            if file.endswith('.pkl'):
+                os.remove(os.path.join(root, file))
+                removed += 1
+    return removed
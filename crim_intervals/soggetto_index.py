@@ -0,0 +1,150 @@
+"""
+Corpus-wide index of melodic ngrams for searches by distance.
+
+`CorpusBase.soggettoIndex` collects the melodic ngrams of every piece in a
+corpus into a `SoggettoIndex`, which answers questions like "which soggetti
+anywhere in the corpus are within distance 1 of '1, -2, 1, -2'?" without
+comparing every pair of ngrams. Distances are the same as in
+`ImportedPiece.distance` and `ImportedPiece.flexed_distance`: the sum of the
+absolute differences of the intervals, optionally ignoring a difference of up
+to `head_flex` in the first interval.
+
+The distinct ngrams are kept as rows of an int array, sorted by the sum of
+their intervals after the first. Two ngrams can't be closer than the
+difference of those sums, so a query with `max_distance=k` only has to check
+the rows whose sum is within `k` of the query's, which a binary search finds.
+
+`SoggettoIndex.save` writes an index to a directory as two parquet files, the
+occurrences and that table of patterns sorted by their sums, and
+`SoggettoIndex.load` reads it back in a later session without going through
+the corpus again.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from .sorting_lists import tuple_to_list
+
+# columns describing each occurrence of an ngram, in the order they're returned in
+OCCURRENCE_COLUMNS = ('Composer', 'Title', 'Voice', 'Offset', 'Pattern')
+# files written by `SoggettoIndex.save`
+OCCURRENCES_FILE = 'occurrences.parquet'
+PATTERNS_FILE = 'patterns.parquet'
+
+
+def _vector(pattern):
+    return tuple_to_list(pattern, cast=int)
+
+
+class SoggettoIndex:
+    """
+    Index of the ngrams in `occurrences`, a df with the columns in
+    `OCCURRENCE_COLUMNS` and a row for every place an ngram occurs. The
+    "Pattern" column holds the ngrams, as strings like "1, -2, 1" or tuples,
+    which must all have the same length.
+    """
+    def __init__(self, occurrences):
+        occurrences = occurrences.reset_index(drop=True)
+        codes, patterns = pd.factorize(occurrences['Pattern'])
+        self.patterns = np.asarray(patterns, dtype=object)
+        width = len(_vector(self.patterns[0])) if len(self.patterns) else 0
+        self.vectors = np.array([_vector(pattern) for pattern in self.patterns], dtype='int64')
+        self.vectors = self.vectors.reshape(len(self.patterns), width)
+        # pattern codes sorted by the sum of their intervals after the first
+        keys = self.vectors[:, 1:].sum(axis=1)
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+        # occurrences grouped by pattern code
+        byPattern = np.argsort(codes, kind='stable')
+        self._occurrences = occurrences.iloc[byPattern].reset_index(drop=True)
+        self._starts = np.searchsorted(codes[byPattern], np.arange(len(self.patterns) + 1))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def save(self, path):
+        """
+        Save the index to the directory `path`, which is created if needed, for
+        `SoggettoIndex.load`. The occurrences are stored with their patterns'
+        codes, and the patterns with their intervals in the order of their sums.
+        """
+        os.makedirs(path, exist_ok=True)
+        occurrences = self._occurrences.copy()
+        occurrences['Pattern'] = np.repeat(np.arange(len(self.patterns)), np.diff(self._starts))
+        occurrences.to_parquet(os.path.join(path, OCCURRENCES_FILE), index=False)
+        patterns = pd.DataFrame(self.vectors[self._order],
+                                columns=['Interval{}'.format(i) for i in range(self.vectors.shape[1])])
+        patterns.insert(0, 'Key', self._keys)
+        patterns.insert(0, 'Code', self._order)
+        patterns.insert(0, 'Pattern', pd.Series(self.patterns[self._order], dtype=object))
+        patterns.to_parquet(os.path.join(path, PATTERNS_FILE), index=False)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return the index saved to the directory `path` by `SoggettoIndex.save`.
+        """
+        table = pd.read_parquet(os.path.join(path, PATTERNS_FILE))
+        occurrences = pd.read_parquet(os.path.join(path, OCCURRENCES_FILE))
+        index = cls.__new__(cls)
+        index._order = table['Code'].to_numpy(dtype='int64')
+        index._keys = table['Key'].to_numpy(dtype='int64')
+        index.patterns = np.empty(len(table), dtype=object)
+        # tuple patterns come back from parquet as arrays
+        index.patterns[index._order] = [pattern if isinstance(pattern, str) else tuple(pattern.tolist())
+                                        for pattern in table['Pattern']]
+        intervals = table.drop(columns=['Pattern', 'Code', 'Key']).to_numpy(dtype='int64')
+        index.vectors = np.empty_like(intervals)
+        index.vectors[index._order] = intervals
+        codes = occurrences['Pattern'].to_numpy(dtype='int64')
+        occurrences['Pattern'] = index.patterns[codes]
+        index._occurrences = occurrences
+        index._starts = np.searchsorted(codes, np.arange(len(index.patterns) + 1))
+        return index
+
+    def _matches(self, pattern, max_distance, head_flex):
+        """
+        Return arrays of the codes of the patterns at most `max_distance` from
+        `pattern` and of their distances.
+        """
+        query = np.array(_vector(pattern), dtype='int64')
+        if len(query) != self.vectors.shape[1]:
+            raise ValueError('Expected a pattern of {} intervals, got {}.'.format(self.vectors.shape[1], len(query)))
+        key = query[1:].sum()
+        lo = np.searchsorted(self._keys, key - max_distance, 'left')
+        hi = np.searchsorted(self._keys, key + max_distance, 'right')
+        candidates = self._order[lo:hi]
+        diff = np.abs(self.vectors[candidates] - query)
+        if head_flex is not None and diff.shape[1]:
+            head = diff[:, 0]
+            head[head <= head_flex] = 0
+        dist = diff.sum(axis=1)
+        found = dist <= max_distance
+        return candidates[found], dist[found]
+
+    def patterns_near(self, pattern, max_distance=0, head_flex=None):
+        """
+        Return a series of the distances from `pattern` of the ngrams in the
+        index at most `max_distance` away, indexed by ngram and sorted by distance.
+        """
+        codes, dist = self._matches(pattern, max_distance, head_flex)
+        order = np.lexsort((codes, dist))
+        return pd.Series(dist[order], index=pd.Index(self.patterns[codes[order]], name='Pattern', tupleize_cols=False), name='Distance')
+
+    def query(self, pattern, max_distance=0, head_flex=None):
+        """
+        Return a df of every occurrence in the corpus of the ngrams at most
+        `max_distance` from `pattern`, with a "Distance" column, sorted by
+        distance. `pattern` can be a string like "1, -2, 1, -2" or a tuple,
+        and `head_flex` works as in `ImportedPiece.flexed_distance`.
+        """
+        codes, dist = self._matches(pattern, max_distance, head_flex)
+        order = np.lexsort((codes, dist))
+        codes, dist = codes[order], dist[order]
+        counts = self._starts[codes + 1] - self._starts[codes]
+        rows = [np.arange(self._starts[code], self._starts[code + 1]) for code in codes]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype='int64')
+        res = self._occurrences.iloc[rows].reset_index(drop=True)
+        res['Distance'] = np.repeat(dist, counts)
+        return res
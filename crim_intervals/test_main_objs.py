@@ -1,3 +1,7 @@
+import sys
+
+import pytest
+
 from .main_objs import *
 from .test_constants import *
 
@@ -29,6 +33,24 @@ class DummyPiece:
     def _getM21ObjsNoTies(self):
         return self._notes_df.copy()
 
+    # ImportedPiece.notes builds the notes table from the per-part pitch arrays
+    # (with the real `_pitchArrayFrame`), not from `_getM21ObjsNoTies`, so
+    # that's the part of the interface the corpus helpers need
+    def _getPartNames(self):
+        return list(self._notes_df.columns)
+
+    def _getNoTiesIndex(self):
+        return self._notes_df.index
+
+    def _getPitchArrays(self):
+        return [{'name': self._notes_df[col].to_numpy(dtype=object),
+                 'tie': np.zeros(len(self._notes_df), dtype='int64'),
+                 'index': self._notes_df.index.to_numpy()} for col in self._notes_df.columns]
+
+    _pitchArrayFrame = ImportedPiece._pitchArrayFrame
+    # notes() hands out copies of the cached variants that _notes builds
+    _notes = ImportedPiece._notes
+
     def _noteRestHelper(self, noteOrRest):
         if noteOrRest == 'Rest':
             return 'Rest'
@@ -146,6 +168,27 @@ def _make_two_part_score_with_key_signatures():
     return score
 
 
+def _make_fuga_score(entries=(0, 8, 16, 24, 32)):
+    from music21 import stream, note, meter, metadata
+
+    score = stream.Score()
+    score.metadata = metadata.Metadata()
+    score.metadata.title = 'Fuga Test'
+    score.metadata.composer = 'Tester'
+    # the same soggetto in every voice, entering at `entries`
+    for i, start in enumerate(entries):
+        part = stream.Part(id='Part{}'.format(i))
+        part.partName = 'V{}'.format(i)
+        part.append(meter.TimeSignature('4/4'))
+        if start:
+            part.append(note.Rest(quarterLength=start))
+        for name in ('C4', 'D4', 'E4', 'F4', 'G4', 'E4'):
+            part.append(note.Note(name, quarterLength=2))
+        part.append(note.Rest(quarterLength=48 - start))
+        score.insert(0, part)
+    return score
+
+
 def test_key_signatures_and_detail_index_key_sig_flag():
     piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
 
@@ -160,6 +203,817 @@ def test_key_signatures_and_detail_index_key_sig_flag():
     assert set(key_sig_values) == {1.0}
 
 
+def test_measure_beat_lookup_matches_detail_index():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+
+    det = piece.detailIndex(piece.notes(), offset=True).reset_index()
+    labels = (det['Measure'].astype(str) + '/' + det['Beat'].astype(str)).tolist()
+    assert piece._measureBeatLabels([1.0, 0.0, 1.0, 0.5]) == labels
+
+
+def test_measures_and_beats_lookup_by_offset():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    measures, beats = piece._measuresAndBeats([0.0, 0.5, 1.0])
+    assert measures.tolist() == [1, 1, 1]
+    assert beats.tolist() == [1.0, 1.0, 2.0]
+
+
+def test_detail_index_forward_fills_levels_onto_any_offsets():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    df = pd.DataFrame({'Count': [3, 4]}, index=[0.5, 1.0])
+
+    res = piece.detailIndex(df, offset=True, sounding=True, lowest=True, progress=True)
+    assert res.index.names == ['Measure', 'Beat', 'Offset', 'Sounding', 'Progress', 'Lowest']
+    assert res.index.tolist() == [(1, 1.0, 0.5, 2, 0.5, 'C3'), (1, 2.0, 1.0, 2, 1.0, 'D3')]
+    # offsets that aren't in the df give missing values, so ints become floats as with a join
+    assert res['Count'].dtype == 'float64'
+
+
+def test_detail_index_defaults_to_measure_and_beat():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    res = piece.detailIndex(piece.notes())
+    assert res.index.names == ['Measure', 'Beat']
+    assert res.index.get_level_values('Beat').tolist() == [1.0, 2.0]
+
+
+def _make_pitch_array_piece():
+    score = _make_two_part_score_with_key_signatures()
+    for part in score.parts:
+        part.append(note.Note('E4', quarterLength=1.5))
+        part.append(note.Rest(quarterLength=0.5))
+        part.append(meter.TimeSignature('3/4'))
+        part.append(note.Note('F4', quarterLength=3))
+        part.makeMeasures(inPlace=True)
+    return ImportedPiece(score, 'test.xml')
+
+
+def test_pitch_array_beat_strengths_match_music21():
+    piece = _make_pitch_array_piece()
+    expected = piece._getM21ObjsNoTies().map(lambda n: n.beatStrength, na_action='ignore')
+    pd.testing.assert_frame_equal(piece.beatStrengths(), expected)
+
+
+def test_pitch_array_notes_match_music21():
+    piece = _make_pitch_array_piece()
+    expected = piece._getM21ObjsNoTies().map(lambda n: 'Rest' if n.isRest else n.nameWithOctave,
+                                             na_action='ignore')
+    pd.testing.assert_frame_equal(piece.notes(combineRests=False), expected)
+
+
+def test_pitch_array_low_and_high_lines():
+    piece = _make_pitch_array_piece()
+    assert piece.lowLine().tolist() == ['C3', 'D3', 'E4', 'Rest', 'F4']
+    assert piece.highLine().tolist() == ['C5', 'D5', 'E4', 'Rest', 'F4']
+
+
+def test_beats_follow_measures_and_time_signatures_with_fractional_offsets():
+    score = _make_two_part_score_with_key_signatures()
+    for part in score.parts:
+        for _ in range(3):
+            part.append(note.Note('E4', quarterLength=Fraction(2, 3)))
+        part.append(meter.TimeSignature('3/2'))
+        part.append(note.Note('F4', quarterLength=6))
+        part.makeMeasures(inPlace=True)
+    piece = ImportedPiece(score, 'test.xml')
+
+    expected = piece._getM21ObjsNoTies().map(lambda n: float(n.beat), na_action='ignore')
+    pd.testing.assert_frame_equal(piece.beats().loc[expected.index], expected)
+    assert np.allclose(piece.beatIndex(), expected.iloc[:, 0])
+
+
+def test_interval_labels_match_music21_for_every_setting():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    names = ['C4', 'C#4', 'B#3', 'D-4', 'E-3', 'F##4', 'G5', 'A-2', 'B4', 'C--5']
+    pairs = [(low, high) for low in names for high in names]
+    intervals = [interval.Interval(note.Note(low), note.Note(high)) for low, high in pairs]
+    for settings in interval_labels.SETTINGS:
+        expected = [piece._intervalMethods[settings](ntrvl) for ntrvl in intervals]
+        assert interval_labels.label_pairs(settings, *zip(*pairs)) == expected
+    expected = [ntrvl.directedName for ntrvl in intervals]
+    assert interval_labels.label_pairs('directedName', *zip(*pairs)) == expected
+
+
+def test_interval_label_lookups_follow_the_settings():
+    interval_labels.clear_cache()
+    assert interval_labels.label('directedName', 'C4', 'B#3') == 'd-2'
+    low = ['C4', 'D4', 'E4', 'F4']
+    assert interval_labels.label_pairs(('c', True, True), low, ['G4'] * 4) == ['7', '5', '3', '2']
+    assert interval_labels.label_pairs(('q', False, True), low, ['G4'] * 4) == ['P5', 'P4', 'm3', 'M2']
+    interval_labels.clear_cache()
+
+
+def test_interval_label_table_is_shared_and_bounded(monkeypatch):
+    interval_labels.clear_cache()
+    monkeypatch.setattr(interval_labels, 'MAX_CACHED_PAIRS', 3)
+    interval_labels.label_pairs(('c', True, True), ['C4', 'D4', 'E4', 'F4'], ['G4'] * 4)
+    interval_labels.label_pairs(('q', False, True), ['C4', 'D4', 'E4', 'F4'], ['G4'] * 4)
+    assert interval_labels.cache_info() == {'pairs': 3, 'max_pairs': 3}
+    interval_labels.clear_cache()
+
+
+def _ngram_intervals():
+    return pd.DataFrame({'A': ['2', '-3', 'Rest', '5', '2', '-2'], 'B': ['1', np.nan, '4', '4', 'Rest', '3']},
+                        index=[0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+
+
+def test_ngrams_windows_skip_rests_and_missing_values():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    first = piece.ngrams(df=_ngram_intervals(), n=2)
+    assert first['A'].dropna().tolist() == [('2', '-3'), ('5', '2'), ('2', '-2')]
+    assert first['A'].dropna().index.tolist() == [0.0, 3.0, 4.0]
+    assert first['B'].dropna().tolist() == [('1', '4'), ('4', '4')]
+
+
+def test_ngrams_last_offsets_and_exclusions():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    last = piece.ngrams(df=_ngram_intervals(), n=2, offsets='last', exclude=['^2$'])
+    assert last['A'].dropna().to_dict() == {2.0: ('-3', 'Rest'), 3.0: ('Rest', '5')}
+    assert last['B'].dropna().index.tolist() == [2.0, 3.0, 4.0, 5.0]
+
+
+def test_ngrams_both_offsets_without_exclusions():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    both = piece.ngrams(df=_ngram_intervals(), n=3, offsets='both', exclude=[])
+    assert both.loc[(2.0, 4.0), 'A'] == ('Rest', '5', '2')
+
+
+def test_ngrams_longest_runs():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    longest = piece.ngrams(df=_ngram_intervals(), n=-1, offsets='both')
+    assert longest['A'].dropna().to_dict() == {(0.0, 1.0): '2, -3', (3.0, 5.0): '5, 2, -2'}
+    assert longest['B'].dropna().to_dict() == {(0.0, 3.0): '1, 4, 4', (5.0, 5.0): '3'}
+
+
+def test_ngram_tokens_share_ids_and_decode_to_strings():
+    from . import ngram_vocab
+
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    notes = pd.DataFrame({'A': ['C4', 'D4', 'E4', 'C4', 'D4'], 'B': ['E4', 'C4', 'D4', np.nan, 'F4']})
+    strings = notes.apply(lambda col: col.str.cat(col.shift(-1), sep=', '))
+
+    ids = piece.ngrams(df=strings.iloc[:-1], n=1, tokens=True)
+    assert (ids.dtypes == 'Int64').all()
+    assert ids.at[0, 'A'] == ids.at[3, 'A'] == ids.at[1, 'B']
+    assert pd.isna(ids.at[2, 'B'])
+    decoded = ngram_vocab.decode_frame(ids)
+    pd.testing.assert_frame_equal(decoded, piece.ngrams(df=strings.iloc[:-1], n=1))
+
+
+def test_ngram_vocab_factorize_leaves_the_vocabulary_alone():
+    from . import ngram_vocab
+
+    size = ngram_vocab.size()
+    a, b = ngram_vocab.factorize(np.array(['1, 2', None, '3, 4'], dtype=object), ['3, 4', '5, 6'])
+    assert a.tolist() == [0, -1, 1] and b.tolist() == [1, 2]
+    assert ngram_vocab.size() == size
+
+
+def test_ngram_vocab_is_bounded(monkeypatch):
+    from . import ngram_vocab
+
+    size = ngram_vocab.size()
+    monkeypatch.setattr(ngram_vocab, 'MAX_SIZE', size + 1)
+    ngram_vocab.encode(['vocab test {}'.format(size)] * 2)
+    with pytest.raises(ValueError):
+        ngram_vocab.encode(['vocab test {}'.format(size + 1)])
+
+
+def test_ngram_vocab_clear_empties_it():
+    from . import ngram_vocab
+
+    ngram_vocab.encode(['vocab test 1'])
+    ngram_vocab.clear()
+    assert ngram_vocab.size() == 0
+    assert ngram_vocab.encode(['vocab test 2']).tolist() == [0]
+
+
+CVF_PATTERNS = ['^(?:[\\-]?.|Rest)_1:[\\-]?., 2_-2:1, 3_2:-2, (?:1|8)', '^3_1:1, 2_-2:1, 3_2:-2, (?:1|8)',
+                '^(?:Rest_1|[\\-]?._[\\-]?[^1]):1, 7_1:-2, 6_(?:-5|4):2, 4D?']
+CVF_NGRAMS = ['3_1:1, 2_-2:1, 3_2:-2, 8', '4D_1:1, 2_-2:1, 3_2:-2, 8', 'Rest_1:1, 7_1:-2, 6_4:2, 4D',
+              '5_2:1, 7_1:-2, 6_4:2, 4D', '3_1:1, 2_-2:1, 3_2:-2, 8, 5', np.nan, '3_1:1, 2_-2:1, 3_2:-2, 8']
+
+
+def test_cvf_pattern_matcher_returns_first_matching_key():
+    from . import cvf_patterns
+
+    matcher = cvf_patterns.PatternMatcher(CVF_PATTERNS)
+    assert matcher.lengths == [4]
+    keys = matcher.match(CVF_NGRAMS)
+    assert keys[0] == keys[6] == CVF_PATTERNS[0]
+    assert keys[1] is None and keys[4] is None and keys[5] is None
+    assert keys[2] == keys[3] == CVF_PATTERNS[2]
+
+
+def test_cvf_pattern_matcher_keeps_the_unmatched_end_of_a_last_token():
+    from . import cvf_patterns
+
+    matcher = cvf_patterns.PatternMatcher(CVF_PATTERNS)
+    assert matcher.match(['3_1:1, 2_-2:1, 3_2:-2, 8D'])[0] == CVF_PATTERNS[0] + 'D'
+
+
+def test_cvf_pattern_matcher_agrees_with_re():
+    from . import cvf_patterns
+
+    matcher = cvf_patterns.PatternMatcher(CVF_PATTERNS)
+    for ngram, key in zip(CVF_NGRAMS, matcher.match(CVF_NGRAMS)):
+        if isinstance(ngram, str) and ngram.count(', ') + 1 in matcher.lengths:
+            hit = any(re.match(pattern, ngram) and pattern.count(', ') == ngram.count(', ')
+                      for pattern in CVF_PATTERNS)
+            assert hit == (key is not None)
+
+
+def _cvf_pairs():
+    index = pd.MultiIndex.from_tuples([(0.0, 4.0), (0.0, 4.0), (2.0, 4.0), (6.0, 8.0)], names=['First', 'Last'])
+    return pd.DataFrame({'LowerVoice': 'Part-2', 'UpperVoice': 'Part-1', 'LowerCVF': ['T', 'B', 'B', 'h'],
+                         'UpperCVF': ['A', 'C', 'C', 'C']}, index=index)
+
+
+def test_cvf_helper_scatters_pairs_in_order_and_keeps_altizans():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    cvfs = piece._cvf_helper(_cvf_pairs())
+    assert cvfs.columns.tolist() == ['Part-1', 'Part-2']
+    assert cvfs.loc[(0.0, 4.0)].tolist() == ['A', 'Q']
+    assert cvfs.loc[(2.0, 4.0)].tolist() == ['C', 'B']
+
+
+def test_cvf_disambiguate_h_removes_h_in_two_voice_rows():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    resolved = piece._cvf_disambiguate_h(piece._cvf_helper(_cvf_pairs()))
+    assert resolved.loc[(6.0, 8.0)].isna().all()
+    assert resolved.loc[(0.0, 4.0)].tolist() == ['A', 'Q']
+
+
+def test_condense_multi_index_keeps_last_value_per_column():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    index = pd.MultiIndex.from_tuples([(0.0, 4.0), (2.0, 4.0), (3.0, 4.0), (5.0, 8.0)], names=['First', 'Last'])
+    df = pd.DataFrame({'S': ['C', np.nan, 'A', np.nan], 'B': ['T', 'B', np.nan, np.nan]}, index=index)
+    res = piece.condenseMultiIndex(df)
+    assert res.index.tolist() == [4.0, 8.0] and res.index.name == 'Last'
+    assert res.loc[4.0].tolist() == ['A', 'B']
+    assert res.loc[8.0].isna().all() and not any(val is None for val in res.loc[8.0])
+
+
+def _distance_ngrams():
+    return pd.DataFrame({'A': ['1, -2, 1', '2, -2, 1', '4, 1, 1'], 'B': ['1, -2, 2', np.nan, '1, -2, 1']})
+
+
+def test_flexed_distance_matrix_is_symmetric_and_flexes_the_head():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    dense = piece.flexed_distance(1, _distance_ngrams())
+    assert dense.loc['1, -2, 1', '2, -2, 1'] == 0 and dense.loc['1, -2, 1', '4, 1, 1'] == 6
+    assert (dense.to_numpy() == dense.to_numpy().T).all()
+
+
+def test_flexed_distance_edges_match_dense_matrix(monkeypatch):
+    from . import main_objs
+
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    ngrams = _distance_ngrams()
+    stacked = piece.flexed_distance(1, ngrams).stack()
+    expected = stacked[stacked <= 1]
+    # force several chunks
+    monkeypatch.setattr(main_objs, 'DISTANCE_CHUNK_CELLS', 5)
+    edges = piece.flexed_distance(1, ngrams, max_distance=1)
+    assert list(zip(edges['source'], edges['match'])) == expected.index.tolist()
+    assert edges['distance'].tolist() == expected.tolist()
+
+
+def test_distance_counts_every_step():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    assert piece.distance(df=_distance_ngrams()).loc['1, -2, 1', '2, -2, 1'] == 1
+
+
+def test_distance_rejects_ngrams_of_mixed_lengths():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    with pytest.raises(ValueError, match='same length'):
+        piece.distance(df=pd.DataFrame({'A': ['1, -2', '1, -2, 1']}))
+
+
+def _soggetto_occurrences():
+    rng = np.random.default_rng(0)
+    vectors = rng.integers(-3, 4, (300, 4))
+    patterns = [', '.join(map(str, row)) for row in vectors]
+    occurrences = pd.DataFrame({'Composer': 'C', 'Title': rng.choice(['A', 'B'], 300), 'Voice': 'S',
+                                'Offset': np.arange(300.0), 'Pattern': patterns})
+    return vectors, occurrences
+
+
+def test_soggetto_index_range_queries_match_brute_force():
+    from . import soggetto_index
+
+    vectors, occurrences = _soggetto_occurrences()
+    index = soggetto_index.SoggettoIndex(occurrences)
+    for query in vectors[:20]:
+        for max_distance, head_flex in ((0, None), (2, None), (1, 1)):
+            diff = np.abs(vectors - query)
+            if head_flex is not None:
+                diff[diff[:, 0] <= head_flex, 0] = 0
+            expected = np.flatnonzero(diff.sum(axis=1) <= max_distance)
+            res = index.query(tuple(query), max_distance, head_flex)
+            assert sorted(res['Offset']) == sorted(occurrences['Offset'][expected])
+            assert (res['Distance'] == diff.sum(axis=1)[res['Offset'].astype(int)]).all()
+            assert res['Distance'].is_monotonic_increasing
+
+
+@pytest.mark.parametrize('tuples', [False, True])
+def test_soggetto_index_save_load_round_trip(tmp_path, tuples):
+    from . import soggetto_index
+
+    vectors, occurrences = _soggetto_occurrences()
+    pattern = '1, -2, 1, 0'
+    if tuples:
+        occurrences['Pattern'] = [tuple(row) for row in vectors]
+        pattern = (1, -2, 1, 0)
+    index = soggetto_index.SoggettoIndex(occurrences)
+    index.save(str(tmp_path / 'index'))
+    loaded = soggetto_index.SoggettoIndex.load(str(tmp_path / 'index'))
+    pd.testing.assert_frame_equal(loaded.query(pattern, 3, 1), index.query(pattern, 3, 1))
+    pd.testing.assert_series_equal(loaded.patterns_near(pattern, 3), index.patterns_near(pattern, 3))
+
+
+def test_corpus_soggetto_index_is_cached():
+    corpus = CorpusBase([ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')])
+    index = corpus.soggettoIndex(n=1)
+    assert corpus.soggettoIndex(n=1) is index
+    assert index.query('1').Voice.tolist() == ['Part-1', 'Part-2']
+
+
+HIDDEN_TYPE_OFFSETS = [0, 4, 8, 8, 12, 14, 18, 26, 30]
+
+
+def test_hidden_type_offsets_are_the_pen_and_id_combinations():
+    expected = set()
+    for r in range(3, 6):
+        for combo in combinations(sorted(set(HIDDEN_TYPE_OFFSETS)), r):
+            if ImportedPiece._classify_by_offset(np.diff(combo).tolist()) in ('PEN', 'ID'):
+                expected.add(combo)
+    found = list(ImportedPiece._hiddenTypeOffsets(HIDDEN_TYPE_OFFSETS))
+    assert len(found) == len(set(found))
+    assert set(found) == expected
+
+
+def test_hidden_type_offsets_respect_max_entries():
+    found = ImportedPiece._hiddenTypeOffsets(HIDDEN_TYPE_OFFSETS, max_entries=3)
+    assert all(len(combo) <= 3 for combo in found)
+
+
+def test_presentation_types_finds_the_same_hidden_types_as_iter_hidden_types():
+    piece = ImportedPiece(_make_fuga_score(), 'fuga.xml')
+    ptypes = piece.presentationTypes(include_hidden_types=True)
+    hidden = ptypes[ptypes['Presentation_Type'].isin(['PEN', 'ID'])]
+    expected = {tuple(ptype['Offsets']) for ptype in piece.iterHiddenTypes()}
+    assert len(expected) == 8
+    assert set(hidden['Offsets'].map(tuple)) == expected
+
+
+def _count_hidden_type_candidates(monkeypatch):
+    # the `whole` flag of every candidate the search takes
+    taken = []
+    candidates = ImportedPiece._hiddenTypeCandidates
+
+    def counting(*args):
+        for candidate in candidates(*args):
+            taken.append(candidate[2])
+            yield candidate
+    monkeypatch.setattr(ImportedPiece, '_hiddenTypeCandidates', counting)
+    return taken
+
+
+def test_hidden_types_limit_stops_the_whole_search(monkeypatch):
+    taken = _count_hidden_type_candidates(monkeypatch)
+    piece = ImportedPiece(_make_fuga_score(), 'fuga.xml')
+    with pytest.warns(UserWarning, match='hidden_types_limit of 2'):
+        piece.presentationTypes(include_hidden_types=True, hidden_types_limit=2)
+    # two classified, and the one that hit the limit
+    assert taken.count(False) == 3
+
+
+def test_hidden_types_limit_warns_on_every_call():
+    piece = ImportedPiece(_make_fuga_score(), 'fuga.xml')
+    for _ in range(2):
+        with pytest.warns(UserWarning, match='hidden_types_limit'):
+            piece.presentationTypes(include_hidden_types=True, hidden_types_limit=2)
+    assert 'PresentationTypes' not in piece.analyses.entries()['Name'].tolist()
+
+
+def test_iter_hidden_types_limit_stops_and_warns(monkeypatch):
+    taken = _count_hidden_type_candidates(monkeypatch)
+    piece = ImportedPiece(_make_fuga_score(), 'fuga.xml')
+    with pytest.warns(UserWarning, match='limit of 3'):
+        found = list(piece.iterHiddenTypes(limit=3))
+    assert len(found) <= 3 and taken.count(False) == 4
+
+
+def test_entry_rows_match_an_isin_scan():
+    patterns = pd.Series(['1, 2', '3, 4', '1, 2', '5, 6', '3, 4', '7, 8'])
+    codes, uniques = pd.factorize(patterns)
+    byPattern = np.argsort(codes, kind='stable')
+    starts = np.searchsorted(codes[byPattern], np.arange(len(uniques) + 1))
+    patternCodes = {pattern: i for i, pattern in enumerate(uniques)}
+    for matches in (['1, 2'], ['3, 4', '7, 8', '1, 2'], ['9, 9'], []):
+        rows = ImportedPiece._entryRows(matches, patternCodes, byPattern, starts)
+        assert rows.tolist() == np.flatnonzero(patterns.isin(matches)).tolist()
+
+
+def test_hashable_temps_are_equal_for_equal_dicts():
+    temp = {'Offsets': [0.0, 8.0], 'Voices': ['S', 'T'], 'Count_Offsets': 2}
+    same = {'Offsets': [0.0, 8.0], 'Voices': ['S', 'T'], 'Count_Offsets': 2}
+    other = dict(temp, Offsets=[0.0, 16.0])
+    assert ImportedPiece._hashableTemp(temp) == ImportedPiece._hashableTemp(same)
+    assert ImportedPiece._hashableTemp(temp) != ImportedPiece._hashableTemp(other)
+    hash(ImportedPiece._hashableTemp(temp))
+
+
+def test_row_value_counts_match_set_counts():
+    values = np.array([['a', 'a', np.nan, 'b'],
+                       ['a', 'b', 'c', np.nan],
+                       [np.nan, np.nan, np.nan, np.nan],
+                       [('x', 1), 'b', ('x', 1), 'b']], dtype=object)
+    valid, active, distinct, repeated = ImportedPiece._rowValueCounts(values)
+    assert active.tolist() == [3, 3, 0, 4]
+    assert distinct.tolist() == [2, 3, 0, 2]
+    assert repeated.tolist() == [[True, True, False, False], [False] * 4, [False] * 4, [True] * 4]
+    assert valid.tolist() == pd.notnull(values).tolist()
+
+
+def test_analysis_cache_evicts_least_recently_used_within_budgets(monkeypatch):
+    from . import analysis_cache
+
+    monkeypatch.setattr(analysis_cache, 'MAX_TOTAL_BYTES', None)
+    cache = analysis_cache.AnalysisCache(max_bytes=2000)
+    cache['A'] = np.zeros(100)
+    cache[('B', 1)] = np.zeros(100)
+    assert 'A' in cache and cache['A'] is not None
+    cache[('B', 2)] = np.zeros(100)  # over budget, so ('B', 1), the least recently used, goes
+    assert list(cache) == ['A', ('B', 2)]
+    assert ('B', 1) not in cache
+    cache['C'] = np.zeros(1000)  # bigger than the budget on its own, but just stored
+    assert list(cache) == ['C']
+    info = cache.info()
+    assert (info['entries'], info['bytes'], info['hits'], info['misses'], info['evictions']) == (1, 8000, 1, 1, 3)
+
+
+def test_analysis_cache_evicts_from_any_cache_over_the_shared_budget(monkeypatch):
+    from . import analysis_cache
+
+    monkeypatch.setattr(analysis_cache, 'MAX_TOTAL_BYTES', None)
+    older = analysis_cache.AnalysisCache(max_bytes=0)
+    older['C'] = np.zeros(1000)
+    other = analysis_cache.AnalysisCache(max_bytes=0)
+    other['D'] = np.zeros(100)
+    budget = analysis_cache.cache_info()['bytes'] - 1000
+    monkeypatch.setattr(analysis_cache, 'MAX_TOTAL_BYTES', budget)
+    other['E'] = np.zeros(10)
+    assert list(other) == ['D', 'E']
+    assert analysis_cache.cache_info()['bytes'] <= budget
+
+
+def test_analysis_cache_counts_a_lookup_and_read_once():
+    from . import analysis_cache
+
+    cache = analysis_cache.AnalysisCache(max_bytes=0)
+    cache['F'] = 1
+    assert cache.get('F') == 1 and cache.get('G') is None and cache.setdefault('F') == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_piece_cache_info_adds_up_entries_and_sizes_music21_objects():
+    from . import analysis_cache
+
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    piece.melodic()
+    piece.harmonic()
+    piece._getM21Objs()
+    assert piece.cache_info()['bytes'] == piece.analyses.entries()['Bytes'].sum() > 0
+    # music21 objects count a fixed estimate each, wherever they are
+    sizes = piece.analyses.entries().set_index('Name')['Bytes']
+    assert sizes['M21Objs'] > 4 * analysis_cache.M21_OBJECT_BYTES
+    assert sizes['FlatParts'] > 4 * analysis_cache.M21_OBJECT_BYTES
+
+
+def test_piece_clear_cache_drops_one_analysis_or_all():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    piece.melodic()
+    assert piece.clear_cache('MelodicIntervals') == 1
+    assert 'MelodicIntervals' not in piece.analyses.entries()['Name'].tolist()
+    piece.clear_cache()
+    assert len(piece.analyses) == piece.cache_info()['bytes'] == 0
+
+
+def test_analysis_cache_reads_check_expiry():
+    from . import analysis_cache
+
+    cache = analysis_cache.AnalysisCache(max_bytes=0, ttl=60)
+    cache['A'] = 1
+    cache['B'] = 2
+    cache._entries['A'].stored -= 120
+    cache._entries['B'].stored -= 120
+    with pytest.raises(KeyError):
+        cache['A']
+    assert cache.get('B') is None
+    assert len(cache) == 0 and cache.evictions == 2
+
+
+def test_analysis_cache_get_survives_eviction_by_other_caches(monkeypatch):
+    from . import analysis_cache
+
+    monkeypatch.setattr(analysis_cache, 'MAX_TOTAL_BYTES', None)
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    expected = piece.markFourths()
+    piece.clear_cache()
+    # every store evicts everything else, in this cache or any other
+    monkeypatch.setattr(analysis_cache, 'MAX_TOTAL_BYTES', 1)
+    pd.testing.assert_frame_equal(piece.markFourths(), expected)
+    assert piece.durations().notnull().any().any()
+
+
+def test_analysis_cache_sizes_object_columns_from_a_sample(monkeypatch):
+    from . import analysis_cache
+
+    monkeypatch.setattr(analysis_cache, 'SIZE_SAMPLE', 10)
+    notes = [note.Note('C4') for _ in range(1000)]
+    ser = pd.Series(notes + [np.nan] * 1000)
+    # the 10 items sampled are 5 notes and 5 NaNs, each standing for 200 items
+    sampled = 5 * analysis_cache.M21_OBJECT_BYTES + 5 * sys.getsizeof(np.nan)
+    assert analysis_cache.sizeof(ser) == ser.memory_usage(deep=False) + 200 * sampled
+
+
+def test_memoized_analyses_share_canonical_keys():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    mel = piece.melodic('Semitones')
+    assert piece.melodic('c') is mel
+    assert ('MelodicIntervals', 'c', True, True, True) in piece.analyses
+
+
+def test_memoized_analyses_ignore_the_cache_for_a_df_of_their_own():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    mel = piece.melodic('c')
+    assert piece.melodic('c', df=piece.notes()) is not mel
+
+
+def test_memoized_analyses_cache_each_parameter_set():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    ratios = piece.durationalRatios()
+    assert piece.durationalRatios() is ratios
+    assert piece.durationalRatios(end=False) is not ratios
+    assert ('DurationalRatios', True) in piece.analyses
+
+
+def test_invalidate_drops_only_the_dependents():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    mel = piece.melodic('c')
+    piece.durationalRatios()
+    piece.durationalRatios(end=False)
+    piece.lyrics()
+    piece.fermatas()
+    assert piece.invalidate('Notes') == 6  # 2 notes tables, durations, melodic intervals, 2 ratios
+    names = set(piece.analyses.entries()['Name'])
+    assert {'Lyrics', 'Fermatas', 'PitchArrays'} <= names
+    assert not names & {'Notes', 'Duration', 'DurationalRatios', 'MelodicIntervals'}
+    assert piece.melodic('c').equals(mel)
+
+
+def test_dependents_follow_the_declared_graph():
+    assert analysis_cache.dependents('Notes') >= {'Notes', 'MelodicIntervals', 'CVF', 'Cadences'}
+
+
+def test_pickled_pieces_cache_the_frozen_score():
+    import pickle
+
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    assert pickle.loads(pickle.dumps(piece)).notes().equals(piece.notes())
+    assert 'FrozenScore' in piece.analyses.entries()['Name'].tolist()
+
+
+def test_invalidating_the_score_drops_the_frozen_score():
+    import pickle
+
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    pickle.dumps(piece)
+    piece.notes()
+    piece.invalidate('Score')
+    assert not set(piece.analyses.entries()['Name']) & {'FrozenScore', 'FlatParts', 'Notes'}
+
+
+def test_pickled_pieces_send_the_current_score():
+    import pickle
+    from music21 import note
+
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    pickle.dumps(piece)
+    piece.score.parts[0].append(note.Note('E5', quarterLength=1))
+    piece.invalidate('Score')
+    assert pickle.loads(pickle.dumps(piece)).notes().iloc[:, 0].tolist() == ['C5', 'D5', 'E5']
+
+
+def test_notes_variants_are_cached_and_handed_out_as_copies():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    nr = piece.notes()
+    assert ('Notes', True, False) in piece.analyses
+    nr.iloc[0, 0] = 'Rest'
+    assert piece.notes().iloc[0, 0] == 'C5'
+
+
+def test_notes_combine_unisons_matches_the_column_helper():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    assert piece.notes(combineUnisons=True).equals(piece.notes().apply(piece._combineUnisons))
+
+
+def test_notes_share_memory_under_copy_on_write():
+    piece = ImportedPiece(_make_two_part_score_with_key_signatures(), 'test.xml')
+    with pd.option_context('mode.copy_on_write', True):
+        nr = piece.notes()
+        assert np.shares_memory(nr['Part-1'].to_numpy(), piece._notes()['Part-1'].to_numpy())
+        nr.iloc[0, 0] = 'Rest'
+        assert piece._notes().iloc[0, 0] == 'C5'
+
+
+def _musicxml_text(tmp_path):
+    path = str(tmp_path / 'cached.musicxml')
+    _make_two_part_score_with_key_signatures().write('musicxml', fp=path)
+    with open(path) as file:
+        return file.read()
+
+
+def test_import_score_disk_cache_round_trip(tmp_path):
+    text = _musicxml_text(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+
+    cold = importScore(text, cache_dir=cache_dir)
+    del pathDict[text]
+    warm = importScore(text, cache_dir=cache_dir)
+    del pathDict[text]
+
+    assert warm is not cold
+    assert len(list((tmp_path / 'cache').rglob('*.pkl'))) == 1
+    assert warm.metadata == cold.metadata
+    pd.testing.assert_frame_equal(warm.notes(), cold.notes())
+    pd.testing.assert_frame_equal(warm.measures(), cold.measures())
+    pd.testing.assert_frame_equal(warm.melodic(), cold.melodic())
+
+
+def test_import_score_cold_keeps_the_parsed_score(tmp_path, monkeypatch):
+    from . import main_objs
+
+    text = _musicxml_text(tmp_path)
+    parsed = []
+    original = main_objs.converter.parse
+
+    def parse(*args, **kwargs):
+        parsed.append(original(*args, **kwargs))
+        return parsed[-1]
+    monkeypatch.setattr(main_objs.converter, 'parse', parse)
+    cold = importScore(text, cache_dir=str(tmp_path / 'cache'))
+    del pathDict[text]
+    assert cold.score is parsed[0]
+    # nothing is computed ahead of time
+    assert 'Measure' not in cold.analyses.entries()['Name'].tolist()
+
+
+def test_import_score_warm_skips_the_parser(tmp_path, monkeypatch):
+    from . import main_objs
+
+    text = _musicxml_text(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    importScore(text, cache_dir=cache_dir)
+    del pathDict[text]
+    monkeypatch.setattr(main_objs.converter, 'parse', None)
+    warm = importScore(text, cache_dir=cache_dir)
+    del pathDict[text]
+    assert warm.notes().iloc[0].tolist() == ['C5', 'C3']
+
+
+def test_import_score_leaves_local_musicxml_to_music21(tmp_path):
+    path = str(tmp_path / 'local.musicxml')
+    _make_two_part_score_with_key_signatures().write('musicxml', fp=path)
+    importScore(path, cache_dir=str(tmp_path / 'cache'))
+    del pathDict[path]
+    assert not list(tmp_path.rglob('*.pkl'))
+
+
+def _parallel_corpus(tmp_path):
+    paths = []
+    for name in ('b_piece', 'a_piece'):
+        path = str(tmp_path / (name + '.musicxml'))
+        _make_two_part_score_with_key_signatures().write('musicxml', fp=path)
+        paths.append(path)
+    paths.insert(1, str(tmp_path / 'missing.mei'))
+
+    corpus = CorpusBase(paths, workers=2)
+    for path in paths:
+        pathDict.pop(path, None)
+    return corpus
+
+
+def test_corpus_parallel_import_keeps_order_and_skips_missing_files(tmp_path):
+    corpus = _parallel_corpus(tmp_path)
+    assert [piece.file_name for piece in corpus.scores] == ['b_piece', 'a_piece']
+
+
+def test_corpus_parallel_import_returns_usable_pieces(tmp_path):
+    corpus = _parallel_corpus(tmp_path)
+    assert corpus.scores[0].notes().iloc[0].tolist() == ['C5', 'C3']
+
+
+def test_batch_workers_match_serial_results():
+    corpus = CorpusBase([ImportedPiece(_make_two_part_score_with_key_signatures(), name)
+                         for name in ('one.xml', 'two.xml')])
+    mel = corpus.batch(ImportedPiece.melodic, metadata=False)
+    serial = corpus.batch(ImportedPiece.ngrams, kwargs={'n': 1, 'df': mel})
+    for backend in ('process', 'thread'):
+        parallel = corpus.batch(ImportedPiece.ngrams, kwargs={'n': 1, 'df': mel}, n_jobs=2, backend=backend)
+        for expected, result in zip(serial, parallel):
+            pd.testing.assert_frame_equal(expected, result)
+
+
+class _MeiServer:
+    """Serve `directory` over http on localhost, recording each response code."""
+
+    def __init__(self, directory):
+        import functools
+        import http.server
+        import threading
+
+        codes = self.codes = []
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            def send_response(self, code, message=None):
+                codes.append(code)
+                super().send_response(code, message)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      functools.partial(Handler, directory=str(directory)))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/piece.mei'.format(self.server.server_address[1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _served_mei(tmp_path):
+    served = tmp_path / 'served'
+    served.mkdir()
+    (served / 'piece.mei').write_text('<mei/>')
+    return served, str(tmp_path / 'mirror')
+
+
+def test_remote_fetch_revalidates_against_mirror(tmp_path):
+    from . import remote
+
+    served, mirror = _served_mei(tmp_path)
+    with _MeiServer(served) as server:
+        assert remote.fetch_text(server.url, mirror=mirror) == '<mei/>'
+        assert remote.fetch_text(server.url, mirror=mirror) == '<mei/>'
+    assert server.codes == [200, 304]
+
+
+def test_remote_fetch_all_returns_errors_in_place(tmp_path):
+    from . import remote
+
+    served, mirror = _served_mei(tmp_path)
+    with _MeiServer(served) as server:
+        texts = remote.fetch_all([server.url, server.url + '.missing'], mirror=mirror)
+    assert texts[0] == '<mei/>'
+    assert isinstance(texts[1], Exception)
+
+
+def test_remote_fetch_does_not_serve_removed_scores_from_mirror(tmp_path):
+    from . import remote
+
+    served, mirror = _served_mei(tmp_path)
+    with _MeiServer(served) as server:
+        remote.fetch_text(server.url, mirror=mirror)
+        (served / 'piece.mei').unlink()
+        with pytest.raises(remote.httpx.HTTPStatusError):
+            remote.fetch_text(server.url, mirror=mirror)
+    assert server.codes == [200, 404]
+
+
+def test_remote_fetch_falls_back_to_mirror_when_server_is_gone(tmp_path, monkeypatch):
+    from . import remote
+
+    served, mirror = _served_mei(tmp_path)
+    with _MeiServer(served) as server:
+        remote.fetch_text(server.url, mirror=mirror)
+    monkeypatch.setattr(remote, 'BACKOFF', 0)
+    assert remote.fetch_text(server.url, mirror=mirror) == '<mei/>'
+
+
+def test_remote_mirror_paths_stay_inside_the_mirror(tmp_path):
+    from . import remote
+
+    mirror = str(tmp_path / 'mirror')
+    assert remote._mirror_path(mirror, 'http://host/a/../../../etc/passwd') is None
+    assert remote._mirror_path(mirror, 'http://host/a/./b.mei') == os.path.join(mirror, 'host', 'a', 'b.mei')
+
+
 def test_get_semi_flat_parts_name():
     """
     Make sure that we could have correct names for each part.